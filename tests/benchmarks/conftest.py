@@ -0,0 +1,20 @@
+"""Benchmarks of theatre's hot paths on synthetic scenes; needs pytest-benchmark.
+
+Skipped in the regular test run: pass --benchmark-only to run them (see the
+'bench' tox environment, which also compares against the previous runs).
+"""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# for sample_charm
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def pytest_ignore_collect(collection_path, config):
+    try:
+        return not config.getoption("benchmark_only")
+    except ValueError:  # pytest-benchmark isn't installed
+        return True
@@ -0,0 +1,99 @@
+"""Measure how long interactions keep the Qt event loop from doing anything else.
+
+The interaction runs inside a real event loop, alongside a heartbeat timer that
+repaints the view every FRAME_INTERVAL, the way a display would refresh it.
+    - stalls: the time between the end of a heartbeat and the start of the next
+      one; when idle, that's FRAME_INTERVAL. The longest one, minus
+      FRAME_INTERVAL, is how long the interaction blocked the event loop.
+    - frames: how long each repaint took.
+"""
+
+import os
+import time
+import typing
+from dataclasses import dataclass, field
+
+from qtpy.QtCore import QEventLoop, Qt, QTimer
+from qtpy.QtWidgets import QAbstractScrollArea
+
+FRAME_INTERVAL = 0.016
+"""Seconds between two heartbeats: one frame at ~60Hz."""
+SETTLE_FRAMES = 3
+"""Heartbeats to wait for once the interaction returns, for deferred work to run."""
+TIMEOUT = 120.0
+# slower machines can scale all latency budgets up
+BUDGET_SCALE = float(os.getenv("THEATRE_BENCH_LATENCY_SCALE", 1.0))
+
+
+@dataclass
+class Latency:
+    stalls: typing.List[float] = field(default_factory=list)
+    frames: typing.List[float] = field(default_factory=list)
+
+    @property
+    def blocked(self) -> float:
+        """The longest time the event loop was kept busy."""
+        return max(max(self.stalls, default=0.0) - FRAME_INTERVAL, 0.0)
+
+    @property
+    def worst_frame(self) -> float:
+        return max(self.frames, default=0.0)
+
+    def percentile_frame(self, percent: float = 95) -> float:
+        if not self.frames:
+            return 0.0
+        frames = sorted(self.frames)
+        return frames[min(int(len(frames) * percent / 100), len(frames) - 1)]
+
+
+def measure(view: QAbstractScrollArea, interaction: typing.Callable) -> Latency:
+    """Run interaction in the event loop, repainting view at every heartbeat."""
+    latency = Latency()
+    loop = QEventLoop()
+    viewport = view.viewport()
+    settled = 0
+    done = False
+    error = None
+    last = time.perf_counter()
+
+    def heartbeat():
+        nonlocal last, settled
+        start = time.perf_counter()
+        latency.stalls.append(start - last)
+        viewport.repaint()
+        last = time.perf_counter()
+        latency.frames.append(last - start)
+        if done:
+            settled += 1
+            if settled >= SETTLE_FRAMES:
+                loop.quit()
+
+    def interact():
+        nonlocal done, error
+        try:
+            interaction()
+        except BaseException as e:  # the event loop would swallow it
+            error = e
+        done = True
+
+    timer = QTimer()
+    timer.setTimerType(Qt.PreciseTimer)
+    timer.setInterval(int(FRAME_INTERVAL * 1000))
+    timer.timeout.connect(heartbeat)
+    timeout = QTimer()
+    timeout.setSingleShot(True)
+    timeout.timeout.connect(loop.quit)
+
+    timer.start()
+    timeout.start(int(TIMEOUT * 1000))
+    # a heartbeat first, so the stall the interaction causes has a start
+    QTimer.singleShot(int(FRAME_INTERVAL * 1000) + 1, interact)
+    loop.exec_()
+    timer.stop()
+    timeout.stop()
+
+    if error is not None:
+        raise error
+    if not done:
+        raise TimeoutError(f"interaction still running after {TIMEOUT}s")
+    return latency
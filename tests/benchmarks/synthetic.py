@@ -0,0 +1,174 @@
+"""Synthetic scenes, as serialized by TheatreScene.serialize, for the benchmarks.
+
+Scenes run against tests/sample_charm.py: every event edge is one the dummy charm
+observes, and relations use its 'foo' endpoint.
+"""
+
+import itertools
+import os
+import typing
+from pathlib import Path
+
+import yaml
+from scenario import Container, Relation, State
+
+from theatre.scenario_json import dump_state
+
+_ids = itertools.count(1)
+
+SIZES = (10, 100, 1000, 10000)
+# evaluating means running the charm once per node: this is as far as we go
+EVALUATION_SIZES = (10, 100, 1000)
+# to keep quick runs quick
+MAX_NODES = int(os.getenv("THEATRE_BENCH_MAX_NODES", 10000))
+
+EVENTS = ("install", "config_changed", "start", "update_status")
+
+
+def sizes(candidates: typing.Sequence[int] = SIZES) -> typing.List[int]:
+    return [size for size in candidates if size <= MAX_NODES]
+
+
+def heavy_state(relations: int = 10, databag_keys: int = 100) -> State:
+    """A state with several relations, each with large databags."""
+    return State(
+        leader=True,
+        relations=[
+            Relation(
+                "foo",
+                remote_app_name=f"remote-{r}",
+                local_app_data={f"key-{i}": "x" * 64 for i in range(databag_keys)},
+                remote_app_data={f"key-{i}": "y" * 64 for i in range(databag_keys)},
+                remote_units_data={
+                    unit: {f"key-{i}": "z" * 64 for i in range(databag_keys)}
+                    for unit in range(3)
+                },
+            )
+            for r in range(relations)
+        ],
+    )
+
+
+def _node(custom_state: typing.Optional[State] = None, n: int = 0) -> dict:
+    node = {
+        "id": next(_ids),
+        "title": "State",
+        "pos_x": 0.0,
+        "pos_y": 0.0,
+        "inputs": [],
+        "outputs": [
+            {
+                "id": next(_ids),
+                "index": 0,
+                "multi_edges": True,
+                "position": 5,
+                "socket_type": 2,
+            }
+        ],
+        "content": {"value": f"state {n}"},
+        "name": "State",
+        "value": f"state {n}",
+        "deltas_source": None,
+    }
+    if custom_state is not None:
+        node["custom-state"] = dump_state(custom_state)
+    else:
+        # custom nodes have no input socket; all others do
+        node["inputs"].append(
+            {
+                "id": next(_ids),
+                "index": 0,
+                "multi_edges": False,
+                "position": 2,
+                "socket_type": 1,
+            }
+        )
+    return node
+
+
+def _edge(parent: dict, child: dict, event: str) -> dict:
+    return {
+        "id": next(_ids),
+        "edge_type": 1,
+        "start": parent["outputs"][0]["id"],
+        "end": child["inputs"][0]["id"],
+        "event_spec": {
+            "event": {
+                "path": event,
+                "args": [],
+                "kwargs": {},
+                "storage": None,
+                "relation": None,
+                "relation_remote_unit_id": None,
+                "secret": None,
+                "container": None,
+                "action": None,
+                "_owner_path": [],
+            },
+            "env": {},
+        },
+    }
+
+
+def _scene(nodes: typing.List[dict], edges: typing.List[dict]) -> dict:
+    return {
+        "id": next(_ids),
+        "scene_width": 64000,
+        "scene_height": 64000,
+        "nodes": nodes,
+        "edges": edges,
+    }
+
+
+def chain(size: int, root_state: typing.Optional[State] = None) -> dict:
+    """A single trace: a custom root and size-1 events, one after the other."""
+    nodes = [_node(root_state or State(leader=True))]
+    edges = []
+    for n in range(1, size):
+        node = _node(n=n)
+        edges.append(_edge(nodes[-1], node, EVENTS[n % len(EVENTS)]))
+        nodes.append(node)
+    return _scene(nodes, edges)
+
+
+def fanout(size: int, root_state: typing.Optional[State] = None) -> dict:
+    """A custom root with size-1 children, one event away from it each."""
+    root = _node(root_state or State(leader=True))
+    nodes = [root]
+    edges = []
+    for n in range(1, size):
+        node = _node(n=n)
+        edges.append(_edge(root, node, EVENTS[n % len(EVENTS)]))
+        nodes.append(node)
+    return _scene(nodes, edges)
+
+
+def heavy_custom_states(size: int) -> dict:
+    """Size unconnected custom nodes, each with a heavy_state."""
+    # the states are all alike: encode one, and share it
+    encoded = dump_state(heavy_state())
+    nodes = []
+    for n in range(size):
+        node = _node(State(), n)
+        node["custom-state"] = encoded
+        nodes.append(node)
+    return _scene(nodes, [])
+
+
+def make_vfs_repo(root: Path, files: int, file_size: int, container="workload"):
+    """A charm repo whose 'default' situation mounts files*file_size bytes."""
+    (root / "src").mkdir(parents=True)
+    (root / "src" / "charm.py").write_text("")
+    (root / "metadata.yaml").write_text(
+        f"name: dummy\ncontainers:\n  {container}: {{}}\n"
+    )
+    container_dir = root / ".theatre" / "virtual_fs" / "default" / container
+    src = container_dir / "etc"
+    for n in range(files):
+        subdir = src / f"dir-{n % 16}"
+        subdir.mkdir(parents=True, exist_ok=True)
+        (subdir / f"file-{n}.yaml").write_bytes(b"x" * file_size)
+    (container_dir / "spec.yaml").write_text(
+        yaml.safe_dump({container: {"mounts": {"/etc/workload": "etc"}}})
+    )
+    return State(containers=[Container(container, can_connect=True)])
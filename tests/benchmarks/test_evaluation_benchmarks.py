@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import pytest
+
+import synthetic
+from theatre.charm_repo_tools import CharmRepo
+from theatre.trace_tree_widget.state_node import add_simulated_fs_from_repo
+
+SHAPES = {"chain": synthetic.chain, "fanout": synthetic.fanout}
+ROOT_STATES = {"light": None, "heavy": synthetic.heavy_state}
+
+
+def _load(scene, shape, size, root_state):
+    make_state = ROOT_STATES[root_state]
+    scene.deserialize(SHAPES[shape](size, make_state() if make_state else None))
+    return list(scene.nodes)
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(synthetic.EVALUATION_SIZES))
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("root_state", ROOT_STATES)
+def test_full_evaluation(benchmark, scene, shape, size, root_state):
+    nodes = _load(scene, shape, size, root_state)
+
+    def mark_dirty():
+        for node in nodes:
+            node.markDirty(True)
+
+    benchmark.pedantic(
+        scene._evaluate_batch, args=(nodes,), setup=mark_dirty, rounds=3, iterations=1
+    )
+    assert all(node.value and node.value.state for node in nodes)
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(synthetic.EVALUATION_SIZES))
+@pytest.mark.parametrize("root_state", ROOT_STATES)
+def test_trace_inspector_display(benchmark, main_window, scene, size, root_state):
+    nodes = _load(scene, "chain", size, root_state)
+    scene._evaluate_batch(nodes)
+    leaf = next(node for node in nodes if not node.getChildrenNodes())
+    inspector = main_window._trace_inspector
+
+    def display_root():
+        # displaying the node that's already displayed is a no-op
+        inspector.display(nodes[0])
+
+    benchmark.pedantic(
+        inspector.display, args=(leaf,), setup=display_root, rounds=10, iterations=1
+    )
+
+
+@pytest.mark.parametrize(
+    "files, file_size",
+    # many small files, a few big ones
+    ((100, 2**10), (10000, 2**10), (10, 2**20), (100, 2**20)),
+)
+def test_add_simulated_fs(benchmark, tmp_path, files, file_size):
+    state = synthetic.make_vfs_repo(tmp_path / "repo", files, file_size)
+    repo = CharmRepo(tmp_path / "repo")
+    vfs_root = tmp_path / "vfs"
+    vfs_root.mkdir()
+
+    state_in = benchmark.pedantic(
+        add_simulated_fs_from_repo,
+        args=(state, repo),
+        kwargs={"root_vfs": str(vfs_root)},
+        rounds=3,
+        iterations=1,
+    )
+    (container,) = state_in.containers
+    (mount,) = container.mounts.values()
+    assert len(list(Path(mount.src).rglob("*.yaml"))) == files
@@ -0,0 +1,251 @@
+"""How long interactions with the node editor block the GUI; see latency.py.
+
+Each benchmark fails if the interaction blocks the event loop for longer than its
+budget, or if the view takes longer than its frame budget to repaint (95th
+percentile). Budgets are about twice what they take today, and grow with the size
+of the scene and of what's added to it; THEATRE_BENCH_LATENCY_SCALE scales them
+all, for slower machines.
+"""
+
+import json
+
+import pytest
+from qtpy.QtCore import QByteArray, QDataStream, QIODevice, QMimeData, QPoint, Qt
+from qtpy.QtGui import QDropEvent, QWheelEvent
+from qtpy.QtTest import QTest
+from qtpy.QtWidgets import QApplication
+from scenario import Event, Relation, State
+
+import synthetic
+from latency import BUDGET_SCALE, Latency, measure
+from theatre.dialogs.event_dialog import EventSpec
+from theatre.trace_tree_widget.event_edge import EventEdge
+from theatre.trace_tree_widget.library_widget import (
+    CATALOGUE,
+    DynamicSubtreeName,
+    SubtreeSpec,
+    get_mimetype,
+    get_spec,
+)
+from theatre.trace_tree_widget.state_node import StateNode
+from theatre.trace_tree_widget.utils import autolayout
+
+GUI_SIZES = (100, 1000)
+"""How many nodes the scenes we interact with have."""
+PAYLOAD_SIZES = (10, 100)
+"""How many nodes the subtrees we drop and paste have."""
+ROUNDS = 3
+
+
+def _frame_budget(size: int) -> float:
+    # nodeeditor's scenes have no item index: each repaint goes through all items
+    return (0.02 + 0.0002 * size) * BUDGET_SCALE
+
+
+@pytest.fixture
+def editor(main_window):
+    main_window.resize(1600, 1000)
+    main_window.show()
+    QApplication.processEvents()
+    return main_window.current_node_editor
+
+
+def _load_fanout(editor, size: int, root_state: State = None):
+    """Load a laid out fan-out; returns the root and its last child."""
+    scene = editor.scene
+    scene.clear()
+    scene.deserialize(synthetic.fanout(size, root_state))
+    root = next(node for node in scene.nodes if node.is_root)
+    autolayout(root)
+    leaf = root.getChildrenNodes()[-1]
+    QApplication.processEvents()
+    return root, leaf
+
+
+def _view_pos(editor, node: StateNode) -> QPoint:
+    """Where node is in the view, scrolling to it if necessary."""
+    view = editor.view
+    view.centerOn(node.grNode)
+    return view.mapFromScene(node.grNode.sceneBoundingRect().center())
+
+
+def _run(benchmark, editor, setup, interaction, size: int, budget: float) -> Latency:
+    """Benchmark the interaction, and check it stays within its budget."""
+    latencies = []
+
+    def interact(*args):
+        latency = measure(editor.view, lambda: interaction(*args))
+        latencies.append(latency)
+        return latency
+
+    def _setup():
+        return setup(), {}
+
+    benchmark.pedantic(interact, setup=_setup, rounds=ROUNDS, iterations=1)
+
+    blocked = max(latency.blocked for latency in latencies)
+    frame = max(latency.percentile_frame(95) for latency in latencies)
+    benchmark.extra_info.update(blocked=blocked, frame_p95=frame)
+    assert (
+        blocked <= budget * BUDGET_SCALE
+    ), f"blocked the event loop for {blocked:.3f}s"
+    assert frame <= _frame_budget(size), f"95th percentile frame took {frame:.3f}s"
+    return latencies[-1]
+
+
+def _drop(editor, entry, pos: QPoint):
+    data = QByteArray()
+    QDataStream(data, QIODevice.WriteOnly).writeQString(entry.name)
+    mime_data = QMimeData()
+    mime_data.setData(get_mimetype(entry), data)
+    event = QDropEvent(pos, Qt.MoveAction, mime_data, Qt.LeftButton, Qt.NoModifier)
+    editor.view.dropEvent(event)
+
+
+@pytest.fixture(params=PAYLOAD_SIZES)
+def subtree_spec(request):
+    size = request.param
+    spec = SubtreeSpec(name=f"benchmark chain of {size}", graph=synthetic.chain(size))
+    CATALOGUE.append(spec)
+    yield spec
+    CATALOGUE.remove(spec)
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(GUI_SIZES))
+def test_drop_subtree(benchmark, editor, subtree_spec, size):
+    payload = len(subtree_spec.graph["nodes"])
+
+    def setup():
+        _, leaf = _load_fanout(editor, size)
+        return (_view_pos(editor, leaf),)
+
+    _run(
+        benchmark,
+        editor,
+        setup,
+        lambda pos: _drop(editor, subtree_spec, pos),
+        size,
+        budget=0.25 + 0.001 * size + 0.03 * payload,
+    )
+    assert len(editor.scene.nodes) == size + payload - 1
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(GUI_SIZES))
+@pytest.mark.parametrize(
+    "name", (DynamicSubtreeName.FAN_OUT, DynamicSubtreeName.RELATION_LIFECYCLE)
+)
+def test_drop_dynamic_subtree(benchmark, editor, name, size):
+    spec = get_spec(name)
+    # the relation lifecycle needs exactly one relation, or it asks which one
+    root_state = State(leader=True, relations=[Relation("foo")])
+
+    def setup():
+        _, leaf = _load_fanout(editor, size, root_state)
+        return (_view_pos(editor, leaf),)
+
+    _run(
+        benchmark,
+        editor,
+        setup,
+        lambda pos: _drop(editor, spec, pos),
+        size,
+        budget=0.5 + 0.003 * size,
+    )
+    assert len(editor.scene.nodes) > size
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(GUI_SIZES))
+@pytest.mark.parametrize("payload", synthetic.sizes(PAYLOAD_SIZES))
+def test_paste(benchmark, main_window, editor, size, payload):
+    clipboard = QApplication.clipboard()
+
+    def setup():
+        _load_fanout(editor, size)
+        clipboard.setText(json.dumps(synthetic.chain(payload)))
+        return ()
+
+    _run(
+        benchmark,
+        editor,
+        setup,
+        main_window.onEditPaste,
+        size,
+        budget=0.25 + 0.001 * size + 0.03 * payload,
+    )
+    assert len(editor.scene.nodes) == size + payload
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(GUI_SIZES))
+def test_connect_edge(benchmark, editor, size):
+    scene = editor.scene
+
+    def setup():
+        _, leaf = _load_fanout(editor, size)
+        leaf.eval()
+        return leaf, StateNode(scene)
+
+    def connect(leaf, node):
+        # connecting the new node evaluates it, greedily
+        EventEdge(
+            scene,
+            leaf.output_socket,
+            node.input_socket,
+            event_spec=EventSpec(Event("update_status"), {}),
+        )
+        assert node.value and node.value.state
+
+    _run(benchmark, editor, setup, connect, size, budget=0.1 + 0.0005 * size)
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(GUI_SIZES))
+def test_click_node(benchmark, main_window, editor, size):
+    clicked = []
+
+    def setup():
+        _, leaf = _load_fanout(editor, size)
+        clicked.append(leaf)
+        view = editor.view
+        view.centerOn(leaf.grNode)
+        # the content's margin: the line edit in the middle takes clicks for itself
+        corner = leaf.grNode.grContent.sceneBoundingRect().topLeft()
+        return (view.mapFromScene(corner) + QPoint(5, 5),)
+
+    def click(pos):
+        QTest.mouseClick(editor.view.viewport(), Qt.LeftButton, Qt.NoModifier, pos)
+
+    _run(benchmark, editor, setup, click, size, budget=0.1 + 0.0005 * size)
+    # clicking displays the node's trace in the inspector
+    assert main_window._trace_inspector.trace_view._state_node is clicked[-1]
+
+
+def _wheel(view, delta: int):
+    pos = view.viewport().rect().center()
+    event = QWheelEvent(
+        pos,
+        view.viewport().mapToGlobal(pos),
+        QPoint(),
+        QPoint(0, delta),
+        Qt.NoButton,
+        Qt.ControlModifier,
+        Qt.NoScrollPhase,
+        False,
+    )
+    view.wheelEvent(event)
+
+
+@pytest.mark.parametrize("size", synthetic.sizes(GUI_SIZES + (10000,)))
+def test_zoom(benchmark, editor, size):
+    view = editor.view
+
+    def setup():
+        root, _ = _load_fanout(editor, size)
+        view.centerOn(root.grNode)
+        return ()
+
+    def zoom_out_and_in():
+        # all the way out, where the whole scene needs drawing, and back
+        for delta in (-120,) * 5 + (120,) * 5:
+            _wheel(view, delta)
+            view.viewport().repaint()
+
+    _run(benchmark, editor, setup, zoom_out_and_in, size, budget=0.25 + 0.002 * size)
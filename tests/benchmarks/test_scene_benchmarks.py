@@ -0,0 +1,45 @@
+import pytest
+
+import synthetic
+from theatre import config
+from theatre.theatre_scene import read_scene_file, write_scene_file
+from theatre.trace_tree_widget.utils import autolayout
+
+SHAPES = {
+    "chain": synthetic.chain,
+    "fanout": synthetic.fanout,
+    "heavy": synthetic.heavy_custom_states,
+}
+
+
+@pytest.mark.parametrize("size", synthetic.sizes())
+@pytest.mark.parametrize("shape", SHAPES)
+def test_load(benchmark, scene, shape, size):
+    data = SHAPES[shape](size)
+    benchmark.pedantic(
+        scene.deserialize, args=(data,), setup=scene.clear, rounds=3, iterations=1
+    )
+    assert len(scene.nodes) == size
+
+
+@pytest.mark.parametrize("size", synthetic.sizes())
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("scene_format", ("json", "packed"))
+def test_save(benchmark, scene, shape, size, scene_format, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SCENE_FORMAT", scene_format)
+    scene.deserialize(SHAPES[shape](size))
+    filename = str(tmp_path / f"scene{config.SCENE_EXTENSION}")
+
+    def save():
+        write_scene_file(scene.serialize(), filename)
+
+    benchmark.pedantic(save, rounds=3, iterations=1)
+    assert len(read_scene_file(filename)["nodes"]) == size
+
+
+@pytest.mark.parametrize("size", synthetic.sizes())
+@pytest.mark.parametrize("shape", ("chain", "fanout"))
+def test_autolayout(benchmark, scene, shape, size):
+    scene.deserialize(SHAPES[shape](size))
+    root = next(node for node in scene.nodes if node.is_root)
+    benchmark.pedantic(autolayout, args=(root,), rounds=3, iterations=1)
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+# for the tests that need a main window, and the scenes in it
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+
+@pytest.fixture(scope="session")
+def main_window():
+    from qtpy.QtWidgets import QApplication
+
+    from sample_charm import charm_context
+    from theatre.main_window import TheatreMainWindow
+
+    app = QApplication.instance() or QApplication([])
+    TheatreMainWindow.RESTORE_ON_OPEN = False
+    window = TheatreMainWindow()
+    window._update_charm_context(charm_context())
+    yield window
+    window.current_node_editor.scene.clear()
+    app.processEvents()
+
+
+@pytest.fixture
+def scene(main_window):
+    scene = main_window.current_node_editor.scene
+    scene.clear()
+    yield scene
+    scene.clear()
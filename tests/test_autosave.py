@@ -0,0 +1,93 @@
+import json
+
+from theatre.autosave import (
+    atomic_write,
+    discard_autosave,
+    has_autosave,
+    journal_path,
+    recover,
+    snapshot_path,
+)
+
+
+def _base():
+    return {
+        "id": 1,
+        "nodes": [{"id": 10, "title": "a"}, {"id": 20, "title": "b"}],
+        "edges": [{"id": 30, "start": 11, "end": 21}],
+    }
+
+
+def _write_journal(scene_file, *records):
+    journal_path(scene_file).write_text(
+        "".join(json.dumps(record) + "\n" for record in records)
+    )
+
+
+def test_paths(tmp_path):
+    scene_file = tmp_path / "foo.theatre"
+    assert journal_path(scene_file) == tmp_path / ".foo.theatre.journal"
+    assert snapshot_path(scene_file) == tmp_path / ".foo.theatre.autosave"
+    assert not has_autosave(scene_file)
+
+
+def test_recover_from_journal(tmp_path):
+    scene_file = tmp_path / "foo.theatre"
+    _write_journal(
+        scene_file,
+        {"seq": 1, "nodes": {"10": {"id": 10, "title": "A"}}, "edges": {}},
+        {"seq": 2, "nodes": {"20": None, "40": {"id": 40}}, "edges": {"30": None}},
+    )
+    assert has_autosave(scene_file)
+    recovered = recover(scene_file, _base())
+    assert recovered["nodes"] == [{"id": 10, "title": "A"}, {"id": 40}]
+    assert recovered["edges"] == []
+
+
+def test_recover_skips_records_in_snapshot(tmp_path):
+    scene_file = tmp_path / "foo.theatre"
+    snapshot = {**_base(), "nodes": [{"id": 10, "title": "snap"}]}
+    snapshot_path(scene_file).write_text(json.dumps({"seq": 2, "scene": snapshot}))
+    _write_journal(
+        scene_file,
+        {"seq": 2, "nodes": {"10": {"id": 10, "title": "old"}}, "edges": {}},
+        {"seq": 3, "nodes": {"50": {"id": 50}}, "edges": {}},
+    )
+    recovered = recover(scene_file, _base())
+    assert recovered["nodes"] == [{"id": 10, "title": "snap"}, {"id": 50}]
+
+
+def test_recover_full_record(tmp_path):
+    scene_file = tmp_path / "foo.theatre"
+    _write_journal(
+        scene_file,
+        {"seq": 1, "nodes": {"60": {"id": 60}}, "edges": {}, "full": True},
+    )
+    recovered = recover(scene_file, _base())
+    assert recovered["nodes"] == [{"id": 60}]
+    assert recovered["edges"] == []
+
+
+def test_recover_truncated_journal(tmp_path):
+    scene_file = tmp_path / "foo.theatre"
+    _write_journal(scene_file, {"seq": 1, "nodes": {"20": None}, "edges": {}})
+    with open(journal_path(scene_file), "a") as file:
+        file.write('{"seq": 2, "nodes": {"10": nu')
+    recovered = recover(scene_file, _base())
+    assert recovered["nodes"] == [{"id": 10, "title": "a"}]
+
+
+def test_discard(tmp_path):
+    scene_file = tmp_path / "foo.theatre"
+    _write_journal(scene_file)
+    snapshot_path(scene_file).write_text("{}")
+    discard_autosave(scene_file)
+    assert not has_autosave(scene_file)
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "foo.theatre"
+    path.write_text("old")
+    atomic_write(path, b"new")
+    assert path.read_text() == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["foo.theatre"]
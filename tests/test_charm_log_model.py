@@ -0,0 +1,70 @@
+import re
+
+import pytest
+from qtpy.QtCore import Qt
+from scenario.state import JujuLogLine
+
+from theatre.charm_log_model import CharmLogModel, compile_filter
+
+
+def _rows(model):
+    return [model.data(model.index(row)) for row in range(model.rowCount())]
+
+
+@pytest.fixture
+def model():
+    model = CharmLogModel()
+    model.append(
+        "install",
+        [
+            JujuLogLine("DEBUG", "starting"),
+            JujuLogLine("WARNING", "no db yet\nretrying later"),
+        ],
+    )
+    model.append("start", [JujuLogLine("INFO", "started"), JujuLogLine("TRACE", "x")])
+    return model
+
+
+def test_rows(model):
+    assert _rows(model) == [
+        "DEBUG starting",
+        "WARNING no db yet …",
+        "INFO started",
+        "TRACE x",
+    ]
+    assert model.data(model.index(1), Qt.ToolTipRole) == "no db yet\nretrying later"
+    model.show_sources = True
+    assert model.data(model.index(2)) == "[start] INFO started"
+
+
+@pytest.mark.parametrize(
+    "min_level, text, expected",
+    (
+        ("DEBUG", "", 4),
+        ("INFO", "", 2),
+        ("WARNING", "", 1),
+        ("ERROR", "", 0),
+        ("DEBUG", "START", 3),  # case-insensitive, and matches sources too
+        ("INFO", "^start", 1),
+    ),
+)
+def test_filter(model, min_level, text, expected):
+    model.set_filter(compile_filter(min_level, text))
+    assert model.rowCount() == expected
+    assert model.total == 4
+
+
+def test_invalid_filter():
+    with pytest.raises(re.error):
+        compile_filter("DEBUG", "[")
+
+
+def test_append_and_truncate_filtered(model):
+    model.set_filter(compile_filter("INFO"))
+    model.append("stop", [JujuLogLine("DEBUG", "a"), JujuLogLine("ERROR", "b")])
+    assert _rows(model) == ["WARNING no db yet …", "INFO started", "ERROR b"]
+    model.truncate(2)
+    assert _rows(model) == ["WARNING no db yet …"]
+    assert model.total == 2
+    model.set_filter(compile_filter())
+    assert model.rowCount() == 2
@@ -0,0 +1,92 @@
+import logging
+
+import ops
+import pytest
+from sample_charm import DummyCharm, charm_context
+from scenario import Context, Event, State
+from scenario.consistency_checker import InconsistentScenarioError
+from scenario.runtime import UncaughtCharmError
+
+from theatre.evaluation_timings import EvaluationTimings
+from theatre.trace_tree_widget.scenario_interface import run_scenario
+from theatre.trace_tree_widget.structs import EvaluationTiming
+
+
+def test_heat_and_slowest():
+    timings = EvaluationTimings()
+    assert timings.range is None
+    assert timings.update("a", EvaluationTiming(wall=0.01))
+    # a single node is the fastest and the slowest
+    assert timings.heat("a") == 0
+    assert timings.update("b", EvaluationTiming(wall=1.0))
+    timings.update("c", EvaluationTiming(wall=0.1))
+    assert timings.range == (0.01, 1.0)
+    assert timings.heat("a") == 0
+    assert timings.heat("b") == 1
+    # log scale: 0.1 is halfway between 0.01 and 1
+    assert timings.heat("c") == pytest.approx(0.5)
+    assert timings.heat("d") is None
+    assert [key for key, _ in timings.slowest()] == ["b", "c", "a"]
+    assert [key for key, _ in timings.slowest(1)] == ["b"]
+
+
+def test_update_reports_range_changes():
+    timings = EvaluationTimings()
+    timings.update("a", EvaluationTiming(wall=0.01))
+    timings.update("b", EvaluationTiming(wall=1.0))
+    assert not timings.update("c", EvaluationTiming(wall=0.1))
+    assert timings.discard("b")
+    assert timings.heat("c") == 1
+    assert not timings.discard("b")
+    assert len(timings) == 2
+
+
+def test_run_scenario_timing():
+    output = run_scenario(charm_context(), State(), Event("start"))
+    timing = output.timing
+    assert output.state.unit_status.name in ("active", "blocked", "waiting")
+    assert timing.wall >= timing.consistency + timing.setup + timing.handler
+    assert timing.consistency > 0
+    assert timing.setup > 0
+    assert timing.handler > 0
+    assert timing.other >= 0
+
+
+def test_run_scenario_action():
+    context = Context(DummyCharm, meta={"name": "dummy"}, actions={"do": {}})
+    output = run_scenario(context, State(), Event("do_action"))
+    assert output.state.unit_status.name in ("active", "blocked", "waiting")
+    assert output.timing.handler > 0
+
+
+def test_run_scenario_leaves_root_logger_alone():
+    context = charm_context()
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    first = run_scenario(context, State(), Event("start"))
+    second = run_scenario(context, State(), Event("start"))
+    assert root.handlers == handlers
+    assert root.level == level
+    # each output only has the logs of its own run
+    assert len(second.charm_logs) == len(first.charm_logs)
+
+
+class _FailingCharm(ops.CharmBase):
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        framework.observe(self.on.start, self._on_start)
+
+    def _on_start(self, _):
+        raise KeyError("boom")
+
+
+def test_run_scenario_charm_error():
+    context = Context(charm_type=_FailingCharm, meta={"name": "failing"})
+    # errors in the handlers are reported the way Context.run reports them
+    with pytest.raises(UncaughtCharmError):
+        run_scenario(context, State(), Event("start"))
+
+
+def test_run_scenario_inconsistent():
+    with pytest.raises(InconsistentScenarioError):
+        run_scenario(charm_context(), State(), Event("foo_relation_changed"))
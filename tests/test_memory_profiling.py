@@ -0,0 +1,56 @@
+import tracemalloc
+
+import pytest
+
+from theatre.memory_profiling import format_bytes, grows_monotonically, measure_memory
+
+_kept = []
+
+
+def _allocate():
+    temporary = bytearray(4 * 2**20)  # freed before we return
+    del temporary
+    _kept.append(bytearray(2**20))
+    return "done"
+
+
+def test_measure_memory():
+    result, usage = measure_memory(_allocate)
+    _kept.clear()
+    assert result == "done"
+    assert usage.peak >= 4 * 2**20
+    assert 2**20 <= usage.net < 2 * 2**20
+    top, *_ = usage.top_sites
+    assert top.filename == __file__
+    assert top.size >= 2**20
+    assert not tracemalloc.is_tracing()
+
+
+def test_measure_memory_keeps_tracing_on():
+    tracemalloc.start()
+    try:
+        measure_memory(_allocate)
+        _kept.clear()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize(
+    "peaks, expected",
+    (
+        ([1, 2, 3, 4], True),
+        ([1, 2, 3], False),  # too short to tell
+        ([1, 2, 2, 4], False),
+        ([4, 3, 2, 1], False),
+        ([], False),
+    ),
+)
+def test_grows_monotonically(peaks, expected):
+    assert grows_monotonically(peaks) is expected
+
+
+def test_format_bytes():
+    assert format_bytes(512) == "512B"
+    assert format_bytes(1536) == "1.5KiB"
+    assert format_bytes(-3 * 2**20) == "-3.0MiB"
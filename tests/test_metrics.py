@@ -0,0 +1,141 @@
+import json
+import os
+import urllib.request
+
+import pytest
+from scenario import State
+
+from theatre import metrics, vfs
+from theatre.metrics import Registry, estimate_size, serve
+from theatre.output_cache import OutputCache
+from theatre.trace_tree_widget.structs import StateNodeOutput
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    evaluations = registry.counter("evaluations_total", "Evaluations.", ("event",))
+    evaluations.inc(event="start")
+    evaluations.inc(2, event="install")
+    depth = registry.gauge("queue_depth", "Queued.", ("queue",))
+    depth.set(3, queue="evaluation")
+    depth.set_function(lambda: 7, queue="store")
+    latency = registry.histogram(
+        "latency_seconds", "Latency.", ("event",), buckets=(0.1, 1.0)
+    )
+    for value in (0.05, 0.5, 0.5, 2.0):
+        latency.observe(value, event="start")
+    return registry
+
+
+def test_prometheus_text(registry):
+    lines = registry.to_prometheus().splitlines()
+    assert lines == [
+        "# HELP evaluations_total Evaluations.",
+        "# TYPE evaluations_total counter",
+        'evaluations_total{event="install"} 2',
+        'evaluations_total{event="start"} 1',
+        "# HELP queue_depth Queued.",
+        "# TYPE queue_depth gauge",
+        'queue_depth{queue="evaluation"} 3',
+        'queue_depth{queue="store"} 7',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{event="start",le="0.1"} 1',
+        'latency_seconds_bucket{event="start",le="1"} 3',
+        'latency_seconds_bucket{event="start",le="+Inf"} 4',
+        'latency_seconds_sum{event="start"} 3.05',
+        'latency_seconds_count{event="start"} 4',
+    ]
+
+
+def test_json(registry):
+    data = registry.to_json()
+    assert data["evaluations_total"]["type"] == "counter"
+    assert data["queue_depth"]["values"] == [
+        {"labels": {"queue": "evaluation"}, "value": 3},
+        {"labels": {"queue": "store"}, "value": 7},
+    ]
+    (histogram,) = data["latency_seconds"]["values"]
+    assert histogram["count"] == 4
+    assert histogram["buckets"] == {"0.1": 1, "1": 3, "+Inf": 4}
+    json.dumps(data)
+
+
+def test_labels_must_match():
+    counter = Registry().counter("c", "C.", ("event",))
+    with pytest.raises(ValueError):
+        counter.inc()
+    with pytest.raises(ValueError):
+        counter.inc(event="start", unit="0")
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter("c", "C.", ("event",)).inc(event='a"b\\c')
+    assert 'c{event="a\\"b\\\\c"} 1' in registry.to_prometheus()
+
+
+def test_samplers(registry):
+    gauge = registry.gauge("nodes", "Nodes.")
+    registry.add_sampler(lambda: gauge.set(42))
+    registry.sample()
+    assert gauge.get() == 42
+
+
+def test_serve(registry):
+    server = serve(0, registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode() == registry.to_prometheus()
+        with urllib.request.urlopen(f"{url}/metrics.json") as response:
+            assert json.load(response) == registry.to_json()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_estimate_size():
+    small = estimate_size(StateNodeOutput(State()))
+    big = estimate_size(StateNodeOutput(State(config={"foo": "x" * 10_000})))
+    assert 0 < small < big
+    assert big - small >= 10_000
+
+
+def test_output_cache_lookups():
+    def lookups(result):
+        return metrics.CACHE_LOOKUPS.get(cache=metrics.OUTPUT_CACHE, result=result)
+
+    hits, misses = lookups("hit"), lookups("miss")
+    cache = OutputCache(max_size=2)
+    cache.put(1, "a", StateNodeOutput(State()))
+    assert cache.get(1, "a")
+    assert cache.get(1, "b") is None
+    assert lookups("hit") == hits + 1
+    assert lookups("miss") == misses + 1
+    assert 0 < metrics.CACHE_HIT_RATIO.get(cache=metrics.OUTPUT_CACHE) < 1
+
+
+def test_vfs_bytes(tmp_path):
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a").write_bytes(b"x" * 100)
+    (src / "sub" / "b").write_bytes(b"x" * 50)
+    copied = metrics.VFS_COPIED_BYTES.get()
+    metrics.REGISTRY.sample()
+    on_disk = metrics.VFS_DISK_BYTES.get()
+
+    root = vfs.make_vfs_root()
+    vfs.copy_tree(src, root)
+    assert metrics.VFS_COPIED_BYTES.get() == copied + 150
+    # sampled, not walked on every scrape
+    assert metrics.VFS_DISK_BYTES.get() == on_disk
+    metrics.REGISTRY.sample()
+    assert metrics.VFS_DISK_BYTES.get() == on_disk + 150
+
+    vfs.remove_vfs_root(root)
+    assert not os.path.exists(root)
+    metrics.REGISTRY.sample()
+    assert metrics.VFS_DISK_BYTES.get() == on_disk
@@ -0,0 +1,36 @@
+from scenario import State
+
+from theatre.output_cache import OutputCache, fingerprint
+from theatre.trace_tree_widget.structs import StateNodeOutput
+
+
+def test_fingerprint_stable():
+    assert fingerprint({"a": 1, "b": [2]}) == fingerprint({"b": [2], "a": 1})
+    assert fingerprint("root") != fingerprint("custom", {})
+
+
+def test_get_put():
+    cache = OutputCache(max_size=2)
+    output = StateNodeOutput(state=State())
+    cache.put(1, "foo", output)
+    assert cache.get(1, "foo") is output
+    assert cache.get(1, "bar") is None
+    assert cache.get(2, "foo") is None
+
+
+def test_lru_eviction():
+    cache = OutputCache(max_size=2)
+    cache.put(1, "foo", StateNodeOutput(state=State()))
+    cache.put(2, "foo", StateNodeOutput(state=State()))
+    # touch 1, so that 2 is the least recently used one
+    cache.get(1, "foo")
+    cache.put(3, "foo", StateNodeOutput(state=State()))
+    assert len(cache) == 2
+    assert cache.get(2, "foo") is None
+    assert cache.get(1, "foo") is not None
+
+
+def test_errors_not_cached():
+    cache = OutputCache()
+    cache.put(1, "foo", StateNodeOutput(exception=ValueError()))
+    assert cache.get(1, "foo") is None
@@ -0,0 +1,95 @@
+import pstats
+import time
+
+import pytest
+
+from theatre.profiling import CPROFILE, SAMPLING, Frame, Profile, profile_call
+
+
+def _busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _leaf():
+    _busy(0.02)
+
+
+def _branch():
+    _leaf()
+    _busy(0.01)
+
+
+def _main():
+    _branch()
+    _leaf()
+    return 42
+
+
+def _names(profile: Profile):
+    return {tuple(frame.function for frame in stack) for stack in profile.stacks}
+
+
+@pytest.mark.parametrize("mode", (CPROFILE, SAMPLING))
+def test_profile_call(mode):
+    result, profile = profile_call(_main, mode=mode)
+    assert result == 42
+    assert profile.mode == mode
+    names = _names(profile)
+    # real stacks, with the profiled function at the root
+    assert any(stack[:3] == ("_main", "_branch", "_leaf") for stack in names)
+    assert all(stack[0] == "_main" for stack in names)
+
+    tree = profile.tree()
+    (main,) = tree.children.values()
+    assert main.total == pytest.approx(tree.total)
+    branch = next(
+        child for child in main.children.values() if child.frame.function == "_branch"
+    )
+    assert branch.total == pytest.approx(0.03, rel=0.5)
+
+
+def test_cprofile_splits_shared_callees():
+    _, profile = profile_call(_main, mode=CPROFILE)
+    tree = profile.tree()
+    (main,) = tree.children.values()
+    by_name = {child.frame.function: child for child in main.children.values()}
+    # _leaf is called from both _main and _branch: its time is split between them
+    assert by_name["_leaf"].total == pytest.approx(0.02, rel=0.5)
+    assert by_name["_branch"].total == pytest.approx(0.03, rel=0.5)
+
+
+def test_merge_and_export(tmp_path):
+    _, first = profile_call(_main, mode=CPROFILE)
+    _, second = profile_call(_leaf, mode=CPROFILE)
+    merged = Profile.merge([first, second], "both")
+    assert merged.total == pytest.approx(first.total + second.total)
+    assert merged.mode == CPROFILE
+
+    merged.dump_stats(str(tmp_path / "both.prof"))
+    calls = {
+        func[2]: n_calls
+        for func, (_, n_calls, *_) in pstats.Stats(
+            str(tmp_path / "both.prof")
+        ).stats.items()
+    }
+    assert calls["_leaf"] == 3
+
+    speedscope = merged.to_speedscope()
+    (exported,) = speedscope["profiles"]
+    frames = speedscope["shared"]["frames"]
+    assert len(exported["samples"]) == len(exported["weights"]) == len(merged.stacks)
+    assert sum(exported["weights"]) == pytest.approx(merged.total)
+    assert {frames[i]["name"] for sample in exported["samples"] for i in sample} >= {
+        "_main",
+        "_branch",
+        "_leaf",
+    }
+
+
+def test_sampling_profiles_cant_be_dumped(tmp_path):
+    profile = Profile({(Frame("f", "f.py", 1),): 1.0}, SAMPLING)
+    with pytest.raises(ValueError):
+        profile.dump_stats(str(tmp_path / "f.prof"))
+    assert Profile.merge([profile, profile], "twice").stats is None
@@ -0,0 +1,122 @@
+import ops
+import pytest
+from sample_charm import charm_context
+from scenario import Container, Mount, State
+from scenario.state import JujuLogLine
+
+from theatre.results_store import ResultsStore, charm_fingerprint
+from theatre.trace_tree_widget.structs import StateNodeOutput
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(tmp_path / ".theatre" / "results.db")
+    store.charm_version = "v1"
+    yield store
+    store.close()
+
+
+def _failed():
+    try:
+        raise KeyError("no such relation: db")
+    except KeyError as e:
+        return StateNodeOutput(exception=e)
+
+
+def _blocked():
+    return StateNodeOutput(
+        State(leader=True, unit_status=ops.BlockedStatus("no db")),
+        [JujuLogLine("WARNING", "database not ready")],
+        "some output",
+    )
+
+
+def test_roundtrip(store):
+    store.put(1, 10, "fp", "install", _blocked())
+    store.flush()
+    output = store.get(1, 10, "fp")
+    assert output.state.leader
+    assert output.state.unit_status == ops.BlockedStatus("no db")
+    assert output.charm_logs == [JujuLogLine("WARNING", "database not ready")]
+    assert output.scenario_logs == "some output"
+    assert store.get(1, 10, "other fp") is None
+    assert store.get(2, 10, "fp") is None
+
+
+def test_other_charm_versions_not_reused(store):
+    store.put(1, 10, "fp", "install", _blocked())
+    store.flush()
+    store.charm_version = "v2"
+    assert store.get(1, 10, "fp") is None
+
+
+def test_not_reusable(store):
+    mounted = State(containers=[Container("c", mounts={"m": Mount("/x", "/tmp")})])
+    store.put(1, 10, "fp", "install", StateNodeOutput(mounted))
+    store.put(1, 11, "fp", "start", _failed())
+    store.flush()
+    # recorded, but not to be reused
+    assert store.count() == 2
+    assert store.get(1, 10, "fp") is None
+    assert store.get(1, 11, "fp") is None
+
+
+def test_one_row_per_node_and_fingerprint(store):
+    store.put(1, 10, "fp", "install", _blocked())
+    store.put(1, 10, "fp", "install", StateNodeOutput(State()))
+    store.flush()
+    assert store.count() == 1
+    assert not store.get(1, 10, "fp").state.leader
+    assert store.search("database") == []
+
+
+def test_counts(store):
+    store.put(1, 10, "fp", "install", _blocked())
+    store.put(1, 11, "fp", "start", _failed())
+    store.flush()
+    assert store.count(status="blocked") == 1
+    assert store.count(exception_type="KeyError") == 1
+    assert store.count(status="active") == 0
+
+
+@pytest.mark.parametrize("fts", (True, False))
+def test_search(store, fts):
+    store.has_fts = store.has_fts and fts
+    store.put(1, 10, "fp", "install", _blocked())
+    store.put(1, 11, "fp", "start", _failed())
+    store.flush()
+    (hit,) = store.search("database")
+    assert (hit.scene, hit.node, hit.event, hit.status) == (1, 10, "install", "blocked")
+    # tracebacks too
+    (hit,) = store.search("no such relation")
+    assert (hit.node, hit.exception_type) == (11, "KeyError")
+    assert store.search("nothing like this") == []
+
+
+def test_invalid_fts_query(store):
+    store.put(1, 10, "fp", "install", _blocked())
+    store.flush()
+    # searched as a phrase instead
+    assert len(store.search('"not ready')) == 1
+    assert store.search("ready AND (") == []
+
+
+def test_reopen(tmp_path, store):
+    store.put(1, 10, "fp", "install", _blocked())
+    store.close()
+    reopened = ResultsStore(store.path)
+    reopened.charm_version = "v1"
+    assert reopened.get(1, 10, "fp").state.leader
+    reopened.close()
+
+
+def test_charm_fingerprint_covers_libs(tmp_path):
+    lib = tmp_path / "lib" / "charms" / "foo" / "v0"
+    lib.mkdir(parents=True)
+    (lib / "foo.py").write_text("LIBPATCH = 1\n")
+    context = charm_context()
+    before = charm_fingerprint(context, tmp_path)
+    assert charm_fingerprint(context, tmp_path) == before
+
+    (lib / "foo.py").write_text("LIBPATCH = 2\n")
+    assert charm_fingerprint(context, tmp_path) != before
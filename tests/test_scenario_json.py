@@ -0,0 +1,144 @@
+import dataclasses
+import datetime
+import json
+
+import pytest
+from ops import ActiveStatus, pebble
+from scenario.state import (
+    Container,
+    DeferredEvent,
+    Event,
+    ExecOutput,
+    Mount,
+    Network,
+    PeerRelation,
+    Port,
+    Relation,
+    Secret,
+    SecretRotate,
+    State,
+    StateValidationError,
+    Storage,
+    StoredState,
+    SubordinateRelation,
+    _EntityStatus,
+)
+
+from theatre.scenario_json import (
+    dump_event,
+    dump_state,
+    parse_event,
+    parse_relation,
+    parse_state,
+)
+
+
+def rich_state():
+    return State(
+        config={"a": 1, "b": "x", "c": True},
+        relations=[
+            Relation(
+                "foo",
+                remote_app_data={"a": "b"},
+                remote_units_data={0: {"x": "y"}, 3: {}},
+            ),
+            PeerRelation("peers", peers_data={1: {"a": "b"}}),
+            SubordinateRelation("sub", remote_unit_data={"k": "v"}),
+        ],
+        networks=[Network.default("foo")],
+        containers=[
+            Container(
+                "ct",
+                can_connect=True,
+                layers={
+                    "l": pebble.Layer(
+                        {
+                            "summary": "s",
+                            "services": {
+                                "svc": {"override": "replace", "command": "ls"}
+                            },
+                        }
+                    )
+                },
+                service_status={"svc": pebble.ServiceStatus.ACTIVE},
+                mounts={"m": Mount("/opt", "/tmp/foo")},
+                exec_mock={("ls", "-ll"): ExecOutput(0, "out", "")},
+            )
+        ],
+        storage=[Storage("data")],
+        opened_ports=[Port("tcp", 80)],
+        leader=True,
+        secrets=[
+            Secret(
+                "secret:1",
+                {0: {"a": "b"}},
+                owner="app",
+                remote_grants={1: {"remote/0"}},
+                expire=datetime.datetime(2020, 1, 1),
+                rotate=SecretRotate.DAILY,
+            )
+        ],
+        resources={"r": "/foo"},
+        deferred=[DeferredEvent("handle/path", "owner", "observer", {"a": 1})],
+        stored_state=[StoredState("MyCharm", content={"a": [1, 2], "b": None})],
+        unit_status=ActiveStatus("ok"),
+        app_status=_EntityStatus("blocked", "meh"),
+        workload_version="1.0",
+    )
+
+
+def test_state_roundtrip():
+    state = rich_state()
+    # the encoded state is json-serializable as is
+    data = json.loads(json.dumps(dump_state(state)))
+    assert parse_state(data) == state
+
+
+def test_event_roundtrip():
+    state = rich_state()
+    event = Event(
+        "foo_relation_changed", relation=state.relations[0], args=(1,), kwargs={"a": 1}
+    )
+    data = json.loads(json.dumps(dump_event(event)))
+    assert parse_event(data) == event
+
+
+def test_legacy_asdict_format():
+    state = State(
+        relations=[Relation("foo", remote_units_data={0: {"a": "b"}})],
+        unit_status=_EntityStatus("active", "yes"),
+    )
+    data = json.loads(json.dumps(dataclasses.asdict(state)))
+    assert parse_state(data) == state
+
+
+def test_relation_type_inference():
+    assert isinstance(parse_relation({"endpoint": "foo"}), Relation)
+    assert isinstance(
+        parse_relation({"endpoint": "foo", "peers_data": {}}), PeerRelation
+    )
+    assert isinstance(
+        parse_relation({"endpoint": "foo", "remote_unit_data": {}}),
+        SubordinateRelation,
+    )
+
+
+def test_partial_data_gets_defaults():
+    state = parse_state({"leader": True})
+    assert state == State(leader=True)
+
+
+def test_decoded_objects_are_validated():
+    with pytest.raises(StateValidationError):
+        parse_state({"relations": [{"endpoint": "db", "remote_app_data": {"a": 1}}]})
+    with pytest.raises(StateValidationError):
+        parse_state({"opened_ports": [{"port": 70000, "protocol": "tcp"}]})
+
+
+def test_decoded_objects_do_not_share_data():
+    data = dump_state(rich_state())
+    expected = parse_state(json.loads(json.dumps(data)))
+    state = parse_state(data)
+    data["config"]["a"] = 2
+    data["relations"][0]["remote_app_data"]["foo"] = "baz"
+    assert state == expected
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from theatre.scene_format import (
+    LAZY_PAYLOAD_KEY,
+    LazyPayload,
+    PackedScene,
+    PackedSceneError,
+    is_packed_scene,
+    pack_scene,
+    write_packed_scene,
+)
+from theatre.theatre_scene import read_scene_file
+
+
+def _scene_data():
+    return {
+        "id": 1,
+        "scene_width": 100,
+        "scene_height": 100,
+        "nodes": [
+            {
+                "id": 10,
+                "inputs": [],
+                "outputs": [{"id": 12}],
+                "custom-state": {"leader": True},
+            },
+            {"id": 20, "inputs": [{"id": 21}], "outputs": [{"id": 22}]},
+        ],
+        "edges": [{"id": 30, "start": 12, "end": 21}],
+    }
+
+
+def test_roundtrip():
+    packed = PackedScene(pack_scene(_scene_data()))
+    assert packed.to_json() == _scene_data()
+    assert packed.payload_node_ids == [10]
+
+
+def test_lazy_skeleton():
+    packed = PackedScene(pack_scene(_scene_data()))
+    skeleton = packed.skeleton()
+    root, child = skeleton["nodes"]
+    assert "custom-state" not in root
+    assert isinstance(root[LAZY_PAYLOAD_KEY], LazyPayload)
+    assert root[LAZY_PAYLOAD_KEY].load() == {"custom-state": {"leader": True}}
+    assert LAZY_PAYLOAD_KEY not in child
+
+
+def test_read_packed_scene_file(tmp_path):
+    packed_file = tmp_path / "scene.theatre"
+    json_file = tmp_path / "other.theatre"
+    write_packed_scene(_scene_data(), packed_file)
+    json_file.write_text(json.dumps(_scene_data()))
+
+    assert is_packed_scene(packed_file)
+    assert not is_packed_scene(json_file)
+
+    data = read_scene_file(str(packed_file))
+    assert data["nodes"][0][LAZY_PAYLOAD_KEY].load()["custom-state"] == {"leader": True}
+
+
+def test_corrupted():
+    buffer = pack_scene(_scene_data())
+    with pytest.raises(PackedSceneError):
+        PackedScene(buffer[:-3])
+    with pytest.raises(PackedSceneError):
+        # the skeleton record is only decoded on access
+        PackedScene(buffer[:20] + b"garbage" + buffer[27:]).skeleton()
@@ -0,0 +1,143 @@
+import pytest
+from scenario import Event, State
+
+from theatre.dialogs.event_dialog import EventSpec
+from theatre.scene_history import _changes_size, _diff
+from theatre.trace_tree_widget.event_edge import EventEdge
+from theatre.trace_tree_widget.state_node import StateNode
+
+
+def test_diff():
+    old = {1: {"id": 1, "pos_x": 0}, 2: {"id": 2}, 3: {"id": 3}}
+    new = {1: {"id": 1, "pos_x": 10}, 2: {"id": 2}, 4: {"id": 4}}
+    assert _diff(old, new) == {
+        1: ({"id": 1, "pos_x": 0}, {"id": 1, "pos_x": 10}),
+        3: ({"id": 3}, None),
+        4: (None, {"id": 4}),
+    }
+
+
+def test_diff_unchanged():
+    items = {1: {"id": 1}}
+    changes = _diff(items, dict(items))
+    assert changes == {}
+    assert _changes_size(changes) == 0
+
+
+def test_changes_size_ignores_missing_side():
+    changes = {1: (None, {"id": 1})}
+    assert _changes_size(changes) == len('{"id":1}')
+
+
+def _snapshot(scene):
+    data = scene.serialize()
+    return (
+        {node["id"]: node for node in data["nodes"]},
+        {edge["id"]: edge for edge in data["edges"]},
+    )
+
+
+@pytest.fixture
+def history(scene):
+    history = scene.history
+    history.clear()
+    history.storeInitialHistoryStamp()
+    yield history
+    history.clear()
+
+
+def _edit(scene, history, snapshots, desc, edit):
+    edit()
+    history.storeHistory(desc, setModified=True)
+    snapshots.append(_snapshot(scene))
+    # the history keeps up with the scene without serializing all of it
+    assert (history.current_nodes, history.current_edges) == snapshots[-1]
+
+
+def test_undo_redo(scene, history):
+    snapshots = [_snapshot(scene)]
+    root = StateNode(scene)
+    child = StateNode(scene)
+    edge = None
+
+    def add_root():
+        root.set_custom_value(State(leader=True))
+
+    def connect():
+        nonlocal edge
+        edge = EventEdge(
+            scene,
+            root.output_socket,
+            child.input_socket,
+            event_spec=EventSpec(Event("update_status"), {}),
+        )
+
+    _edit(scene, history, snapshots, "add nodes", add_root)
+    _edit(scene, history, snapshots, "connect", connect)
+    _edit(scene, history, snapshots, "move", lambda: root.setPos(100, 50))
+    _edit(
+        scene,
+        history,
+        snapshots,
+        "change event",
+        lambda: edge.set_event_spec(EventSpec(Event("start"), {})),
+    )
+    _edit(
+        scene,
+        history,
+        snapshots,
+        "edit root",
+        lambda: root.set_custom_value(State(leader=False)),
+    )
+    _edit(scene, history, snapshots, "remove child", child.remove)
+
+    for expected in reversed(snapshots[:-1]):
+        history.undo()
+        assert _snapshot(scene) == expected
+        assert (history.current_nodes, history.current_edges) == expected
+    assert not history.canUndo()
+
+    for expected in snapshots[1:]:
+        history.redo()
+        assert _snapshot(scene) == expected
+    assert not history.canRedo()
+
+
+def test_unchanged_items_not_serialized(scene, history, monkeypatch):
+    nodes = [StateNode(scene) for _ in range(3)]
+    history.storeHistory("add nodes")
+    serialized = []
+    serialize = StateNode.serialize
+
+    def spy(node):
+        serialized.append(node)
+        return serialize(node)
+
+    monkeypatch.setattr(StateNode, "serialize", spy)
+    nodes[0].setPos(100, 100)
+    history.storeHistory("move")
+
+    assert serialized == [nodes[0]]
+    assert list(history.history_stack[-1]["nodes"]) == [nodes[0].id]
+
+
+def test_snapshot(scene, history, monkeypatch):
+    nodes = [StateNode(scene) for _ in range(3)]
+    history.storeHistory("add nodes")
+    nodes[1].setPos(100, 100)  # not stamped yet
+    serialized = []
+    serialize = StateNode.serialize
+
+    def spy(node):
+        serialized.append(node)
+        return serialize(node)
+
+    monkeypatch.setattr(StateNode, "serialize", spy)
+    snapshot = history.snapshot()
+
+    assert serialized == [nodes[1]]
+    monkeypatch.undo()
+    assert snapshot == dict(scene.serialize())
+    # a snapshot isn't a step: the move is still there to be stamped
+    history.storeHistory("move")
+    assert list(history.history_stack[-1]["nodes"]) == [nodes[1].id]
@@ -0,0 +1,111 @@
+import ops
+from scenario import (
+    Container,
+    PeerRelation,
+    Relation,
+    Secret,
+    State,
+    StoredState,
+    SubordinateRelation,
+)
+
+from theatre.state_diff import Change, diff_states
+
+
+def _kinds(diff):
+    return {"/".join(change.path): change.kind for change in diff.changes}
+
+
+def test_no_changes():
+    state = State(leader=True, relations=[Relation("db")])
+    diff = diff_states(state, state.replace())
+    assert not diff
+    assert diff.describe() == "no changes"
+
+
+def test_scalars_and_statuses():
+    diff = diff_states(
+        State(), State(leader=True, unit_status=ops.BlockedStatus("whoops"))
+    )
+    assert _kinds(diff) == {"leader": "modified", "unit_status": "modified"}
+    assert "blocked('whoops')" in diff.describe()
+
+
+def test_relations_matched_by_id():
+    db = Relation("db", relation_id=1, remote_app_data={"a": "1", "b": "2"})
+    foo = Relation("foo", relation_id=2)
+    old = State(relations=[db, foo])
+    # order doesn't matter, ids do
+    new = State(
+        relations=[
+            Relation("bar", relation_id=3),
+            db.replace(remote_app_data={"a": "2", "c": "3"}),
+        ]
+    )
+    assert _kinds(diff_states(old, new)) == {
+        "relations/db:1/remote_app_data/a": "modified",
+        "relations/db:1/remote_app_data/b": "removed",
+        "relations/db:1/remote_app_data/c": "added",
+        "relations/foo:2": "removed",
+        "relations/bar:3": "added",
+    }
+
+
+def test_mixed_relations_matched_by_id():
+    db = Relation("db", relation_id=1, remote_app_data={"a": "1"})
+    peers = PeerRelation("peers", relation_id=2)
+    logs = SubordinateRelation("logs", relation_id=3)
+    old = State(relations=[db, peers, logs])
+    new = State(
+        relations=[
+            logs,
+            peers.replace(peers_data={0: {"b": "1"}}),
+            db.replace(remote_app_data={"a": "2"}),
+        ]
+    )
+    assert _kinds(diff_states(old, new)) == {
+        "relations/db:1/remote_app_data/a": "modified",
+        "relations/peers:2/peers_data/0/b": "added",
+    }
+
+
+def test_type_changes():
+    diff = diff_states(
+        State(config={"a": 1, "b": 1}), State(config={"a": True, "b": 1})
+    )
+    assert _kinds(diff) == {"config/a": "modified"}
+
+
+def test_containers_by_name():
+    old = State(containers=[Container("a"), Container("b")])
+    new = State(containers=[Container("b", can_connect=True), Container("a")])
+    assert _kinds(diff_states(old, new)) == {"containers/b/can_connect": "modified"}
+
+
+def test_secrets_and_stored_state():
+    old = State(
+        secrets=[Secret("secret:1", {0: {"k": "v"}})],
+        stored_state=[StoredState(None, content={"count": 1})],
+    )
+    new = State(
+        secrets=[Secret("secret:1", {0: {"k": "v"}}, label="foo")],
+        stored_state=[StoredState(None, content={"count": 2})],
+    )
+    diff = diff_states(old, new)
+    assert _kinds(diff) == {
+        "secrets/secret:1/label": "modified",
+        "stored_state/[_stored]/content/count": "modified",
+    }
+    assert (
+        Change(("stored_state", "[_stored]", "content", "count"), "modified", 1, 2)
+        in diff.changes
+    )
+
+
+def test_describe_limit():
+    old = State(config={str(i): i for i in range(30)})
+    diff = diff_states(old, State())
+    assert len(diff) == 30
+    lines = diff.describe(limit=5).splitlines()
+    assert len(lines) == 6
+    assert lines[-1] == "... and 25 more"
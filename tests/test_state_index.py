@@ -0,0 +1,76 @@
+import ops
+import pytest
+from scenario import Container, Relation, State
+
+from theatre.state_index import QueryError, StateIndex, compile_query
+from theatre.trace_tree_widget.structs import StateNodeOutput
+
+
+@pytest.fixture
+def index():
+    index = StateIndex()
+    index.update(
+        "a",
+        StateNodeOutput(
+            State(
+                leader=True,
+                unit_status=ops.BlockedStatus("no db"),
+                relations=[Relation("db", remote_app_data={"host": "foo.local"})],
+            )
+        ),
+    )
+    index.update(
+        "b",
+        StateNodeOutput(
+            State(
+                containers=[Container("workload", can_connect=True)],
+                relations=[Relation("ingress", remote_app_data={"host": "bar"})],
+            )
+        ),
+    )
+    index.update("c", StateNodeOutput(exception=KeyError("boom")))
+    return index
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    (
+        ("status:blocked", {"a"}),
+        ("unit_status.message = 'no db'", {"a"}),
+        ("leader = true", {"a"}),
+        ("leader = True", {"a"}),
+        ("leader != true", {"b"}),
+        ("has relations.db", {"a"}),
+        ("relations.db.remote_app_data.host = foo.local", {"a"}),
+        ("relations.*.remote_app_data.host ~ BA", {"b"}),
+        ("has relations.*.remote_app_data.host", {"a", "b"}),
+        ("containers.workload.can_connect = true", {"b"}),
+        ("exception:KeyError", {"c"}),
+        ("exception:LookupError", {"c"}),
+        ("not exception:Exception", {"a", "b"}),
+        ("has relations and not leader = true", {"b"}),
+        ("has relations not leader = true", {"b"}),
+    ),
+)
+def test_query(index, query, expected):
+    assert index.query(query) == expected
+
+
+def test_update_and_discard(index):
+    assert index.query("status:blocked") == {"a"}
+    index.update("a", StateNodeOutput(State()))
+    assert index.query("status:blocked") == set()
+    assert index.query("status:unknown") == {"a", "b"}
+    index.discard("b")
+    assert index.query("status:unknown") == {"a"}
+    assert "b" not in index
+    index.update("a", None)
+    assert len(index) == 1
+    # nothing left over from a and b
+    assert index.query("has relations") == set()
+
+
+@pytest.mark.parametrize("query", ("", "leader", "leader =", "not", "has", "= foo"))
+def test_invalid_query(query):
+    with pytest.raises(QueryError):
+        compile_query(query)
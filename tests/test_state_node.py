@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import pytest
+import yaml
+from sample_charm import DummyCharm, charm_context
+from scenario import Container, Context, Event, State
+
+from theatre import metrics
+from theatre.charm_repo_tools import CharmRepo
+from theatre.dialogs.event_dialog import EventSpec
+from theatre.trace_tree_widget.event_edge import EventEdge
+from theatre.trace_tree_widget.state_node import StateNode
+
+
+@pytest.fixture
+def workload_scene(scene, main_window, tmp_path, monkeypatch):
+    """A scene whose charm has a container, with a mount in the 'default' situation."""
+    root = tmp_path / "repo"
+    (root / "src").mkdir(parents=True)
+    (root / "src" / "charm.py").write_text("")
+    (root / "metadata.yaml").write_text("name: dummy\ncontainers:\n  workload: {}\n")
+    container_dir = root / ".theatre" / "virtual_fs" / "default" / "workload"
+    (container_dir / "etc").mkdir(parents=True)
+    (container_dir / "etc" / "config.yaml").write_text("foo: bar")
+    (container_dir / "spec.yaml").write_text(
+        yaml.safe_dump({"workload": {"mounts": {"/etc/workload": "etc"}}})
+    )
+    monkeypatch.setattr(main_window, "_repo", CharmRepo(root))
+    main_window._update_charm_context(
+        Context(DummyCharm, meta={"name": "dummy", "containers": {"workload": {}}})
+    )
+    yield scene
+    scene.clear()
+    main_window._update_charm_context(charm_context())
+
+
+def _connect(scene, parent: StateNode, event: str = "update_status") -> StateNode:
+    node = StateNode(scene)
+    EventEdge(
+        scene,
+        parent.output_socket,
+        node.input_socket,
+        event_spec=EventSpec(Event(event), {}),
+    )
+    return node
+
+
+def _counts():
+    return (
+        metrics.EVALUATIONS_STARTED.get(event="update_status"),
+        metrics.EVALUATIONS_SUCCEEDED.get(event="update_status"),
+    )
+
+
+def test_profile_evaluation_leaves_the_node_alone(
+    workload_scene, tmp_path, monkeypatch
+):
+    root = StateNode(workload_scene)
+    root.set_custom_value(State(containers=[Container("workload", can_connect=True)]))
+    node = _connect(workload_scene, root)
+    value = node.value
+    assert value.state
+    vfs_contents = sorted(os.listdir(node.root_vfs_tempdir))
+    counts = _counts()
+    scratch_parent = tmp_path / "scratch"
+    scratch_parent.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(scratch_parent))
+
+    profile = node.profile_trace()
+
+    assert profile.parts
+    assert node.value is value
+    assert not node.isDirty()
+    # the charm ran against a scratch copy of the filesystems, since removed
+    assert sorted(os.listdir(node.root_vfs_tempdir)) == vfs_contents
+    assert os.listdir(scratch_parent) == []
+    # and it didn't count as an evaluation
+    assert _counts() == counts
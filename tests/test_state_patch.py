@@ -0,0 +1,144 @@
+import pytest
+from scenario import State
+from scenario.state import Relation
+
+from theatre.scenario_json import dump_state
+from theatre.scene_format import LAZY_PAYLOAD_KEY, PackedScene, pack_scene
+from theatre.state_patch import (
+    CUSTOM_STATE_KEY,
+    NULL_BASE,
+    PATCHED_STATE_KEY,
+    PatchError,
+    apply_patch,
+    decode_state_patches,
+    encode_state_patches,
+    make_patch,
+)
+
+
+@pytest.mark.parametrize(
+    "base, target",
+    (
+        ({"a": 1, "b": [1, 2]}, {"a": 1, "b": [1, 3]}),
+        ({"a": 1, "b": 2}, {"a": 1, "c": 3}),
+        ({"a": [1, 2]}, {"a": [1, 2, 3]}),
+        ({"a": {"b": {"c": None}}}, {"a": {"b": {"c": 1}}}),
+        (1, "foo"),
+    ),
+)
+def test_patch_roundtrip(base, target):
+    assert apply_patch(base, make_patch(base, target)) == target
+
+
+@pytest.mark.parametrize("target", (True, 1.0, "1"))
+def test_type_changes(target):
+    patch = make_patch({"a": 1}, {"a": target})
+    assert patch == {"{}": {"a": {"=": target}}}
+    assert type(apply_patch({"a": 1}, patch)["a"]) is type(target)
+
+
+def test_no_changes():
+    assert make_patch({"a": 1}, {"a": 1}) is None
+    assert apply_patch({"a": 1}, None) == {"a": 1}
+
+
+def test_apply_does_not_modify_base():
+    base = {"a": {"b": 1}}
+    apply_patch(base, make_patch(base, {"a": {"b": 2}}))
+    assert base == {"a": {"b": 1}}
+
+
+@pytest.mark.parametrize("patch", (None, {"{}": {"c": {"=": 1}}}))
+def test_apply_does_not_share_base(patch):
+    base = {"a": {"b": [1]}}
+    out = apply_patch(base, patch)
+    out["a"]["b"].append(2)
+    assert base == {"a": {"b": [1]}}
+
+
+def _node(node_id, state: State, name="State"):
+    return {"id": node_id, "name": name, CUSTOM_STATE_KEY: dump_state(state)}
+
+
+def _scene():
+    relations = [Relation("foo", relation_id=i) for i in range(10)]
+    return {
+        "id": 1,
+        "nodes": [
+            _node(1, State(leader=True, relations=relations)),
+            _node(2, State(leader=False, relations=relations)),
+            {"id": 3, "name": "State"},
+        ],
+        "edges": [],
+    }
+
+
+def test_encode_decode():
+    data = _scene()
+    encoded = encode_state_patches(data)
+    first, second, plain = encoded["nodes"]
+    assert first[PATCHED_STATE_KEY]["base"] == NULL_BASE
+    # the second node is patched against the first one: only 'leader' changes
+    assert second[PATCHED_STATE_KEY]["base"] == "node:1"
+    assert second[PATCHED_STATE_KEY]["patch"] == {"{}": {"leader": {"=": False}}}
+    assert plain == {"id": 3, "name": "State"}
+
+    assert decode_state_patches(encoded) == data
+
+
+def test_decode_lazy():
+    data = _scene()
+    skeleton = PackedScene(pack_scene(encode_state_patches(data))).skeleton()
+    decoded = decode_state_patches(skeleton)
+    for original, node_data in zip(data["nodes"][:2], decoded["nodes"]):
+        assert node_data[LAZY_PAYLOAD_KEY].load() == {
+            CUSTOM_STATE_KEY: original[CUSTOM_STATE_KEY]
+        }
+
+
+def test_same_named_nodes_patched_against_the_first():
+    relations = [Relation("foo", relation_id=i) for i in range(10)]
+    data = {
+        "id": 1,
+        "nodes": [_node(i, State(unit_id=i, relations=relations)) for i in range(1, 6)],
+        "edges": [],
+    }
+    encoded = encode_state_patches(data)
+    assert [node[PATCHED_STATE_KEY]["base"] for node in encoded["nodes"][1:]] == [
+        "node:1"
+    ] * 4
+    assert decode_state_patches(encoded) == data
+
+
+def test_decode_long_chain_lazily():
+    # as saved by older versions: each node patched against the previous one
+    count = 3000
+    nodes = [_node(1, State(unit_id=0))]
+    for node_id in range(2, count + 1):
+        nodes.append(
+            {
+                "id": node_id,
+                "name": "State",
+                PATCHED_STATE_KEY: {
+                    "base": f"node:{node_id - 1}",
+                    "patch": {"{}": {"unit_id": {"=": node_id}}},
+                },
+            }
+        )
+    data = {"id": 1, "nodes": nodes, "edges": []}
+    skeleton = PackedScene(pack_scene(data)).skeleton()
+    decoded = decode_state_patches(skeleton)
+
+    # the last node first: no recursion down the chain
+    last = decoded["nodes"][-1][LAZY_PAYLOAD_KEY].load()[CUSTOM_STATE_KEY]
+    assert last["unit_id"] == count
+    middle = decoded["nodes"][1000][LAZY_PAYLOAD_KEY].load()[CUSTOM_STATE_KEY]
+    assert middle["unit_id"] == 1001
+
+
+def test_unknown_base():
+    data = {
+        "nodes": [{"id": 1, PATCHED_STATE_KEY: {"base": "library:foo", "patch": None}}]
+    }
+    with pytest.raises(PatchError):
+        decode_state_patches(data)
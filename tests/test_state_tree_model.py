@@ -0,0 +1,59 @@
+import json
+
+import yaml
+from scenario import Container, Relation, State
+
+from theatre.state_tree_model import child_entries, dump_state_text, find
+
+
+def _state():
+    return State(
+        leader=True,
+        relations=[Relation("db", remote_app_data={"host": "foo", "port": "42"})],
+        containers=[Container("workload")],
+    )
+
+
+def _resolve(value, path):
+    for row in path:
+        key, value = child_entries(value)[row]
+    return key, value
+
+
+def test_child_entries():
+    state = _state()
+    keys = [key for key, _ in child_entries(state)]
+    assert "relations" in keys and "leader" in keys
+    assert child_entries({"a": 1}) == [("a", 1)]
+    assert child_entries(["x", "y"]) == [("0", "x"), ("1", "y")]
+    assert child_entries("leaf") is None
+    assert child_entries(42) is None
+
+
+def test_find_keys_and_values():
+    state = _state()
+    matches = find(state, "HOST")
+    assert [_resolve(state, path) for path in matches] == [("host", "foo")]
+    # values match only on leaves
+    matches = find(state, "workload")
+    assert ("name", "workload") in [_resolve(state, path) for path in matches]
+
+
+def test_find_limit():
+    state = State(
+        relations=[Relation("db", local_app_data={str(i): "" for i in range(50)})]
+    )
+    assert len(find(state, "", limit=10)) == 10
+
+
+def test_find_in_order():
+    data = {"a": {"x": 1}, "b": {"x": 2}}
+    assert find(data, "x") == [(0, 0), (1, 0)]
+
+
+def test_dump_state_text():
+    state = _state()
+    as_json = json.loads(dump_state_text(state, "json"))
+    as_yaml = yaml.safe_load(dump_state_text(state, "yaml"))
+    assert as_json == as_yaml
+    assert as_json["relations"][0]["remote_app_data"] == {"host": "foo", "port": "42"}
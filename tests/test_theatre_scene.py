@@ -0,0 +1,201 @@
+import json
+
+import pytest
+from nodeeditor.node_scene import InvalidFile
+from qtpy.QtWidgets import QApplication
+from scenario import Event, State
+
+from theatre.dialogs.event_dialog import EventSpec
+from theatre.theatre_scene import (
+    TheatreScene,
+    read_scene_file,
+    validate_scene_data,
+)
+from theatre.trace_tree_widget.event_edge import EventEdge
+from theatre.trace_tree_widget.state_node import StateNode
+
+
+def _scene_data():
+    def node(node_id, socket_ids):
+        return {
+            "id": node_id,
+            "inputs": [{"id": socket_ids[0]}],
+            "outputs": [{"id": socket_ids[1]}],
+        }
+
+    return {
+        "id": 1,
+        "nodes": [node(10, (11, 12)), node(20, (21, 22))],
+        "edges": [{"id": 30, "start": 12, "end": 21}],
+    }
+
+
+def test_read_scene_file(tmp_path):
+    scene_file = tmp_path / "scene.json"
+    scene_file.write_text(json.dumps(_scene_data()))
+    assert read_scene_file(str(scene_file)) == _scene_data()
+
+
+def test_read_scene_file_invalid_json(tmp_path):
+    scene_file = tmp_path / "scene.json"
+    scene_file.write_text("{nodes: ")
+    with pytest.raises(InvalidFile):
+        read_scene_file(str(scene_file))
+
+
+def test_validate_dangling_edge():
+    data = _scene_data()
+    data["edges"][0]["end"] = 42
+    with pytest.raises(InvalidFile):
+        validate_scene_data(data)
+
+
+def test_validate_duplicate_node_ids():
+    data = _scene_data()
+    data["nodes"][1]["id"] = 10
+    with pytest.raises(InvalidFile):
+        validate_scene_data(data)
+
+
+def test_validate_missing_keys():
+    with pytest.raises(InvalidFile):
+        validate_scene_data({"nodes": []})
+
+
+@pytest.fixture
+def evaluations(scene, monkeypatch):
+    """The nodes evaluated, in order, and the batches they were evaluated in."""
+    record = {"nodes": [], "batches": []}
+    evaluate_batch = scene._evaluate_batch
+    node_eval = StateNode.eval
+
+    def _evaluate_batch(nodes):
+        nodes = list(nodes)
+        record["batches"].append(nodes)
+        evaluate_batch(nodes)
+
+    def eval(node):
+        record["nodes"].append(node)
+        return node_eval(node)
+
+    monkeypatch.setattr(scene, "_evaluate_batch", _evaluate_batch)
+    monkeypatch.setattr(StateNode, "eval", eval)
+    return record
+
+
+def _root(scene) -> StateNode:
+    root = StateNode(scene)
+    root.set_custom_value(State())
+    return root
+
+
+def _connect(scene, parent: StateNode, node: StateNode = None) -> StateNode:
+    node = node or StateNode(scene)
+    EventEdge(
+        scene,
+        parent.output_socket,
+        node.input_socket,
+        event_spec=EventSpec(Event("update_status"), {}),
+    )
+    return node
+
+
+def test_transaction_defers_evaluation(scene, evaluations):
+    root = _root(scene)
+    evaluations["nodes"].clear()
+    with scene.evaluation_transaction():
+        child, grandchild = StateNode(scene), StateNode(scene)
+        # connected bottom-up: greedily, the grandchild would be evaluated twice
+        _connect(scene, child, grandchild)
+        _connect(scene, root, child)
+        assert evaluations["nodes"] == []
+        assert evaluations["batches"] == []
+
+    assert len(evaluations["batches"]) == 1
+    (batch,) = evaluations["batches"]
+    assert set(batch) == {child, grandchild}
+    evaluated = evaluations["nodes"]
+    assert evaluated.count(grandchild) == 1
+    assert evaluated.index(child) < evaluated.index(grandchild)
+    assert grandchild.value.state
+
+
+def test_transaction_evaluates_chains_top_down(scene, evaluations):
+    root = _root(scene)
+    with scene.evaluation_transaction():
+        chain = [StateNode(scene) for _ in range(20)]
+        # bottom-up, again
+        for parent, child in reversed(list(zip([root, *chain], chain))):
+            _connect(scene, parent, child)
+
+    (batch,) = evaluations["batches"]
+    evaluated = [node for node in evaluations["nodes"] if node in chain]
+    assert list(dict.fromkeys(evaluated)) == chain
+
+
+def test_nested_transactions(scene, evaluations):
+    root = _root(scene)
+    with scene.evaluation_transaction():
+        with scene.evaluation_transaction():
+            child = _connect(scene, root)
+        assert scene.in_evaluation_transaction
+        assert evaluations["batches"] == []
+        grandchild = _connect(scene, child)
+
+    assert not scene.in_evaluation_transaction
+    (batch,) = evaluations["batches"]
+    assert set(batch) == {child, grandchild}
+
+
+def test_aborted_transaction(scene, evaluations):
+    root = _root(scene)
+    with pytest.raises(KeyError):
+        with scene.evaluation_transaction():
+            child = _connect(scene, root)
+            raise KeyError("boom")
+
+    assert not scene.in_evaluation_transaction
+    assert evaluations["batches"] == []
+    # nothing is left deferred: the next transaction doesn't evaluate the child
+    with scene.evaluation_transaction():
+        other = _connect(scene, root)
+    assert evaluations["batches"] == [[other]]
+    assert child not in evaluations["nodes"]
+
+
+def test_failed_save_leaves_scene_modified(main_window, tmp_path):
+    def write(data, filename):
+        raise OSError("disk full")
+
+    # not one of the main window's scenes, which would show an error dialog
+    scene = TheatreScene(main_window)
+    StateNode(scene)
+    scene.autosave.save(str(tmp_path / "scene.theatre"), scene.serialize(), write)
+    scene.has_been_modified = False  # as saveToFile does
+    scene.autosave.flush()
+    QApplication.processEvents()
+    assert scene.has_been_modified
+    scene.autosave.close()
+
+
+def test_save_serializes_only_changes(scene, tmp_path, monkeypatch):
+    nodes = [StateNode(scene) for _ in range(3)]
+    scene.history.storeHistory("add nodes")
+    nodes[0].setPos(100, 100)
+    serialized = []
+    serialize = StateNode.serialize
+
+    def spy(node):
+        serialized.append(node)
+        return serialize(node)
+
+    monkeypatch.setattr(StateNode, "serialize", spy)
+    scene_file = tmp_path / "scene.theatre"
+    scene.saveToFile(str(scene_file))
+    scene.autosave.flush()
+
+    assert serialized == [nodes[0]]
+    monkeypatch.undo()
+    assert read_scene_file(str(scene_file))["nodes"] == json.loads(
+        json.dumps(scene.serialize()["nodes"])
+    )
@@ -0,0 +1,51 @@
+import pytest
+
+from theatre.trace_tree_widget.tidy_tree import tidy_layout
+
+
+def _check(children, pos, distance):
+    for v, kids in enumerate(children):
+        if v not in pos:
+            continue
+        ys = [pos[k] for k in kids]
+        # siblings keep their order, at least distance apart
+        for a, b in zip(ys, ys[1:]):
+            assert b - a >= distance - 1e-9
+        # parents are centered over their children
+        if kids:
+            assert pos[v] == pytest.approx((ys[0] + ys[-1]) / 2)
+
+
+def test_single_node():
+    assert tidy_layout([[]]) == {0: 0.0}
+
+
+def test_siblings_spaced_and_centered():
+    children = [[1, 2, 3], [], [], []]
+    pos = tidy_layout(children, distance=2)
+    assert pos == {0: 0.0, 1: -2.0, 2: 0.0, 3: 2.0}
+
+
+def test_subtrees_dont_overlap():
+    #       0
+    #    1     2
+    #  3 4 5  6 7 8
+    children = [[1, 2], [3, 4, 5], [6, 7, 8], [], [], [], [], [], []]
+    pos = tidy_layout(children)
+    _check(children, pos, 1)
+    assert pos[6] - pos[5] >= 1
+
+
+def test_deep_chain():
+    n = 50_000
+    children = [[i + 1] for i in range(n - 1)] + [[]]
+    pos = tidy_layout(children)
+    assert len(pos) == n
+    assert set(pos.values()) == {0.0}
+
+
+def test_subtree_of_larger_graph():
+    # 1 and 2 are siblings; only lay out the tree rooted at 2
+    children = [[1, 2], [], [3, 4], [], []]
+    pos = tidy_layout(children, root=2)
+    assert pos == {2: 0.0, 3: -0.5, 4: 0.5}
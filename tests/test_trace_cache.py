@@ -0,0 +1,64 @@
+from theatre.trace_tree_widget.trace_cache import TraceCache
+
+
+class Node:
+    def __init__(self, name, previous=None):
+        self.name = name
+        self.previous = previous
+        self.calls = 0
+
+    def get_previous(self):
+        self.calls += 1
+        return self.previous
+
+    def __repr__(self):
+        return self.name
+
+
+def test_trace():
+    root = Node("root")
+    a = Node("a", root)
+    b = Node("b", a)
+    cache = TraceCache()
+    assert cache.get_trace(b) == [root, a, b]
+    assert cache.get_trace(root) == [root]
+
+
+def test_siblings_share_prefix():
+    root = Node("root")
+    a = Node("a", root)
+    b = Node("b", a)
+    c = Node("c", a)
+    cache = TraceCache()
+    cache.get_trace(b)
+    calls = root.calls, a.calls
+    assert cache.get_trace(c) == [root, a, c]
+    # a's trace was already known
+    assert (root.calls, a.calls) == calls
+    assert c.calls == 1
+    assert len(cache) == 4
+
+
+def test_invalidate():
+    root = Node("root")
+    other = Node("other")
+    a = Node("a", root)
+    cache = TraceCache()
+    assert cache.get_trace(a) == [root, a]
+    a.previous = other
+    # still cached
+    assert cache.get_trace(a) == [root, a]
+    version = cache.version
+    cache.invalidate()
+    assert cache.version == version + 1
+    assert cache.get_trace(a) == [other, a]
+
+
+def test_deep_trace():
+    node = Node("0")
+    nodes = [node]
+    for i in range(1, 20_000):
+        node = Node(str(i), node)
+        nodes.append(node)
+    cache = TraceCache()
+    assert cache.get_trace(node) == nodes
@@ -0,0 +1,90 @@
+import pytest
+
+from theatre.trace_query import PatternError, compile_pattern
+
+#   r -install-> a -config_changed-> b -start-> c
+#                |                   b -db_relation_broken-> d
+#                a -db_relation_joined-> e -db_relation_broken-> f
+TREE = {
+    "r": [("install", "a")],
+    "a": [("config_changed", "b"), ("db_relation_joined", "e")],
+    "b": [("start", "c"), ("db_relation_broken", "d")],
+    "e": [("db_relation_broken", "f")],
+}
+ACTIVE = {"r", "a", "c", "e"}
+BLOCKED = {"b", "f"}
+
+
+def _run(pattern, state_sets=()):
+    compiled = compile_pattern(pattern)
+    matches = compiled.run(["r"], lambda node: TREE.get(node, ()), state_sets)
+    return sorted("".join(path) for path in matches)
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    (
+        ("config_changed", ["ab"]),
+        ("*_relation_broken", ["bd", "ef"]),
+        ("install config_changed start", ["rabc"]),
+        ("^ config_changed", []),
+        ("^ install", ["ra"]),
+        ("start $", ["bc"]),
+        ("^ . . . $", ["rabc", "rabd", "raef"]),
+        ("^ .+ $", ["rabc", "rabd", "raef"]),
+        ("^ .{1,2} $", []),
+        ("install .? config_changed", ["rab"]),
+        ("install (config_changed | db_relation_joined) *_broken", ["rabd", "raef"]),
+        ("^ (!*_relation_joined)* *_relation_broken", ["rabd"]),
+        ("(install|start){2}", []),
+    ),
+)
+def test_events(pattern, expected):
+    assert _run(pattern) == expected
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    (
+        # active to blocked within two events; the longest stretch for each end
+        ("[status:active] .{1,2} [status:blocked]", ["aef", "rab"]),
+        ("[status:blocked] .", ["bc", "bd"]),
+        ("[status:blocked] $", ["f"]),
+        ("^ [status:blocked]", []),
+    ),
+)
+def test_state_assertions(pattern, expected):
+    # the pattern's state queries, in order
+    sets = {"status:active": ACTIVE, "status:blocked": BLOCKED}
+    compiled = compile_pattern(pattern)
+    state_sets = [sets[query] for query in compiled.state_queries]
+    matches = compiled.run(["r"], lambda node: TREE.get(node, ()), state_sets)
+    assert sorted("".join(path) for path in matches) == expected
+
+
+def test_longest_match_per_end():
+    # a .* pattern could end at c having started at r, a or b: only r is reported
+    assert _run("install .* start") == ["rabc"]
+
+
+def test_limit():
+    compiled = compile_pattern(".")
+    assert len(compiled.run(["r"], lambda node: TREE.get(node, ()), (), limit=2)) == 2
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    (
+        "",
+        "(install",
+        "install )",
+        "$+",
+        "[status:blocked]{2}",
+        "a{3,1}",
+        "a +",
+        "[leader]",
+    ),
+)
+def test_invalid_pattern(pattern):
+    with pytest.raises(PatternError):
+        compile_pattern(pattern)
@@ -0,0 +1,129 @@
+import json
+import threading
+
+import pytest
+from sample_charm import charm_context
+from scenario import Event, State
+
+from theatre.tracing import Tracer, tracer
+from theatre.trace_tree_widget.scenario_interface import run_scenario
+
+
+def _spans(trace: dict) -> list:
+    return [event for event in trace["traceEvents"] if event["ph"] == "X"]
+
+
+def test_off_records_nothing():
+    recorder = Tracer()
+    with recorder.span("a"):
+        pass
+    # the same do-nothing span every time
+    assert recorder.span("a") is recorder.span("b")
+    assert len(recorder) == 0
+    assert _spans(recorder.to_chrome_trace()) == []
+
+
+def test_spans_nest():
+    recorder = Tracer(enabled=True)
+    with recorder.span("outer", "batch", nodes=2):
+        with recorder.span("inner"):
+            pass
+    inner, outer = _spans(recorder.to_chrome_trace())
+    assert (outer["name"], outer["cat"], outer["args"]) == (
+        "outer",
+        "batch",
+        {"nodes": 2},
+    )
+    assert inner["name"] == "inner" and "args" not in inner
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert inner["tid"] == outer["tid"]
+
+
+def test_traced():
+    recorder = Tracer()
+
+    @recorder.traced("double", "math")
+    def double(x):
+        return 2 * x
+
+    assert double(2) == 4
+    assert len(recorder) == 0
+    recorder.start()
+    assert double(3) == 6
+    (span,) = _spans(recorder.to_chrome_trace())
+    assert (span["name"], span["cat"]) == ("double", "math")
+
+
+def test_errors_are_recorded():
+    recorder = Tracer(enabled=True)
+    with pytest.raises(KeyError):
+        with recorder.span("failing"):
+            raise KeyError("boom")
+    (span,) = _spans(recorder.to_chrome_trace())
+    assert span["args"] == {"error": "KeyError"}
+
+
+def test_one_track_per_thread():
+    recorder = Tracer(enabled=True)
+
+    def work():
+        with recorder.span("work"):
+            pass
+
+    work()
+    worker = threading.Thread(target=work, name="worker")
+    worker.start()
+    worker.join()
+
+    trace = recorder.to_chrome_trace()
+    names = {
+        event["tid"]: event["args"]["name"]
+        for event in trace["traceEvents"]
+        if event["name"] == "thread_name"
+    }
+    assert sorted(names.values()) == ["GUI", "worker"]
+    assert {span["tid"] for span in _spans(trace)} == set(names)
+
+
+def test_oldest_spans_are_dropped():
+    recorder = Tracer(enabled=True, max_events=2)
+    for name in "abc":
+        with recorder.span(name):
+            pass
+    assert [span["name"] for span in _spans(recorder.to_chrome_trace())] == ["b", "c"]
+    recorder.clear()
+    assert len(recorder) == 0
+
+
+def test_dump(tmp_path):
+    recorder = Tracer(enabled=True)
+    with recorder.span("a", state=State()):  # not json: written as str
+        pass
+    path = tmp_path / "timeline.json"
+    recorder.dump(str(path))
+    trace = json.loads(path.read_text())
+    assert trace["displayTimeUnit"] == "ms"
+    assert [span["name"] for span in _spans(trace)] == ["a"]
+
+
+@pytest.fixture
+def recording():
+    tracer.clear()
+    tracer.start()
+    yield tracer
+    tracer.stop()
+    tracer.clear()
+
+
+def test_run_scenario_spans(recording):
+    run_scenario(charm_context(), State(), Event("start"))
+    names = [span["name"] for span in _spans(recording.to_chrome_trace())]
+    for name in (
+        "run scenario",
+        "event.bind",
+        "context.run",
+        "consistency check",
+        "emit",
+    ):
+        assert name in names
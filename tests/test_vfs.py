@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from theatre import config, vfs
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    if not vfs.memory_backend_available():
+        pytest.skip("no tmpfs available on this system")
+    monkeypatch.setattr(config, "VFS_BACKEND", vfs.MEMORY)
+
+
+def test_disk_backend_default():
+    assert vfs.get_backend() == vfs.DISK
+    assert vfs.get_vfs_parent_dir() is None
+
+
+def test_unknown_backend_falls_back_to_disk(monkeypatch):
+    monkeypatch.setattr(config, "VFS_BACKEND", "floppy")
+    assert vfs.get_backend() == vfs.DISK
+
+
+def test_memory_backend_unavailable(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "VFS_BACKEND", vfs.MEMORY)
+    monkeypatch.setattr(vfs, "SHM_ROOT", tmp_path / "not-there")
+    assert vfs.get_backend() == vfs.DISK
+
+
+def test_memory_backend_root(memory_backend):
+    root = Path(vfs.make_vfs_root())
+    assert root.is_dir()
+    assert root.parent == vfs.SHM_ROOT / f"theatre-{os.getpid()}"
+
+
+def _mount_roots(tmp_path):
+    root = tmp_path / "foo-mount"
+    root.mkdir()
+    root.joinpath("a.yaml").write_text("a")
+    root.joinpath("sub").mkdir()
+    root.joinpath("sub", "b.yaml").write_text("b")
+    return root, {"foo/opt": root}
+
+
+def test_manifest(tmp_path):
+    _, roots = _mount_roots(tmp_path)
+    manifest = vfs.build_manifest(roots)
+    assert set(manifest) == {"foo/opt/a.yaml", "foo/opt/sub/b.yaml"}
+    assert manifest["foo/opt/a.yaml"].size == 1
+
+
+def test_manifest_reuses_unchanged_entries(tmp_path, monkeypatch):
+    root, roots = _mount_roots(tmp_path)
+    previous = vfs.build_manifest(roots)
+    root.joinpath("c.yaml").write_text("c")
+
+    hashed = []
+    _hash_file = vfs._hash_file
+    monkeypatch.setattr(
+        vfs, "_hash_file", lambda path: hashed.append(path) or _hash_file(path)
+    )
+    manifest = vfs.build_manifest(roots, previous=previous)
+    assert hashed == [root / "c.yaml"]
+    assert manifest["foo/opt/a.yaml"] is previous["foo/opt/a.yaml"]
+
+
+def test_manifest_diff(tmp_path):
+    root, roots = _mount_roots(tmp_path)
+    old = vfs.build_manifest(roots)
+
+    root.joinpath("a.yaml").write_text("aaa")
+    root.joinpath("sub", "b.yaml").unlink()
+    root.joinpath("c.yaml").write_text("c")
+    new = vfs.build_manifest(roots, previous=old)
+
+    diff = vfs.diff_manifests(old, new)
+    assert diff.added == ("foo/opt/c.yaml",)
+    assert diff.removed == ("foo/opt/sub/b.yaml",)
+    assert diff.modified == ("foo/opt/a.yaml",)
+    assert not vfs.diff_manifests(new, new)
@@ -0,0 +1,342 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Background autosave and saving of scenes.
+
+Charms run in-process, so a charm that brings theatre down takes all unsaved
+edits with it. To avoid that, every change recorded by the scene history is
+appended (as the nodes and edges it changed) to a journal file next to the
+scene file. Every AUTOSAVE_COMPACT_EVERY records, the journal is compacted into
+an (atomically written) snapshot of the whole scene, and emptied.
+
+For a scene saved as ``foo.theatre``:
+    - ``.foo.theatre.journal``: one json record per line:
+      ``{"seq": int, "nodes": {id: data or null}, "edges": {id: data or null}}``;
+      ``"full": true`` means the record replaces all nodes and edges.
+    - ``.foo.theatre.autosave``: ``{"seq": int, "scene": SerializedScene}``, where
+      seq is that of the last record the snapshot includes.
+
+Both files are removed when the scene is saved, and left alone otherwise: if
+they are there when the scene is opened, the last session ended before saving
+and `recover` can bring its changes back.
+
+All file writing, saving the scene itself included, happens on a background
+thread: the GUI thread only hands over data it already has.
+"""
+
+import json
+import os
+import queue
+import tempfile
+import threading
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+from qtpy.QtCore import QObject, Signal
+
+from theatre import config
+from theatre.logger import logger as theatre_logger
+
+if typing.TYPE_CHECKING:
+    from theatre.theatre_scene import SerializedScene, TheatreScene
+
+logger = theatre_logger.getChild("autosave")
+
+JOURNAL_SUFFIX = ".journal"
+SNAPSHOT_SUFFIX = ".autosave"
+
+ItemChanges = typing.Dict[int, typing.Optional[dict]]
+"""Mapping from node or edge id to its new serialized data; None if removed."""
+
+
+def journal_path(scene_file: typing.Union[str, Path]) -> Path:
+    scene_file = Path(scene_file)
+    return scene_file.with_name(f".{scene_file.name}{JOURNAL_SUFFIX}")
+
+
+def snapshot_path(scene_file: typing.Union[str, Path]) -> Path:
+    scene_file = Path(scene_file)
+    return scene_file.with_name(f".{scene_file.name}{SNAPSHOT_SUFFIX}")
+
+
+def has_autosave(scene_file: typing.Union[str, Path]) -> bool:
+    """Whether there are unsaved changes to this scene from a previous session."""
+    return journal_path(scene_file).exists() or snapshot_path(scene_file).exists()
+
+
+def discard_autosave(scene_file: typing.Union[str, Path]):
+    for path in (journal_path(scene_file), snapshot_path(scene_file)):
+        path.unlink(missing_ok=True)
+
+
+def atomic_write(path: typing.Union[str, Path], data: bytes):
+    """Write to a temporary file next to path, then move it in place.
+
+    Readers (and crashes) only ever see either the old or the new file.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _index(items: typing.Iterable[dict]) -> typing.Dict[int, dict]:
+    return {item["id"]: item for item in items}
+
+
+def _apply_changes(items: typing.Dict[int, dict], changes: dict, full: bool):
+    if full:
+        items.clear()
+    for item_id, data in changes.items():
+        # json object keys are strings
+        item_id = int(item_id)
+        if data is None:
+            items.pop(item_id, None)
+        else:
+            items[item_id] = data
+
+
+def _read_journal(path: Path) -> typing.Iterator[dict]:
+    if not path.exists():
+        return
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # the last record may have been cut short by a crash
+                logger.warning(f"skipping truncated record in {path}")
+                return
+
+
+def recover(
+    scene_file: typing.Union[str, Path], base: "SerializedScene"
+) -> "SerializedScene":
+    """Reconstruct the unsaved scene from the autosave files.
+
+    Base is the scene as saved in scene_file, i.e. what the journal applies to.
+    """
+    scene, seq = base, -1
+    snapshot = snapshot_path(scene_file)
+    if snapshot.exists():
+        payload = json.loads(snapshot.read_text())
+        scene, seq = payload["scene"], payload["seq"]
+
+    nodes, edges = _index(scene["nodes"]), _index(scene["edges"])
+    for record in _read_journal(journal_path(scene_file)):
+        if record["seq"] <= seq:
+            # already in the snapshot
+            continue
+        full = record.get("full", False)
+        _apply_changes(nodes, record["nodes"], full)
+        _apply_changes(edges, record["edges"], full)
+    return {**scene, "nodes": list(nodes.values()), "edges": list(edges.values())}
+
+
+@dataclass
+class _Base:
+    """The scene as it is on disk: what the following records apply to."""
+
+    filename: str
+    scene: dict
+    nodes: typing.Dict[int, dict]
+    edges: typing.Dict[int, dict]
+
+
+@dataclass
+class _Record:
+    nodes: ItemChanges
+    edges: ItemChanges
+    full: bool = False
+
+
+@dataclass
+class _Save:
+    filename: str
+    data: "SerializedScene"
+    write: typing.Callable[["SerializedScene", str], None]
+
+
+@dataclass
+class _Discard:
+    pass
+
+
+_STOP = object()
+
+
+class Autosave(QObject):
+    """Journals the changes to a scene, and saves it, on a background thread."""
+
+    save_failed = Signal(str)
+
+    def __init__(self, scene: "TheatreScene"):
+        super().__init__()
+        self.scene = scene
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: typing.Optional[threading.Thread] = None
+        scene.history.addHistoryModifiedListener(self._on_history_modified)
+
+        # writer thread state: the scene as of the last record we journaled
+        self._filename: typing.Optional[str] = None
+        self._scene: typing.Optional[dict] = None
+        self._nodes: typing.Optional[typing.Dict[int, dict]] = None
+        self._edges: typing.Optional[typing.Dict[int, dict]] = None
+        self._seq = 0
+        self._since_snapshot = 0
+
+    def _put(self, job):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="theatre-autosave", daemon=True
+            )
+            self._thread.start()
+        self._queue.put(job)
+
+    def _on_history_modified(self):
+        scene = self.scene
+        if not config.AUTOSAVE or not scene.filename:
+            return
+        history = scene.history
+        changes = history.last_changes
+        if changes is None and not scene.has_been_modified:
+            # freshly loaded or saved: the file on disk is what we journal against
+            self._put(
+                _Base(
+                    scene.filename,
+                    {
+                        "id": scene.id,
+                        "scene_width": scene.scene_width,
+                        "scene_height": scene.scene_height,
+                    },
+                    dict(history.current_nodes),
+                    dict(history.current_edges),
+                )
+            )
+        elif changes is None:
+            self._put(
+                _Record(
+                    dict(history.current_nodes), dict(history.current_edges), full=True
+                )
+            )
+        else:
+            self._put(_Record(*changes))
+
+    def save(
+        self,
+        filename: str,
+        data: "SerializedScene",
+        write: typing.Callable[["SerializedScene", str], None],
+    ):
+        """Write the scene to filename with write(data, filename), in the background.
+
+        The journal is dropped once the scene is safely on disk.
+        """
+        self._put(_Save(filename, data, write))
+
+    def discard(self):
+        """Forget about the changes journaled so far."""
+        self._put(_Discard())
+
+    def flush(self):
+        """Wait until everything queued so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    # writer thread
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self._handle(job)
+            except Exception as e:
+                logger.error(
+                    f"autosave: {job.__class__.__name__} failed", exc_info=True
+                )
+                if isinstance(job, _Save):
+                    self.save_failed.emit(f"could not save {job.filename}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _handle(self, job):
+        if isinstance(job, _Base):
+            self._filename = job.filename
+            self._scene, self._nodes, self._edges = job.scene, job.nodes, job.edges
+            self._seq = self._since_snapshot = 0
+        elif isinstance(job, _Record):
+            self._append(job)
+        elif isinstance(job, _Save):
+            job.write(job.data, job.filename)
+            logger.info(f"saved scene to {job.filename}")
+            # the scene might have been saved under a new name
+            if self._filename and self._filename != job.filename:
+                discard_autosave(self._filename)
+            discard_autosave(job.filename)
+            self._filename = job.filename
+            self._scene = {
+                k: v for k, v in job.data.items() if k not in ("nodes", "edges")
+            }
+            self._nodes, self._edges = _index(job.data["nodes"]), _index(
+                job.data["edges"]
+            )
+            self._seq = self._since_snapshot = 0
+        elif isinstance(job, _Discard):
+            if self._filename:
+                discard_autosave(self._filename)
+            self._since_snapshot = 0
+
+    def _append(self, record: _Record):
+        if not self._filename:
+            return
+        if not (record.nodes or record.edges or record.full):
+            return
+        self._seq += 1
+        line = json.dumps(
+            {
+                "seq": self._seq,
+                "nodes": record.nodes,
+                "edges": record.edges,
+                **({"full": True} if record.full else {}),
+            },
+            separators=(",", ":"),
+        )
+        with open(journal_path(self._filename), "a") as file:
+            file.write(line + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        if self._nodes is not None:
+            _apply_changes(self._nodes, record.nodes, record.full)
+            _apply_changes(self._edges, record.edges, record.full)
+            self._since_snapshot += 1
+            if self._since_snapshot >= config.AUTOSAVE_COMPACT_EVERY:
+                self._compact()
+
+    def _compact(self):
+        """Fold the journal into a snapshot of the whole scene."""
+        scene = {
+            **self._scene,
+            "nodes": list(self._nodes.values()),
+            "edges": list(self._edges.values()),
+        }
+        payload = json.dumps({"seq": self._seq, "scene": scene}, separators=(",", ":"))
+        atomic_write(snapshot_path(self._filename), payload.encode("utf-8"))
+        # if we crash right here, recover skips the records the snapshot includes
+        journal_path(self._filename).unlink(missing_ok=True)
+        self._since_snapshot = 0
+        logger.debug(f"compacted autosave journal of {self._filename}")
@@ -0,0 +1,164 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""List model over charm (juju-log) logs, for the logs view.
+
+Lines are kept as they come, and filtered into a list of the row numbers to
+show; the view only ever asks for the rows it's painting. Lines can be added
+at the end (or dropped from it) without resetting the model, so the view keeps
+its scroll position while logs stream in.
+"""
+
+import bisect
+import itertools
+import re
+import typing
+
+from qtpy.QtCore import QAbstractListModel, QModelIndex, Qt
+from scenario.state import JujuLogLine
+
+from theatre.helpers import get_color
+from theatre.state_tree_model import MAX_TOOLTIP_LENGTH
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+MAX_LINE_LENGTH = 500
+"""Longer messages are cut short in the view (but not in their tooltips)."""
+
+_LEVEL_COLORS = {
+    "WARNING": "pastel orange",
+    "ERROR": "pastel red",
+    "CRITICAL": "pastel red",
+}
+
+
+def _level_rank(level: str) -> int:
+    # unknown levels (e.g. juju's TRACE) count as the lowest
+    level = level.upper()
+    return LEVELS.index(level) if level in LEVELS else 0
+
+
+def _truncated(text: str, length: int) -> str:
+    return text if len(text) <= length else text[: length - 1] + "…"
+
+
+class LogFilter(typing.NamedTuple):
+    min_level: str = "DEBUG"
+    pattern: typing.Optional[typing.Pattern] = None
+    """Searched for in the message, and in the source."""
+
+    @property
+    def is_trivial(self) -> bool:
+        return self.pattern is None and _level_rank(self.min_level) == 0
+
+
+def compile_filter(min_level: str = "DEBUG", text: str = "") -> LogFilter:
+    """A case-insensitive regex filter; raises re.error if text isn't a valid one."""
+    return LogFilter(min_level, re.compile(text, re.IGNORECASE) if text else None)
+
+
+class CharmLogModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lines: typing.List[JujuLogLine] = []
+        # where each line comes from, e.g. the node that logged it
+        self._sources: typing.List[str] = []
+        self._filter = LogFilter()
+        # indices of the lines passing the filter
+        self._rows: typing.List[int] = []
+        self.show_sources = False
+
+    @property
+    def total(self) -> int:
+        """The number of lines, filtered or not."""
+        return len(self._lines)
+
+    @property
+    def log_filter(self) -> LogFilter:
+        return self._filter
+
+    def clear(self):
+        self.beginResetModel()
+        self._lines = []
+        self._sources = []
+        self._rows = []
+        self.endResetModel()
+
+    def set_filter(self, log_filter: LogFilter):
+        self.beginResetModel()
+        self._filter = log_filter
+        self._rows = self._filtered(0)
+        self.endResetModel()
+
+    def _filtered(self, start: int) -> typing.List[int]:
+        """The indices of the lines from start on that pass the filter."""
+        lines, sources = self._lines, self._sources
+        log_filter = self._filter
+        if log_filter.is_trivial:
+            return list(range(start, len(lines)))
+
+        min_rank = _level_rank(log_filter.min_level)
+        search = log_filter.pattern.search if log_filter.pattern else None
+        ranks: typing.Dict[str, int] = {}  # there's only ever a handful of levels
+        out = []
+        for i in range(start, len(lines)):
+            level, message = lines[i]
+            rank = ranks.get(level)
+            if rank is None:
+                rank = ranks[level] = _level_rank(level)
+            if rank < min_rank:
+                continue
+            if search and not (search(message) or search(sources[i])):
+                continue
+            out.append(i)
+        return out
+
+    def append(self, source: str, lines: typing.Sequence[JujuLogLine]):
+        """Add lines at the end; only the visible ones are inserted in the view."""
+        start = len(self._lines)
+        self._lines.extend(lines)
+        self._sources.extend(itertools.repeat(source, len(lines)))
+        new_rows = self._filtered(start)
+        if not new_rows:
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(new_rows) - 1)
+        self._rows.extend(new_rows)
+        self.endInsertRows()
+
+    def truncate(self, length: int):
+        """Drop all lines past the first length."""
+        if length >= len(self._lines):
+            return
+        del self._lines[length:]
+        del self._sources[length:]
+        # rows are sorted: drop those pointing past the end
+        first = bisect.bisect_left(self._rows, length)
+        if first < len(self._rows):
+            self.beginRemoveRows(QModelIndex(), first, len(self._rows) - 1)
+            del self._rows[first:]
+            self.endRemoveRows()
+
+    def line(self, row: int) -> typing.Tuple[str, JujuLogLine]:
+        """The source and the line at a (visible) row."""
+        i = self._rows[row]
+        return self._sources[i], self._lines[i]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        source, (level, message) = self.line(index.row())
+        if role == Qt.DisplayRole:
+            # one line per row, or uniform row heights won't hold
+            first_line, _, rest = message.partition("\n")
+            text = f"{level} {first_line}{' …' if rest else ''}"
+            if self.show_sources:
+                text = f"[{source}] {text}"
+            return _truncated(text, MAX_LINE_LENGTH)
+        if role == Qt.ToolTipRole:
+            return _truncated(message, MAX_TOOLTIP_LENGTH)
+        if role == Qt.ForegroundRole:
+            color = _LEVEL_COLORS.get(level.upper())
+            return get_color(color) if color else None
+        return None
@@ -8,3 +8,48 @@ TEMPLATES_DIR = RESOURCES_DIR / "templates"
 SCENE_EXTENSION = ".theatre"
 SCENE_FILE_TYPE = f"Scene (*{SCENE_EXTENSION});;All files (*)"
 PYTHON_SOURCE_TYPE = "Python source (*.py);;All files (*)"
+
+# where the simulated container filesystems of each node live:
+#  - "disk": a regular temporary directory (default)
+#  - "memory": a tmpfs-backed directory under /dev/shm (linux only)
+VFS_BACKEND = os.getenv("THEATRE_VFS_BACKEND", "disk")
+
+# on-disk format of saved scenes (both can always be opened):
+#  - "json": a single json document (default)
+#  - "packed": a compressed, indexed record stream whose custom states are only
+#    decoded when needed; see theatre.scene_format
+SCENE_FORMAT = os.getenv("THEATRE_SCENE_FORMAT", "json")
+
+# undo history: max number of steps, and (roughly) how many bytes they may take up
+HISTORY_LIMIT = int(os.getenv("THEATRE_HISTORY_LIMIT", 256))
+HISTORY_MEMORY_BUDGET = int(os.getenv("THEATRE_HISTORY_MEMORY_BUDGET", 64 * 2**20))
+
+# journal unsaved scene changes next to the scene file, to recover them after a crash
+AUTOSAVE = os.getenv("THEATRE_AUTOSAVE", "1") == "1"
+# fold the journal into a full snapshot every so many changes
+AUTOSAVE_COMPACT_EVERY = int(os.getenv("THEATRE_AUTOSAVE_COMPACT_EVERY", 100))
+
+# how many evaluated node outputs to keep around for undo/redo to reattach
+OUTPUT_CACHE_SIZE = int(os.getenv("THEATRE_OUTPUT_CACHE_SIZE", 1024))
+
+# record all evaluation results in <charm repo>/.theatre/results.db, to search them
+# and to reopen scenes without running the charm again; see theatre.results_store
+RESULTS_STORE = os.getenv("THEATRE_RESULTS_STORE", "1") == "1"
+
+# how "Profile evaluation" captures profiles; see theatre.profiling:
+#  - "cprofile": deterministic, exportable as .prof (default)
+#  - "sampling": samples the evaluating thread's stack; much lower overhead
+PROFILER = os.getenv("THEATRE_PROFILER", "cprofile")
+
+# measure the memory allocated by each evaluation with tracemalloc (slow);
+# can also be toggled from the Window menu. See theatre.memory_profiling
+MEASURE_MEMORY = os.getenv("THEATRE_MEASURE_MEMORY", "0") == "1"
+
+# record a timeline of the evaluation pipeline from startup, to export for Perfetto;
+# can also be toggled from the Window menu. See theatre.tracing
+TRACE_EVALUATIONS = os.getenv("THEATRE_TRACE_EVALUATIONS", "0") == "1"
+
+# serve process-level metrics (evaluations, caches, queues, simulated filesystems)
+# on http://localhost:<port>/metrics, in Prometheus' text format, and as json on
+# /metrics.json; 0 doesn't serve them (default). See theatre.metrics
+METRICS_PORT = int(os.getenv("THEATRE_METRICS_PORT", 0))
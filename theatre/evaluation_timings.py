@@ -0,0 +1,109 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""How long the nodes of a scene took to evaluate, for the heatmap and the slowest nodes dock.
+
+Only evaluations run in this session are timed: outputs restored from the
+results store or the output cache keep the timing they were recorded with, if
+any.
+"""
+
+import math
+import typing
+
+from theatre.trace_tree_widget.structs import EvaluationTiming
+
+_K = typing.TypeVar("_K", bound=typing.Hashable)
+
+
+class EvaluationTimings(typing.Generic[_K]):
+    """The timing of the last evaluation of each node."""
+
+    def __init__(self):
+        self._timings: typing.Dict[_K, EvaluationTiming] = {}
+        # (fastest, slowest) wall time; None when it needs recomputing
+        self._range: typing.Optional[typing.Tuple[float, float]] = None
+
+    def __len__(self):
+        return len(self._timings)
+
+    def __contains__(self, key: _K):
+        return key in self._timings
+
+    def get(self, key: _K) -> typing.Optional[EvaluationTiming]:
+        return self._timings.get(key)
+
+    def update(self, key: _K, timing: typing.Optional[EvaluationTiming]) -> bool:
+        """Set (or with None, drop) the timing of key.
+
+        Returns whether the fastest or slowest time changed, i.e. whether the
+        heat of the other nodes did.
+        """
+        old = self._timings.pop(key, None)
+        if timing is not None:
+            self._timings[key] = timing
+        if old is None and timing is None:
+            return False
+        before = self._range
+        self._range = None
+        return self.range != before
+
+    def discard(self, key: _K) -> bool:
+        return self.update(key, None)
+
+    def clear(self):
+        self._timings.clear()
+        self._range = None
+
+    @property
+    def range(self) -> typing.Optional[typing.Tuple[float, float]]:
+        """The fastest and slowest wall times, if anything was timed."""
+        if self._range is None and self._timings:
+            walls = [timing.wall for timing in self._timings.values()]
+            self._range = (min(walls), max(walls))
+        return self._range
+
+    def heat(self, key: _K) -> typing.Optional[float]:
+        """Where key's wall time sits between the fastest (0) and slowest (1) one.
+
+        On a log scale: evaluation times easily span orders of magnitude, and a
+        single slow node shouldn't make all others look equally fast.
+        """
+        timing = self._timings.get(key)
+        if timing is None:
+            return None
+        fastest, slowest = self.range
+        # avoid log(0) on clocks with a coarse resolution
+        fastest = max(fastest, 1e-6)
+        if slowest <= fastest:
+            return 0.0
+        wall = min(max(timing.wall, fastest), slowest)
+        return math.log(wall / fastest) / math.log(slowest / fastest)
+
+    def slowest(
+        self, n: typing.Optional[int] = None
+    ) -> typing.List[typing.Tuple[_K, EvaluationTiming]]:
+        """The (n) slowest nodes and their timings, slowest first."""
+        ranked = sorted(
+            self._timings.items(), key=lambda item: item[1].wall, reverse=True
+        )
+        return ranked if n is None else ranked[:n]
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+def format_timing(timing: EvaluationTiming) -> str:
+    """One line per phase, e.g. for tooltips."""
+    return "\n".join(
+        (
+            f"evaluated in {format_duration(timing.wall)} "
+            f"(cpu {format_duration(timing.cpu)})",
+            f"  consistency checks: {format_duration(timing.consistency)}",
+            f"  charm setup: {format_duration(timing.setup)}",
+            f"  event handlers: {format_duration(timing.handler)}",
+            f"  other: {format_duration(timing.other)}",
+        )
+    )
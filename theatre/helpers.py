@@ -1,5 +1,6 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
+import functools
 import importlib
 import sys
 import types
@@ -21,6 +22,7 @@ logger = theatre_logger.getChild("helpers")
 
 ColorType = typing.Union[str, typing.Tuple[int, int, int]]
 DEFAULT_ICON_PIXMAP_RESOLUTION = 100
+_ICON_CACHE: typing.Dict[typing.Tuple[str, typing.Tuple[str, ...], str], QIcon] = {}
 CUSTOM_COLORS = {
     # state node icon
     "invalid": (138, 0, 0),
@@ -39,19 +41,26 @@ CUSTOM_COLORS = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def _get_named_color(color: str) -> QColor:
+    for db in (CUSTOM_COLORS, X11_COLORS):
+        if mapped_color := db.get(color, None):
+            return (
+                QColor(mapped_color)
+                if isinstance(mapped_color, str)
+                else QColor(*mapped_color)
+            )
+    raise RuntimeError(f"invalid input: unable to map {color} to QColor.")
+
+
 def get_color(color: ColorType):
     if isinstance(color, QColor):
         return color
     elif isinstance(color, tuple):
         return QColor(*color)
     elif isinstance(color, str):
-        for db in (CUSTOM_COLORS, X11_COLORS):
-            if mapped_color := db.get(color, None):
-                return (
-                    QColor(mapped_color)
-                    if isinstance(mapped_color, str)
-                    else QColor(*mapped_color)
-                )
+        # return a copy: callers are free to mutate it
+        return QColor(_get_named_color(color))
     raise RuntimeError(f"invalid input: unable to map {color} to QColor.")
 
 
@@ -104,6 +113,11 @@ def get_icon(
     if color:
         return colorized(name, get_color(color))
 
+    # every node and edge asks for its icons: only hit the disk once per icon.
+    key = (name, tuple(path), suffix)
+    if cached := _ICON_CACHE.get(key):
+        return cached
+
     path = RESOURCES_DIR.joinpath(*path) / name
     filename = path.with_suffix(f".{suffix}")
 
@@ -115,7 +129,8 @@ def get_icon(
             return get_icon("bolt")
 
     abspath_str = str(filename.absolute())
-    return QIcon(abspath_str)
+    icon = _ICON_CACHE[key] = QIcon(abspath_str)
+    return icon
 
 
 _EVENT_SUFFIX_TO_ICON_NAME = {
@@ -3,12 +3,13 @@
 import os
 import sys
 import typing
+from functools import partial
 from importlib.metadata import version
 from pathlib import Path
 
 from nodeeditor.node_editor_window import NodeEditorWindow
 from nodeeditor.utils import dumpException, loadStylesheets
-from qtpy.QtCore import QSettings, QSignalMapper, Qt
+from qtpy.QtCore import QSettings, QSignalMapper, Qt, QTimer
 from qtpy.QtGui import QKeySequence
 from qtpy.QtWidgets import (
     QAction,
@@ -19,20 +20,28 @@ from qtpy.QtWidgets import (
     QWidget,
 )
 
-from theatre import __version__, config
+from theatre import __version__, config, metrics
 from theatre.charm_repo_tools import CharmRepo, load_charm_context
 from theatre.config import SCENE_EXTENSION, SCENE_FILE_TYPE
 from theatre.dialogs.context_loader import CharmCtxLoaderDialog
 from theatre.helpers import get_icon, show_error_dialog, toggle_visible
 from theatre.logger import logger as theatre_logger
+from theatre.profile_view import ProfileView
+from theatre.results_store import RESULTS_DB, ResultsStore, charm_fingerprint
+from theatre.slowest_nodes import SlowestNodesWidget
+from theatre.state_query import StateQueryWidget
 from theatre.trace_inspector import TraceInspectorWidget
 from theatre.trace_tree_widget.library_widget import Library
 from theatre.trace_tree_widget.node_editor_widget import NodeEditorWidget
+from theatre.trace_tree_widget.state_node import StateNode
+from theatre.tracing import tracer
 
 if typing.TYPE_CHECKING:
     from scenario import Context
     from scenario.state import _CharmSpec
 
+    from theatre.profiling import Profile
+
 
 logger = theatre_logger.getChild(__file__)
 
@@ -53,6 +62,12 @@ class TheatreMainWindow(NodeEditorWindow):
         from scenario import Context
 
         self._repo: typing.Optional["CharmRepo"] = None
+        self._results_store: typing.Optional[ResultsStore] = None
+        self.show_heatmap = False
+        """Whether nodes are tinted by how long they took to evaluate."""
+        self.measure_memory = config.MEASURE_MEMORY
+        """Whether evaluations are run with tracemalloc on."""
+        self._metrics_server = None
         self._charm_ctx: Context | None = None
         self._charm_spec: _CharmSpec | None = None
         super().__init__()
@@ -118,6 +133,33 @@ class TheatreMainWindow(NodeEditorWindow):
         trace_inspector_dock.setFloating(False)
         self.addDockWidget(Qt.RightDockWidgetArea, trace_inspector_dock)
 
+        self._state_query = state_query = StateQueryWidget(self)
+        self._state_query_dock = state_query_dock = QDockWidget("State Query")
+        state_query_dock.setWidget(state_query)
+        state_query_dock.setFloating(False)
+        self.addDockWidget(Qt.RightDockWidgetArea, state_query_dock)
+        state_query_dock.hide()
+        self.mdiArea.subWindowActivated.connect(state_query.schedule_refresh)
+
+        self._slowest_nodes = slowest_nodes = SlowestNodesWidget(self)
+        self._slowest_nodes_dock = slowest_nodes_dock = QDockWidget("Slowest Nodes")
+        slowest_nodes_dock.setWidget(slowest_nodes)
+        slowest_nodes_dock.setFloating(False)
+        self.addDockWidget(Qt.RightDockWidgetArea, slowest_nodes_dock)
+        slowest_nodes_dock.hide()
+        self.mdiArea.subWindowActivated.connect(slowest_nodes.schedule_refresh)
+
+        self._profile_view = profile_view = ProfileView(self)
+        self._profile_view_dock = profile_view_dock = QDockWidget("Profiler")
+        profile_view_dock.setWidget(profile_view)
+        profile_view_dock.setFloating(False)
+        self.addDockWidget(Qt.BottomDockWidgetArea, profile_view_dock)
+        profile_view_dock.hide()
+
+        metrics.REGISTRY.add_sampler(self._sample_metrics)
+        if config.METRICS_PORT:
+            self._serve_metrics(config.METRICS_PORT)
+
         self.createActions()
         self.createMenus()
         self.create_toolbars()
@@ -149,6 +191,11 @@ class TheatreMainWindow(NodeEditorWindow):
             event.ignore()
         else:
             self.writeSettings()
+            if self._results_store is not None:
+                # let it finish writing
+                self._results_store.close()
+            if self._metrics_server is not None:
+                self._metrics_server.shutdown()
             event.accept()
             # hacky fix for PyQt 5.14.x
             import sys
@@ -228,6 +275,69 @@ class TheatreMainWindow(NodeEditorWindow):
             checkable=True,
         )
 
+        self.actToggleStateQuery = QAction(
+            "Show State &Query",
+            self,
+            statusTip="Toggle the visibility of the state query widget.",
+            triggered=partial(toggle_visible, self._state_query_dock),
+            checkable=True,
+        )
+
+        self.actToggleSlowestNodes = QAction(
+            "Show &Slowest Nodes",
+            self,
+            statusTip="Toggle the visibility of the slowest nodes widget.",
+            triggered=partial(toggle_visible, self._slowest_nodes_dock),
+            checkable=True,
+        )
+
+        self.actToggleProfiler = QAction(
+            "Show &Profiler",
+            self,
+            statusTip="Toggle the visibility of the profiler widget.",
+            triggered=partial(toggle_visible, self._profile_view_dock),
+            checkable=True,
+        )
+
+        self.actToggleMeasureMemory = QAction(
+            "Measure &Memory Use",
+            self,
+            statusTip="Trace the memory allocated by evaluations from now on (slow).",
+            triggered=self._toggle_measure_memory,
+            checkable=True,
+        )
+
+        self.actToggleHeatmap = QAction(
+            "Show Evaluation &Heatmap",
+            self,
+            statusTip="Tint nodes by how long they took to evaluate.",
+            triggered=self._toggle_heatmap,
+            checkable=True,
+        )
+
+        self.actToggleTimeline = QAction(
+            "Record Evaluation &Timeline",
+            self,
+            statusTip="Record where evaluations spend their time, to export for Perfetto.",
+            triggered=self._toggle_timeline,
+            checkable=True,
+        )
+
+        self.actExportTimeline = QAction(
+            "Export Evaluation Timeline...",
+            self,
+            statusTip="Save the recorded evaluation timeline as Chrome trace JSON.",
+            triggered=self._on_export_timeline,
+        )
+
+        self.actFindStates = QAction(
+            "&Find States...",
+            self,
+            shortcut=QKeySequence.Find,
+            statusTip="Find evaluated states matching a query.",
+            triggered=self._on_find_states,
+        )
+
         self.actNewState = QAction(
             "New State",
             self,
@@ -235,6 +345,20 @@ class TheatreMainWindow(NodeEditorWindow):
             triggered=self._on_new_custom_state,
         )
 
+        self.actExportJson = QAction(
+            "Export as &JSON...",
+            self,
+            statusTip="Save a copy of the current scene as plain json.",
+            triggered=self.onFileExportJson,
+        )
+
+        self.actExportMetrics = QAction(
+            "Export &Metrics...",
+            self,
+            statusTip="Save the evaluation, cache and filesystem metrics as json.",
+            triggered=self._on_export_metrics,
+        )
+
         self.actLoadCharm = QAction(
             "Load Charm Context",
             self,
@@ -269,13 +393,36 @@ class TheatreMainWindow(NodeEditorWindow):
         self.setTitle()
         return True
 
+    @property
+    def results_store(self) -> typing.Optional[ResultsStore]:
+        return self._results_store
+
     def _set_repo(self, repo: "CharmRepo"):
         self._repo = repo
+        self._open_results_store(repo)
         ctx = repo.load_context()
         self._update_charm_context(ctx)
 
+    def _open_results_store(self, repo: "CharmRepo"):
+        if self._results_store is not None:
+            self._results_store.close()
+            self._results_store = None
+        if not config.RESULTS_STORE:
+            return
+        try:
+            self._results_store = ResultsStore(repo.theatre_dir / RESULTS_DB)
+        except Exception:
+            # theatre works just as well without
+            logger.error("could not open the results store", exc_info=True)
+
     def _update_charm_context(self, ctx: "Context"):
         self._charm_ctx = ctx
+        # outputs evaluated against another charm are no good anymore
+        for window in self.mdiArea.subWindowList():
+            window.widget().scene.output_cache.clear()
+        if self._results_store is not None:
+            repo_root = self._repo.root if self._repo else None
+            self._results_store.charm_version = charm_fingerprint(ctx, repo_root)
         self.setTitle()
 
     def _on_new_custom_state(self):
@@ -341,6 +488,25 @@ class TheatreMainWindow(NodeEditorWindow):
 
         return True
 
+    def onFileExportJson(self):
+        editor: NodeEditorWidget = self.current_node_editor
+        if not editor:
+            self.statusBar().showMessage("No editor; nothing to export.", 5000)
+            return False
+
+        fname, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export graph as json",
+            str(self.getFileDialogDirectory()),
+            "JSON (*.json);;All files (*)",
+        )
+        if not fname:
+            return False
+
+        editor.scene.export_json(fname)
+        self.statusBar().showMessage(f"Exported to {fname}", 5000)
+        return True
+
     def get_title(self):
         """Generate window title."""
         charm_type = (
@@ -440,6 +606,8 @@ class TheatreMainWindow(NodeEditorWindow):
 
     def createFileMenu(self):
         super().createFileMenu()
+        self.fileMenu.addAction(self.actExportJson)
+        self.fileMenu.addAction(self.actExportMetrics)
         self.fileMenu.addSeparator()
         self.fileMenu.addAction(self.actLoadCharm)
 
@@ -455,6 +623,8 @@ class TheatreMainWindow(NodeEditorWindow):
         self.helpMenu = self.menuBar().addMenu("&Help")
         self.helpMenu.addAction(self.actAbout)
 
+        self.editMenu.addSeparator()
+        self.editMenu.addAction(self.actFindStates)
         self.editMenu.aboutToShow.connect(self.update_edit_menu)
 
     def update_menus(self):
@@ -464,6 +634,7 @@ class TheatreMainWindow(NodeEditorWindow):
 
         self.actSave.setEnabled(hasMdiChild)
         self.actSaveAs.setEnabled(hasMdiChild)
+        self.actExportJson.setEnabled(hasMdiChild)
         self.actClose.setEnabled(hasMdiChild)
         self.actCloseAll.setEnabled(hasMdiChild)
         self.actTile.setEnabled(hasMdiChild)
@@ -501,6 +672,26 @@ class TheatreMainWindow(NodeEditorWindow):
         menu.addAction(self.actToggleTraceInspector)
         self.actToggleTraceInspector.setChecked(self._trace_inspector_dock.isVisible())
 
+        menu.addAction(self.actToggleStateQuery)
+        self.actToggleStateQuery.setChecked(self._state_query_dock.isVisible())
+
+        menu.addAction(self.actToggleSlowestNodes)
+        self.actToggleSlowestNodes.setChecked(self._slowest_nodes_dock.isVisible())
+
+        menu.addAction(self.actToggleProfiler)
+        self.actToggleProfiler.setChecked(self._profile_view_dock.isVisible())
+
+        menu.addAction(self.actToggleHeatmap)
+        self.actToggleHeatmap.setChecked(self.show_heatmap)
+
+        menu.addAction(self.actToggleMeasureMemory)
+        self.actToggleMeasureMemory.setChecked(self.measure_memory)
+
+        menu.addAction(self.actToggleTimeline)
+        self.actToggleTimeline.setChecked(tracer.enabled)
+        menu.addAction(self.actExportTimeline)
+        self.actExportTimeline.setEnabled(len(tracer) > 0)
+
         menu.addAction(self.actToggleScenarioLogs)
         self.actToggleScenarioLogs.setChecked(
             self._trace_inspector.node_view.logs_view.scenario_logs_view.isVisible()
@@ -534,6 +725,90 @@ class TheatreMainWindow(NodeEditorWindow):
             action.triggered.connect(self.windowMapper.map)
             self.windowMapper.setMapping(action, window)
 
+    def _on_find_states(self):
+        self._state_query_dock.show()
+        self._state_query_dock.raise_()
+        self._state_query.focus()
+
+    def show_profile(self, profile: "Profile"):
+        self._profile_view.show_profile(profile)
+        self._profile_view_dock.show()
+        self._profile_view_dock.raise_()
+
+    def _toggle_heatmap(self):
+        self.show_heatmap = not self.show_heatmap
+        for window in self.mdiArea.subWindowList():
+            window.widget().scene.grScene.update()
+
+    def _toggle_measure_memory(self):
+        self.measure_memory = not self.measure_memory
+
+    def _toggle_timeline(self):
+        if tracer.enabled:
+            tracer.stop()
+        else:
+            # a fresh timeline each time
+            tracer.clear()
+            tracer.start()
+
+    def _on_export_timeline(self):
+        fname, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export evaluation timeline",
+            os.path.join(str(self.getFileDialogDirectory()), "timeline.json"),
+            "Chrome trace (*.json);;All files (*)",
+        )
+        if not fname:
+            return
+        try:
+            tracer.dump(fname)
+        except Exception as e:
+            show_error_dialog(self, f"Could not export the timeline: {e}")
+            return
+        self.statusBar().showMessage(
+            f"Exported {len(tracer)} spans to {fname}; open it in ui.perfetto.dev",
+            5000,
+        )
+
+    def _serve_metrics(self, port: int):
+        try:
+            self._metrics_server = metrics.serve(port)
+        except OSError as e:
+            logger.error(f"cannot serve metrics on port {port}: {e}")
+            return
+        # the samplers walk the scenes: they run here, not in the server's thread
+        self._metrics_timer = timer = QTimer(self)
+        timer.timeout.connect(metrics.REGISTRY.sample)
+        timer.start(int(metrics.SAMPLE_INTERVAL * 1000))
+        metrics.REGISTRY.sample()
+
+    def _sample_metrics(self):
+        outputs = size = 0
+        for window in self.mdiArea.subWindowList():
+            for node in window.widget().scene.nodes:
+                if isinstance(node, StateNode) and (node_size := node.value_size):
+                    outputs += 1
+                    size += node_size
+        metrics.NODE_OUTPUTS.set(outputs)
+        metrics.NODE_OUTPUT_BYTES.set(size)
+
+    def _on_export_metrics(self):
+        fname, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export metrics",
+            os.path.join(str(self.getFileDialogDirectory()), "metrics.json"),
+            "JSON (*.json);;All files (*)",
+        )
+        if not fname:
+            return
+        metrics.REGISTRY.sample()
+        try:
+            metrics.REGISTRY.dump(fname)
+        except Exception as e:
+            show_error_dialog(self, f"Could not export the metrics: {e}")
+            return
+        self.statusBar().showMessage(f"Exported metrics to {fname}", 5000)
+
     def _toggle_states(self):
         # we don't subclass the library dock yet.
         toggle_visible(self._library_dock)
@@ -555,13 +830,28 @@ class TheatreMainWindow(NodeEditorWindow):
             self._trace_inspector.on_node_changed
         )
         trace_tree_editor.state_node_created.connect(self._library.on_node_created)
+        # state reevaluated or removed --> rerun the state query
+        trace_tree_editor.state_node_changed.connect(self._state_query.schedule_refresh)
+        trace_tree_editor.state_node_changed.connect(
+            self._slowest_nodes.schedule_refresh
+        )
         # click on trace tree editor --> display in trace inspector
         trace_tree_editor.state_node_clicked.connect(self._trace_inspector.display)
+        trace_tree_editor.state_node_clicked.connect(self._profile_view.on_node_clicked)
 
         trace_tree_editor.scene.history.addHistoryModifiedListener(
             self.update_edit_menu
         )
+        trace_tree_editor.scene.history.addHistoryModifiedListener(
+            self._state_query.schedule_refresh
+        )
+        trace_tree_editor.scene.history.addHistoryModifiedListener(
+            self._slowest_nodes.schedule_refresh
+        )
         trace_tree_editor.add_close_event_listener(self.on_sub_window_close)
+        trace_tree_editor.scene.autosave.save_failed.connect(
+            partial(show_error_dialog, self)
+        )
 
         # subwnd.widget().fileNew()
         subwnd.showMaximized()
@@ -0,0 +1,110 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Measure how much memory charm evaluations allocate, with tracemalloc.
+
+Tracing allocations slows evaluations down several times over, so it's off
+unless turned on (see config.MEASURE_MEMORY, or Window > Measure Memory Use).
+Sizes are relative to what was allocated when the evaluation started:
+    - peak: the most that was allocated at any one time during the evaluation;
+    - net: what's still allocated afterwards, including the output state.
+"""
+
+import os
+import tracemalloc
+import typing
+from dataclasses import dataclass, field
+
+TOP_SITES = 10
+"""How many allocation sites to keep per evaluation."""
+MIN_GROWTH_STEPS = 3
+"""How many consecutive increases of the peak make a trace worth flagging."""
+
+# our own allocations, and the import machinery's, are noise
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+@dataclass(frozen=True)
+class AllocationSite:
+    filename: str
+    line: int
+    size: int
+    """Bytes allocated here (and still alive) at the end of the evaluation."""
+    count: int
+
+    @property
+    def label(self) -> str:
+        return f"{os.path.basename(self.filename)}:{self.line}"
+
+
+@dataclass
+class MemoryUsage:
+    peak: int = 0
+    net: int = 0
+    top_sites: typing.List[AllocationSite] = field(default_factory=list)
+
+
+def format_bytes(size: int) -> str:
+    sign = "-" if size < 0 else ""
+    size = abs(size)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return (
+                f"{sign}{size:.0f}{unit}" if unit == "B" else f"{sign}{size:.1f}{unit}"
+            )
+        size /= 1024
+    return f"{sign}{size:.1f}GiB"
+
+
+def measure_memory(
+    function: typing.Callable, *args, **kwargs
+) -> typing.Tuple[typing.Any, MemoryUsage]:
+    """Call function with tracemalloc on; returns its result and what it allocated.
+
+    If tracemalloc was already tracing, it's left on (and its peak reset).
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        result = function(*args, **kwargs)
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    sites = []
+    for stat in after.compare_to(before, "lineno"):
+        if stat.size_diff <= 0:
+            continue
+        frame = stat.traceback[0]
+        sites.append(
+            AllocationSite(
+                frame.filename, frame.lineno, stat.size_diff, stat.count_diff
+            )
+        )
+        if len(sites) == TOP_SITES:
+            break  # compare_to sorts by (absolute) size_diff
+    return result, MemoryUsage(peak - start, current - start, sites)
+
+
+def grows_monotonically(
+    peaks: typing.Sequence[int], min_steps: int = MIN_GROWTH_STEPS
+) -> bool:
+    """Whether the peaks went up at every step, for at least min_steps steps."""
+    if len(peaks) < min_steps + 1:
+        return False
+    return all(a < b for a, b in zip(peaks, peaks[1:]))
+
+
+def format_memory(usage: MemoryUsage) -> str:
+    return f"peak {format_bytes(usage.peak)}, net {format_bytes(usage.net)}"
@@ -0,0 +1,440 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Process-level metrics: evaluations, caches, queues and simulated filesystems.
+
+Counters and histograms are updated as things happen, at the cost of a dict
+lookup. Gauges either read something thread-safe when collected (see
+Gauge.set_function), or are set by samplers: functions that walk the scenes,
+and so must run on the GUI thread, or that are too slow to run on every scrape.
+The main window runs them every SAMPLE_INTERVAL seconds while serving, and
+before exporting.
+
+With config.METRICS_PORT set, the metrics are served on localhost, at
+``/metrics`` in Prometheus' text exposition format and at ``/metrics.json``
+as json; File > Export Metrics... writes the json to a file.
+"""
+
+import bisect
+import dataclasses
+import json
+import math
+import sys
+import threading
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from theatre.logger import logger as theatre_logger
+
+logger = theatre_logger.getChild("metrics")
+
+SAMPLE_INTERVAL = 5.0
+"""Seconds between two runs of the samplers, while serving."""
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Upper bounds, in seconds, of the evaluation latency histogram buckets."""
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_LabelValues = typing.Tuple[str, ...]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: typing.Dict[str, str]) -> _LabelValues:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(
+                f"{self.name} takes labels {self.label_names}, not {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: _LabelValues) -> typing.Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def samples(self) -> typing.List[typing.Tuple[_LabelValues, typing.Any]]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        # without labels, there's a value from the start
+        self._values: typing.Dict[_LabelValues, float] = {} if labels else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class Gauge(_Metric):
+    """A value that goes up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        # without labels, there's a value from the start
+        self._values: typing.Dict[_LabelValues, float] = {} if labels else {(): 0}
+        self._functions: typing.Dict[_LabelValues, typing.Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: typing.Callable[[], float], **labels: str):
+        """Compute the value with function whenever it's collected.
+
+        It's called from whatever thread collects the metrics: it must be thread-safe.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def get(self, **labels: str) -> float:
+        key = self._key(labels)
+        function = self._functions.get(key)
+        return function() if function else self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                logger.warning(f"could not collect {self.name}", exc_info=True)
+        return sorted(values.items())
+
+
+@dataclasses.dataclass
+class _Buckets:
+    counts: typing.List[int]
+    sum: float = 0.0
+    count: int = 0
+
+
+class Histogram(_Metric):
+    """How many observed values fell into each bucket."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: typing.Dict[_LabelValues, _Buckets] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            buckets = self._values.get(key)
+            if buckets is None:
+                buckets = self._values[key] = _Buckets([0] * len(self.buckets))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                buckets.counts[index] += 1
+            buckets.sum += value
+            buckets.count += 1
+
+    def samples(self):
+        with self._lock:
+            return sorted(
+                (key, dataclasses.replace(buckets, counts=list(buckets.counts)))
+                for key, buckets in self._values.items()
+            )
+
+    def cumulative(self, buckets: _Buckets) -> typing.List[typing.Tuple[float, int]]:
+        """(upper bound, count of values up to it) pairs, ending with +Inf."""
+        out = []
+        total = 0
+        for bound, count in zip(self.buckets, buckets.counts):
+            total += count
+            out.append((bound, total))
+        out.append((math.inf, buckets.count))
+        return out
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: typing.Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Registry:
+    """A set of metrics, and the samplers that keep some of them up to date."""
+
+    def __init__(self):
+        self._metrics: typing.Dict[str, _Metric] = {}
+        self._samplers: typing.List[typing.Callable[[], None]] = []
+
+    def __iter__(self) -> typing.Iterator[_Metric]:
+        return iter(list(self._metrics.values()))
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"{metric.name} is registered already")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: typing.Sequence[str] = ()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: typing.Sequence[str] = (),
+        buckets: typing.Sequence[float] = LATENCY_BUCKETS,
+    ):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_sampler(self, sampler: typing.Callable[[], None]):
+        self._samplers.append(sampler)
+
+    def remove_sampler(self, sampler: typing.Callable[[], None]):
+        self._samplers.remove(sampler)
+
+    def sample(self):
+        """Run the samplers; on the GUI thread."""
+        for sampler in list(self._samplers):
+            try:
+                sampler()
+            except Exception:
+                logger.warning(f"metrics sampler {sampler} failed", exc_info=True)
+
+    def to_prometheus(self) -> str:
+        """The metrics in Prometheus' text exposition format."""
+        lines = []
+        for metric in self:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in metric.samples():
+                labels = metric._labels(key)
+                if isinstance(metric, Histogram):
+                    for bound, count in metric.cumulative(value):
+                        bucket_labels = _format_labels(
+                            {**labels, "le": _format_value(bound)}
+                        )
+                        lines.append(f"{metric.name}_bucket{bucket_labels} {count}")
+                    lines.append(
+                        f"{metric.name}_sum{_format_labels(labels)} "
+                        f"{_format_value(value.sum)}"
+                    )
+                    lines.append(
+                        f"{metric.name}_count{_format_labels(labels)} {value.count}"
+                    )
+                else:
+                    lines.append(
+                        f"{metric.name}{_format_labels(labels)} {_format_value(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        out = {}
+        for metric in self:
+            values = []
+            for key, value in metric.samples():
+                entry = {"labels": metric._labels(key)}
+                if isinstance(metric, Histogram):
+                    entry.update(
+                        count=value.count,
+                        sum=value.sum,
+                        buckets={
+                            _format_value(bound): count
+                            for bound, count in metric.cumulative(value)
+                        },
+                    )
+                else:
+                    entry["value"] = value
+                values.append(entry)
+            out[metric.name] = {
+                "type": metric.kind,
+                "help": metric.help,
+                "values": values,
+            }
+        return out
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+
+REGISTRY = Registry()
+
+EVALUATIONS_STARTED = REGISTRY.counter(
+    "theatre_evaluations_started_total", "Charm evaluations started.", ("event",)
+)
+EVALUATIONS_SUCCEEDED = REGISTRY.counter(
+    "theatre_evaluations_succeeded_total",
+    "Charm evaluations that returned a state.",
+    ("event",),
+)
+EVALUATIONS_FAILED = REGISTRY.counter(
+    "theatre_evaluations_failed_total",
+    "Charm evaluations that raised, e.g. an uncaught charm error or an inconsistent scenario.",
+    ("event",),
+)
+EVALUATION_SECONDS = REGISTRY.histogram(
+    "theatre_evaluation_seconds",
+    "Wall time of successful charm evaluations.",
+    ("event",),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "theatre_cache_lookups_total",
+    "Lookups of node outputs in the output cache and the results store.",
+    ("cache", "result"),
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "theatre_cache_hit_ratio",
+    "Fraction of the lookups that found an output.",
+    ("cache",),
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "theatre_queue_depth",
+    "Nodes waiting to be evaluated, and outputs waiting to be written to the results store.",
+    ("queue",),
+)
+VFS_COPIED_BYTES = REGISTRY.counter(
+    "theatre_vfs_copied_bytes_total",
+    "Bytes copied into the simulated container filesystems of nodes.",
+)
+VFS_DISK_BYTES = REGISTRY.gauge(
+    "theatre_vfs_disk_bytes",
+    "Bytes in the simulated container filesystems of nodes.",
+)
+NODE_OUTPUTS = REGISTRY.gauge(
+    "theatre_node_outputs", "Nodes holding an evaluated output."
+)
+NODE_OUTPUT_BYTES = REGISTRY.gauge(
+    "theatre_node_output_bytes",
+    "Estimated memory taken up by the outputs of nodes.",
+)
+
+OUTPUT_CACHE = "output_cache"
+RESULTS_STORE = "results_store"
+EVALUATION_QUEUE = "evaluation"
+
+
+def _hit_ratio(cache: str) -> float:
+    hits = CACHE_LOOKUPS.get(cache=cache, result="hit")
+    total = hits + CACHE_LOOKUPS.get(cache=cache, result="miss")
+    return hits / total if total else 0.0
+
+
+for _cache in (OUTPUT_CACHE, RESULTS_STORE):
+    CACHE_HIT_RATIO.set_function(lambda cache=_cache: _hit_ratio(cache), cache=_cache)
+
+
+def record_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def estimate_size(obj: typing.Any) -> int:
+    """Rough estimate of the memory obj takes up, in bytes, counting what it holds.
+
+    Follows containers and dataclasses; other objects only count for their own size.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, (str, bytes, int, float, bool, type(None))):
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif dataclasses.is_dataclass(item) and not isinstance(item, type):
+            stack.extend(
+                getattr(item, field.name) for field in dataclasses.fields(item)
+            )
+    return total
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = REGISTRY
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.registry.to_prometheus().encode()
+            content_type = PROMETHEUS_CONTENT_TYPE
+        elif path == "/metrics.json":
+            body = json.dumps(self.registry.to_json()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve the metrics on localhost:port, in the background; port 0 picks one."""
+    handler = type("Handler", (_Handler,), {"registry": registry})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(
+        target=server.serve_forever, name="theatre-metrics", daemon=True
+    )
+    thread.start()
+    logger.info(f"serving metrics on http://127.0.0.1:{server.server_port}/metrics")
+    return server
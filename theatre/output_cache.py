@@ -0,0 +1,65 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Cache of evaluated node outputs, keyed by node id and input fingerprint.
+
+A node's input fingerprint identifies everything its evaluation depends on:
+the fingerprint of its parent's value and the event (and env) on the edge
+leading to it. Custom nodes are fingerprinted by their custom state. As long as
+the charm context does not change, the same node with the same fingerprint
+evaluates to the same output, so outputs can be reattached when the history
+brings a node (or its inputs) back, instead of running the charm again.
+"""
+
+import hashlib
+import json
+import typing
+from collections import OrderedDict
+
+from theatre import config
+from theatre.metrics import OUTPUT_CACHE, record_lookup
+from theatre.trace_tree_widget.structs import StateNodeOutput
+
+Fingerprint = str
+_Key = typing.Tuple[int, Fingerprint]
+
+
+def fingerprint(*parts: typing.Any) -> Fingerprint:
+    """Stable fingerprint of some json-serializable data."""
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class OutputCache:
+    """Least-recently-used cache of node outputs."""
+
+    def __init__(self, max_size: typing.Optional[int] = None):
+        self.max_size = config.OUTPUT_CACHE_SIZE if max_size is None else max_size
+        self._outputs: "OrderedDict[_Key, StateNodeOutput]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._outputs)
+
+    def get(
+        self, node_id: int, input_fingerprint: Fingerprint
+    ) -> typing.Optional[StateNodeOutput]:
+        key = (node_id, input_fingerprint)
+        output = self._outputs.get(key)
+        record_lookup(OUTPUT_CACHE, output is not None)
+        if output is not None:
+            self._outputs.move_to_end(key)
+        return output
+
+    def put(
+        self, node_id: int, input_fingerprint: Fingerprint, output: StateNodeOutput
+    ):
+        if output.exception or not output.state:
+            # errors may well be transient: not worth keeping around
+            return
+        key = (node_id, input_fingerprint)
+        self._outputs[key] = output
+        self._outputs.move_to_end(key)
+        while len(self._outputs) > self.max_size:
+            self._outputs.popitem(last=False)
+
+    def clear(self):
+        self._outputs.clear()
@@ -0,0 +1,340 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Dock showing evaluation profiles as icicle graphs (top-down flamegraphs).
+
+See theatre.profiling for how they're captured.
+"""
+
+import json
+import os
+import typing
+import zlib
+from datetime import datetime
+
+from qtpy.QtCore import QPointF, QRectF, Qt
+from qtpy.QtGui import QColor, QFontMetrics, QPainter, QPen
+from qtpy.QtWidgets import (
+    QComboBox,
+    QFileDialog,
+    QHBoxLayout,
+    QLabel,
+    QPushButton,
+    QScrollArea,
+    QSplitter,
+    QTableWidget,
+    QTableWidgetItem,
+    QToolTip,
+    QVBoxLayout,
+    QWidget,
+)
+
+from theatre.evaluation_timings import format_duration
+from theatre.helpers import get_color, show_error_dialog
+from theatre.memory_profiling import format_bytes, format_memory, grows_monotonically
+from theatre.profiling import CallTree, Profile
+
+if typing.TYPE_CHECKING:
+    from theatre.main_window import TheatreMainWindow
+    from theatre.trace_tree_widget.state_node import StateNode
+
+ROW_HEIGHT = 18
+MIN_WIDTH = 1.0
+"""Frames narrower than this many pixels aren't drawn."""
+
+
+def _frame_color(tree: CallTree) -> QColor:
+    # stable per file, so the same module keeps its color across profiles
+    filename = tree.frame.filename if tree.frame else ""
+    hue = zlib.crc32(filename.encode()) % 50  # reds to yellows
+    return QColor.fromHsv(hue, 110, 245)
+
+
+class FlameGraphWidget(QWidget):
+    """Icicle graph of a call tree: callers above, callees below.
+
+    Hover for details, click a frame to zoom into it, right-click to zoom out.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMouseTracking(True)
+        self._root: typing.Optional[CallTree] = None
+        # the frames from the root to the one we're zoomed into
+        self._zoom: typing.List[CallTree] = []
+        # where each frame was drawn last, for hit testing
+        self._rects: typing.List[typing.Tuple[QRectF, CallTree]] = []
+
+    def set_tree(self, root: typing.Optional[CallTree]):
+        self._root = root
+        self._zoom = [root] if root else []
+        depth = root.depth if root else 0
+        self.setMinimumHeight(depth * ROW_HEIGHT)
+        self.update()
+
+    def zoom_out(self):
+        if len(self._zoom) > 1:
+            self._zoom.pop()
+            self.update()
+
+    def reset_zoom(self):
+        del self._zoom[1:]
+        self.update()
+
+    def paintEvent(self, event):
+        self._rects = []
+        if not self._zoom:
+            return
+        painter = QPainter(self)
+        metrics = QFontMetrics(painter.font())
+        focus = self._zoom[-1]
+        scale = self.width() / focus.total if focus.total else 0.0
+        y = 0.0
+        # the frames above the one we zoomed into, full width
+        for tree in self._zoom[1:-1]:
+            self._draw(painter, metrics, tree, QRectF(0, y, self.width(), ROW_HEIGHT))
+            y += ROW_HEIGHT
+        if focus.frame is None:  # the root: no frame of its own
+            self._draw_children(painter, metrics, focus, 0.0, y, scale)
+        else:
+            self._draw_tree(painter, metrics, focus, 0.0, y, scale)
+        painter.end()
+
+    def _draw_tree(self, painter, metrics, tree: CallTree, x, y, scale):
+        rect = QRectF(x, y, tree.total * scale, ROW_HEIGHT)
+        self._draw(painter, metrics, tree, rect)
+        self._draw_children(painter, metrics, tree, x, y + ROW_HEIGHT, scale)
+
+    def _draw_children(self, painter, metrics, tree: CallTree, x, y, scale):
+        if y > self.height():
+            return
+        for child in sorted(tree.children.values(), key=lambda c: -c.total):
+            width = child.total * scale
+            if width < MIN_WIDTH:
+                break  # and so are all the others, sorted as they are
+            self._draw_tree(painter, metrics, child, x, y, scale)
+            x += width
+
+    def _draw(self, painter: QPainter, metrics: QFontMetrics, tree, rect: QRectF):
+        self._rects.append((rect, tree))
+        painter.setPen(QPen(Qt.white))
+        painter.setBrush(_frame_color(tree))
+        painter.drawRect(rect)
+        if rect.width() > 20:
+            text = metrics.elidedText(
+                tree.frame.label, Qt.ElideRight, int(rect.width()) - 4
+            )
+            painter.setPen(QPen(Qt.black))
+            painter.drawText(rect.adjusted(2, 0, -2, 0), Qt.AlignVCenter, text)
+
+    def _tree_at(self, pos: QPointF) -> typing.Optional[CallTree]:
+        for rect, tree in self._rects:
+            if rect.contains(pos):
+                return tree
+        return None
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        tree = self._tree_at(QPointF(event.pos()))
+        if tree is None or not self._root:
+            QToolTip.hideText()
+            return
+        total = self._root.total
+        share = tree.total / total * 100 if total else 0
+        frame = tree.frame
+        QToolTip.showText(
+            event.globalPos(),
+            f"{frame.function}\n{frame.filename}:{frame.line}\n"
+            f"{format_duration(tree.total)} ({share:.1f}% of the total), "
+            f"{format_duration(tree.self_time)} in itself",
+            self,
+        )
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.RightButton:
+            self.zoom_out()
+            return
+        tree = self._tree_at(QPointF(event.pos()))
+        if tree is None or tree is self._zoom[-1]:
+            return
+        if tree in self._zoom:  # one of the frames above: zoom out to it
+            del self._zoom[self._zoom.index(tree) + 1 :]
+        else:
+            self._zoom.extend(self._path_to(self._zoom[-1], tree))
+        self.update()
+
+    @staticmethod
+    def _path_to(start: CallTree, target: CallTree) -> typing.List[CallTree]:
+        """The frames from start (excluded) down to target (included)."""
+        stack = [(start, [])]
+        while stack:
+            tree, path = stack.pop()
+            for child in tree.children.values():
+                if child is target:
+                    return path + [child]
+                stack.append((child, path + [child]))
+        return []
+
+
+_REPORT_COLUMNS = ("Evaluation", "Time", "Peak memory", "Net memory", "Top allocation")
+
+
+class ProfileView(QWidget):
+    """The captured profiles, one at a time, with export buttons."""
+
+    def __init__(self, main_window: "TheatreMainWindow"):
+        super().__init__(main_window)
+        self._main_window = main_window
+        self._profiles: typing.List[Profile] = []
+
+        self.picker = picker = QComboBox(self)
+        picker.setToolTip("Captured profiles, latest first.")
+        picker.currentIndexChanged.connect(self._on_profile_picked)
+        self.info_label = QLabel(self)
+
+        self.flamegraph = FlameGraphWidget(self)
+        scroll = QScrollArea(self)
+        scroll.setWidgetResizable(True)
+        scroll.setWidget(self.flamegraph)
+
+        # for profiles of whole traces: one row per evaluation
+        self.report = report = QTableWidget(0, len(_REPORT_COLUMNS), self)
+        report.setHorizontalHeaderLabels(_REPORT_COLUMNS)
+        report.setEditTriggers(QTableWidget.NoEditTriggers)
+        report.verticalHeader().hide()
+        report.horizontalHeader().setStretchLastSection(True)
+        self.growth_label = growth_label = QLabel(self)
+        palette = growth_label.palette()
+        palette.setColor(growth_label.foregroundRole(), get_color("pastel red"))
+        growth_label.setPalette(palette)
+        growth_label.hide()
+
+        splitter = QSplitter(Qt.Vertical, self)
+        splitter.addWidget(scroll)
+        splitter.addWidget(report)
+
+        reset_zoom = QPushButton("Reset zoom", self)
+        reset_zoom.clicked.connect(self.flamegraph.reset_zoom)
+        self.export_prof = export_prof = QPushButton("Export .prof...", self)
+        export_prof.setToolTip("Save the cProfile statistics, e.g. for snakeviz.")
+        export_prof.clicked.connect(self._on_export_prof)
+        self.export_speedscope = export_speedscope = QPushButton(
+            "Export speedscope...", self
+        )
+        export_speedscope.setToolTip("Save for https://www.speedscope.app.")
+        export_speedscope.clicked.connect(self._on_export_speedscope)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(reset_zoom)
+        buttons.addStretch()
+        buttons.addWidget(export_prof)
+        buttons.addWidget(export_speedscope)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(picker)
+        layout.addWidget(self.info_label)
+        layout.addWidget(growth_label)
+        layout.addWidget(splitter)
+        layout.addLayout(buttons)
+        self._on_profile_picked(-1)
+
+    @property
+    def current(self) -> typing.Optional[Profile]:
+        index = self.picker.currentIndex()
+        return self._profiles[index] if index >= 0 else None
+
+    def show_profile(self, profile: Profile):
+        """Add a profile (if it's new) and show it."""
+        if profile not in self._profiles:
+            self._profiles.insert(0, profile)
+            when = datetime.fromtimestamp(profile.created).strftime("%H:%M:%S")
+            self.picker.insertItem(0, f"{when} {profile.name}")
+        self.picker.setCurrentIndex(self._profiles.index(profile))
+
+    def on_node_clicked(self, node: "StateNode"):
+        if self.isVisible() and node.profile is not None:
+            self.show_profile(node.profile)
+
+    def _on_profile_picked(self, index: int):
+        profile = self.current
+        self.flamegraph.set_tree(profile.tree() if profile else None)
+        self._update_report(profile)
+        self.export_prof.setEnabled(bool(profile and profile.stats))
+        self.export_speedscope.setEnabled(profile is not None)
+        if profile is None:
+            self.info_label.setText(
+                "Right-click a node and choose 'Profile evaluation'."
+            )
+            return
+        info = (
+            f"{format_duration(profile.total)} profiled with {profile.mode}, "
+            f"{len(profile.stacks)} distinct stacks"
+        )
+        if profile.memory:
+            info += f"; memory: {format_memory(profile.memory)}"
+        self.info_label.setText(info)
+
+    def _update_report(self, profile: typing.Optional[Profile]):
+        parts = profile.parts if profile else []
+        report = self.report
+        report.setVisible(bool(parts))
+        report.setRowCount(len(parts))
+        for row, part in enumerate(parts):
+            memory = part.memory
+            top = memory.top_sites[0] if memory and memory.top_sites else None
+            cells = (
+                part.name,
+                format_duration(part.total),
+                format_bytes(memory.peak) if memory else "",
+                format_bytes(memory.net) if memory else "",
+                f"{top.label} ({format_bytes(top.size)})" if top else "",
+            )
+            for column, text in enumerate(cells):
+                report.setItem(row, column, QTableWidgetItem(text))
+        report.resizeColumnsToContents()
+
+        peaks = [part.memory.peak for part in parts if part.memory]
+        flagged = len(peaks) == len(parts) and grows_monotonically(peaks)
+        self.growth_label.setVisible(flagged)
+        if flagged:
+            self.growth_label.setText(
+                f"Peak memory grows with every event in this trace: "
+                f"{format_bytes(peaks[0])} → {format_bytes(peaks[-1])}"
+            )
+
+    def _save_file_name(self, caption: str, suffix: str, file_type: str) -> str:
+        name = self.current.name.split(" ")[0] + suffix
+        fname, _ = QFileDialog.getSaveFileName(
+            self,
+            caption,
+            os.path.join(str(self._main_window.getFileDialogDirectory()), name),
+            f"{file_type};;All files (*)",
+        )
+        return fname
+
+    def _on_export_prof(self):
+        fname = self._save_file_name(
+            "Export cProfile statistics", ".prof", "Profile (*.prof)"
+        )
+        if not fname:
+            return
+        try:
+            self.current.dump_stats(fname)
+        except Exception as e:
+            show_error_dialog(self, f"Could not export the profile: {e}")
+            return
+        self._main_window.statusBar().showMessage(f"Exported to {fname}", 5000)
+
+    def _on_export_speedscope(self):
+        fname = self._save_file_name(
+            "Export for speedscope", ".speedscope.json", "JSON (*.json)"
+        )
+        if not fname:
+            return
+        try:
+            with open(fname, "w") as f:
+                json.dump(self.current.to_speedscope(), f)
+        except Exception as e:
+            show_error_dialog(self, f"Could not export the profile: {e}")
+            return
+        self._main_window.statusBar().showMessage(f"Exported to {fname}", 5000)
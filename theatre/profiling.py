@@ -0,0 +1,294 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Profiles of charm evaluations, as aggregated call stacks.
+
+Two ways of capturing them (see config.PROFILER):
+    - "cprofile": deterministic, with exact call counts, and exportable as a
+      ``.prof`` file for pstats, snakeviz and the like. cProfile only records
+      who called whom, not whole stacks: these are reconstructed by splitting
+      each function's time among its callees in proportion to the calls it made,
+      the way snakeviz does. Recursive calls are folded into their first frame.
+    - "sampling": the stack of the profiled thread is sampled every
+      SAMPLE_INTERVAL seconds from another thread. Much lower overhead, real
+      stacks, but short evaluations only get a handful of samples.
+
+Either way a profile is a mapping from stacks (outermost frame first) to the
+time spent in their innermost frame. Profiles of several evaluations merge by
+adding those up; see Profile.merge.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import typing
+from dataclasses import dataclass, field
+
+from theatre import config
+from theatre.logger import logger as theatre_logger
+
+if typing.TYPE_CHECKING:
+    from theatre.memory_profiling import MemoryUsage
+
+logger = theatre_logger.getChild("profiling")
+
+CPROFILE, SAMPLING = "cprofile", "sampling"
+SAMPLE_INTERVAL = 0.0005
+"""Seconds between two samples of the sampling profiler."""
+MIN_FRACTION = 1e-4
+"""Calls taking less than this fraction of the total aren't broken down further."""
+MAX_DEPTH = 256
+
+
+class Frame(typing.NamedTuple):
+    function: str
+    filename: str
+    line: int
+
+    @property
+    def label(self) -> str:
+        if not self.filename or self.filename == "~":  # builtins, in cProfile
+            return self.function
+        return f"{self.function} ({os.path.basename(self.filename)}:{self.line})"
+
+
+Stack = typing.Tuple[Frame, ...]
+
+
+@dataclass
+class CallTree:
+    """A frame, with the time spent in it and in its callees, for the flamegraph."""
+
+    frame: typing.Optional[Frame]  # None for the root
+    total: float = 0.0
+    children: typing.Dict[Frame, "CallTree"] = field(default_factory=dict)
+
+    @property
+    def self_time(self) -> float:
+        return max(self.total - sum(c.total for c in self.children.values()), 0.0)
+
+    @property
+    def depth(self) -> int:
+        """How many levels of frames there are below (and including) this one."""
+        if not self.children:
+            return 1
+        return 1 + max(child.depth for child in self.children.values())
+
+
+class Profile:
+    """Where the time went in one or more evaluations."""
+
+    def __init__(
+        self,
+        stacks: typing.Dict[Stack, float],
+        mode: str,
+        name: str = "profile",
+        stats: typing.Optional[pstats.Stats] = None,
+    ):
+        self.stacks = stacks
+        self.mode = mode
+        self.name = name
+        self.stats = stats
+        """The raw cProfile statistics, if this was captured with cProfile."""
+        self.created = time.time()
+        self.memory: typing.Optional["MemoryUsage"] = None
+        """What the evaluation allocated, if memory was measured too."""
+        self.parts: typing.List["Profile"] = []
+        """The profiles this one was merged from, if any."""
+
+    @property
+    def total(self) -> float:
+        return sum(self.stacks.values())
+
+    def tree(self) -> CallTree:
+        root = CallTree(None)
+        for stack, seconds in self.stacks.items():
+            root.total += seconds
+            node = root
+            for frame in stack:
+                child = node.children.get(frame)
+                if child is None:
+                    child = node.children[frame] = CallTree(frame)
+                child.total += seconds
+                node = child
+        return root
+
+    @classmethod
+    def merge(cls, profiles: typing.Sequence["Profile"], name: str) -> "Profile":
+        """Add up the stacks (and the cProfile statistics) of several profiles."""
+        stacks: typing.Dict[Stack, float] = {}
+        for profile in profiles:
+            for stack, seconds in profile.stacks.items():
+                stacks[stack] = stacks.get(stack, 0.0) + seconds
+        modes = {profile.mode for profile in profiles}
+        stats = None
+        if modes == {CPROFILE}:
+            stats = pstats.Stats()
+            stats.add(*(profile.stats for profile in profiles))
+        merged = cls(stacks, modes.pop() if len(modes) == 1 else "mixed", name, stats)
+        merged.parts = list(profiles)
+        return merged
+
+    def dump_stats(self, path: str):
+        """Write a .prof file; only for profiles captured with cProfile."""
+        if self.stats is None:
+            raise ValueError(f"no cProfile statistics in a {self.mode} profile")
+        self.stats.dump_stats(path)
+
+    def to_speedscope(self) -> dict:
+        """As a speedscope (https://www.speedscope.app) 'sampled' profile."""
+        frames: typing.Dict[Frame, int] = {}
+        samples = []
+        weights = []
+        for stack, seconds in self.stacks.items():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(seconds)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "theatre",
+            "activeProfileIndex": 0,
+            "shared": {
+                "frames": [
+                    {"name": frame.function, "file": frame.filename, "line": frame.line}
+                    for frame in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+
+_DISABLE = "<method 'disable' of '_lsprof.Profiler' objects>"
+
+
+def _frame(func: typing.Tuple[str, int, str]) -> Frame:
+    filename, line, function = func
+    return Frame(function, filename, line)
+
+
+def stacks_from_stats(stats: pstats.Stats) -> typing.Dict[Stack, float]:
+    """Reconstruct call stacks from cProfile's caller/callee statistics."""
+    raw = stats.stats  # func -> (primitive calls, calls, own time, cumulative, callers)
+    callees: typing.Dict[tuple, typing.Dict[tuple, float]] = {}
+    roots = []
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, {})[func] = cumulative
+        # the profiler's own 'disable' call shows up as a root, too
+        if not callers and func[2] != _DISABLE:
+            roots.append(func)
+
+    total = sum(raw[func][3] for func in roots)
+    threshold = total * MIN_FRACTION
+    stacks: typing.Dict[Stack, float] = {}
+
+    def walk(func, seconds: float, stack: Stack, on_stack: typing.Set[tuple]):
+        cumulative = raw[func][3]
+        # our share of each call this function made
+        scale = seconds / cumulative if cumulative else 0.0
+        inner = 0.0
+        if len(stack) < MAX_DEPTH:
+            for callee, callee_cumulative in callees.get(func, {}).items():
+                share = callee_cumulative * scale
+                if callee in on_stack or share < threshold:
+                    continue
+                # recursion can make the shares add up to more than we've got
+                share = min(share, seconds - inner)
+                if share <= 0:
+                    break
+                inner += share
+                child_stack = stack + (_frame(callee),)
+                walk(callee, share, child_stack, on_stack | {callee})
+        if seconds - inner > 0:
+            stacks[stack] = stacks.get(stack, 0.0) + seconds - inner
+
+    for func in roots:
+        walk(func, raw[func][3], (_frame(func),), {func})
+    return stacks
+
+
+class _Sampler(threading.Thread):
+    """Samples the stack of the calling thread while it's in runcall."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="theatre-profiler", daemon=True)
+        self._thread_id = threading.get_ident()
+        self._interval = interval
+        self._done = threading.Event()
+        # runcall's frame, while it's running: only what's below it is sampled
+        self._base_frame = None
+        self.stacks: typing.Dict[Stack, float] = {}
+
+    def runcall(self, function: typing.Callable, *args, **kwargs):
+        self._base_frame = sys._getframe()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self._base_frame = None
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def run(self):
+        stacks = self.stacks
+        last = time.perf_counter()
+        while not self._done.wait(self._interval):
+            base = self._base_frame
+            frame = sys._current_frames().get(self._thread_id)
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            stack = []
+            while frame is not None and frame is not base:
+                code = frame.f_code
+                stack.append(Frame(code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if base is None or frame is None or not stack:
+                continue  # not in the profiled function
+            key = tuple(reversed(stack))
+            stacks[key] = stacks.get(key, 0.0) + elapsed
+
+
+def profile_call(
+    function: typing.Callable, *args, mode: typing.Optional[str] = None, **kwargs
+) -> typing.Tuple[typing.Any, Profile]:
+    """Call function under a profiler; returns its result and the profile.
+
+    If the function raises, so does this; the profile is lost.
+    """
+    mode = mode or config.PROFILER
+    if mode == SAMPLING and not hasattr(sys, "_current_frames"):
+        logger.warning("no sampling profiler on this interpreter; using cProfile")
+        mode = CPROFILE
+
+    if mode == SAMPLING:
+        sampler = _Sampler(SAMPLE_INTERVAL)
+        # the sampler only gets to run when the GIL is handed over
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SAMPLE_INTERVAL / 2)
+        sampler.start()
+        try:
+            result = sampler.runcall(function, *args, **kwargs)
+        finally:
+            sampler.stop()
+            sys.setswitchinterval(switch_interval)
+        return result, Profile(sampler.stacks, SAMPLING)
+
+    if mode != CPROFILE:
+        raise ValueError(f"unknown profiler {mode!r}")
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    stats = pstats.Stats(profiler)
+    return result, Profile(stacks_from_stats(stats), CPROFILE, stats=stats)
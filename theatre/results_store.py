@@ -0,0 +1,403 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Persistent store of evaluation results, in an SQLite database per charm repo.
+
+Every evaluation is recorded as one row per (scene, node, input fingerprint):
+the output state, the charm logs, the scenario output and the traceback, if
+any. Logs and tracebacks are indexed for full-text search (with FTS5, if the
+sqlite library has it; else searches scan the table), and statuses and
+exception types have their own indexes, so results can be looked up across
+sessions without loading any scene.
+
+Input fingerprints (see theatre.output_cache) are combined with a fingerprint
+of the charm itself, so results are only ever reused against the charm that
+produced them. Outputs whose states have mounts aren't reused: the simulated
+filesystems they point to are temporary.
+
+Rows are written on a background thread, in one transaction per batch of
+results; the GUI thread only queues the outputs and reads.
+"""
+
+import hashlib
+import inspect
+import json
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import typing
+from pathlib import Path
+
+from scenario.state import JujuLogLine
+
+from theatre.logger import logger as theatre_logger
+from theatre.metrics import QUEUE_DEPTH, RESULTS_STORE, record_lookup
+from theatre.output_cache import Fingerprint, fingerprint
+from theatre.scenario_json import dump_state, parse_state
+from theatre.tracing import span
+from theatre.trace_tree_widget.structs import StateNodeOutput
+
+if typing.TYPE_CHECKING:
+    from scenario import Context
+
+logger = theatre_logger.getChild("results_store")
+
+RESULTS_DB = "results.db"
+BATCH_SIZE = 200
+"""Most results written in one transaction."""
+BATCH_DELAY = 0.05
+"""How long (in seconds) to wait for more results before writing a batch."""
+MAX_SEARCH_RESULTS = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    scene INTEGER NOT NULL,
+    node INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    event TEXT,
+    status TEXT,
+    exception_type TEXT,
+    reusable INTEGER NOT NULL,
+    state TEXT,
+    logs TEXT,
+    stdout TEXT,
+    traceback TEXT,
+    created REAL NOT NULL,
+    UNIQUE (scene, node, fingerprint)
+);
+CREATE INDEX IF NOT EXISTS results_status ON results (status);
+CREATE INDEX IF NOT EXISTS results_exception_type ON results (exception_type);
+"""
+# the text to search, by results.id
+_FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS results_text USING fts5(logs, stdout, traceback)"
+_PLAIN_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results_text (logs TEXT, stdout TEXT, traceback TEXT)"
+)
+
+
+class SearchHit(typing.NamedTuple):
+    scene: int
+    node: int
+    event: typing.Optional[str]
+    status: typing.Optional[str]
+    exception_type: typing.Optional[str]
+    created: float
+    """When the result was recorded, as a unix timestamp."""
+    snippet: str
+    """The matching part of the logs, stdout or traceback."""
+
+
+def charm_fingerprint(
+    context: "Context", repo_root: typing.Optional[Path] = None
+) -> Fingerprint:
+    """Fingerprint of the charm a context runs: its metadata and its source code.
+
+    The source code is that of the charm's own package and, if the charm comes
+    from a repo, of the repo's src and lib trees: the charm libs it imports.
+    """
+    spec = context.charm_spec
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(
+        json.dumps(
+            [spec.meta, spec.config, spec.actions], sort_keys=True, default=str
+        ).encode()
+    )
+    source_dirs = []
+    try:
+        source_dirs.append(Path(inspect.getfile(spec.charm_type)).parent)
+    except (TypeError, OSError):
+        # not defined in a file: the metadata (and the repo) will have to do
+        pass
+    if repo_root is not None:
+        source_dirs += [repo_root / "src", repo_root / "lib"]
+    seen = set()
+    for source_dir in source_dirs:
+        source_dir = source_dir.resolve()
+        if source_dir in seen:
+            continue
+        seen.add(source_dir)
+        digest.update(source_dir.name.encode())
+        for path in sorted(source_dir.rglob("*.py")):
+            digest.update(str(path.relative_to(source_dir)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _text(output: StateNodeOutput) -> typing.Tuple[str, str, str]:
+    """The searchable text of an output: logs, stdout and traceback."""
+    logs = "\n".join(f"{level} {message}" for level, message in output.charm_logs or ())
+    exc = output.exception
+    tb = "".join(traceback.format_exception(exc)) if exc is not None else ""
+    return logs, output.scenario_logs or "", tb
+
+
+_COLUMNS = (
+    "scene",
+    "node",
+    "fingerprint",
+    "event",
+    "status",
+    "exception_type",
+    "reusable",
+    "state",
+    "logs",
+    "stdout",
+    "traceback",
+    "created",
+)
+_INSERT = (
+    f"INSERT INTO results ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_COLUMNS))})"
+)
+
+
+def _encode(
+    scene_id: int,
+    node_id: int,
+    key: Fingerprint,
+    event: typing.Optional[str],
+    output: StateNodeOutput,
+    created: float,
+) -> typing.Tuple[tuple, typing.Tuple[str, str, str]]:
+    """The values of a results row (in _COLUMNS order), and its searchable text."""
+    text = _text(output)
+    exc = output.exception
+    values = (
+        scene_id,
+        node_id,
+        key,
+        event,
+        output.state.unit_status.name if output.state else None,
+        type(exc).__name__ if exc is not None else None,
+        int(_is_reusable(output)),
+        json.dumps(dump_state(output.state)) if output.state else None,
+        json.dumps(output.charm_logs or []),
+        output.scenario_logs,
+        text[2],
+        created,
+    )
+    return values, text
+
+
+def _is_reusable(output: StateNodeOutput) -> bool:
+    if output.exception is not None or not output.state:
+        return False
+    return not any(container.mounts for container in output.state.containers)
+
+
+class ResultsStore:
+    """Records evaluation results in the background; looks them up and searches them."""
+
+    def __init__(self, path: typing.Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.charm_version: Fingerprint = ""
+        """Fingerprint of the charm that results are recorded for; see charm_fingerprint."""
+        self._queue: "queue.Queue" = queue.Queue()
+        QUEUE_DEPTH.set_function(self._queue.qsize, queue=RESULTS_STORE)
+        self._thread: typing.Optional[threading.Thread] = None
+        # for the GUI thread; the writer thread has its own
+        self._db = self._connect()
+        self.has_fts = self._init_schema(self._db)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=10)
+        # readers don't block the writer, and the other way around
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @staticmethod
+    def _init_schema(db: sqlite3.Connection) -> bool:
+        """Create the tables if needed; returns whether full-text search is available."""
+        with db:
+            db.executescript(_SCHEMA)
+            try:
+                db.execute(_FTS_SCHEMA)
+                return True
+            except sqlite3.OperationalError:
+                pass
+            # either there's no fts5, or the table was made without it
+            db.execute(_PLAIN_SCHEMA)
+            (sql,) = db.execute(
+                "SELECT sql FROM sqlite_master WHERE name = 'results_text'"
+            ).fetchone()
+            return "fts5" in sql.lower()
+
+    def _key(self, input_fingerprint: Fingerprint) -> Fingerprint:
+        return fingerprint(self.charm_version, input_fingerprint)
+
+    # writing
+    def put(
+        self,
+        scene_id: int,
+        node_id: int,
+        input_fingerprint: Fingerprint,
+        event: typing.Optional[str],
+        output: StateNodeOutput,
+    ):
+        """Record an output; encoding and writing happen in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="theatre-results-store", daemon=True
+            )
+            self._thread.start()
+        key = self._key(input_fingerprint)
+        self._queue.put((scene_id, node_id, key, event, output, time.time()))
+
+    def flush(self):
+        """Wait until everything queued so far has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        self._db.close()
+
+    # writer thread
+    def _run(self):
+        db = self._connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + BATCH_DELAY
+                while len(batch) < BATCH_SIZE and batch[-1] is not _STOP:
+                    try:
+                        batch.append(
+                            self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                        )
+                    except queue.Empty:
+                        break
+                jobs = [job for job in batch if job is not _STOP]
+                try:
+                    with span("record results", "store", results=len(jobs)):
+                        self._write(db, jobs)
+                except Exception:
+                    logger.error(
+                        f"failed recording {len(batch)} results", exc_info=True
+                    )
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                if batch[-1] is _STOP:
+                    return
+        finally:
+            db.close()
+
+    def _write(self, db: sqlite3.Connection, jobs: typing.List[tuple]):
+        rows = []
+        for scene_id, node_id, key, event, output, created in jobs:
+            try:
+                rows.append(_encode(scene_id, node_id, key, event, output, created))
+            except Exception:
+                logger.error(
+                    f"cannot record the result of node {node_id}", exc_info=True
+                )
+
+        with db:  # one transaction
+            for values, text in rows:
+                old = db.execute(
+                    "SELECT id FROM results "
+                    "WHERE scene = ? AND node = ? AND fingerprint = ?",
+                    values[:3],
+                ).fetchone()
+                if old:
+                    db.execute("DELETE FROM results_text WHERE rowid = ?", old)
+                    db.execute("DELETE FROM results WHERE id = ?", old)
+                cursor = db.execute(_INSERT, values)
+                db.execute(
+                    "INSERT INTO results_text (rowid, logs, stdout, traceback) "
+                    "VALUES (?, ?, ?, ?)",
+                    (cursor.lastrowid, *text),
+                )
+
+    # reading
+    def get(
+        self, scene_id: int, node_id: int, input_fingerprint: Fingerprint
+    ) -> typing.Optional[StateNodeOutput]:
+        """The recorded output of a node, if it can be reused."""
+        row = self._db.execute(
+            "SELECT state, logs, stdout FROM results "
+            "WHERE scene = ? AND node = ? AND fingerprint = ? AND reusable",
+            (scene_id, node_id, self._key(input_fingerprint)),
+        ).fetchone()
+        record_lookup(RESULTS_STORE, row is not None)
+        if row is None:
+            return None
+        state, logs, stdout = row
+        try:
+            return StateNodeOutput(
+                parse_state(json.loads(state)),
+                [JujuLogLine(*line) for line in json.loads(logs)],
+                stdout,
+            )
+        except Exception:
+            # e.g. recorded by a version of theatre that encoded states differently
+            logger.warning("could not decode a recorded result", exc_info=True)
+            return None
+
+    def count(
+        self,
+        status: typing.Optional[str] = None,
+        exception_type: typing.Optional[str] = None,
+    ) -> int:
+        """The number of results, with this status and/or exception type if given."""
+        where, params = [], []
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if exception_type is not None:
+            where.append("exception_type = ?")
+            params.append(exception_type)
+        sql = "SELECT count(*) FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._db.execute(sql, params).fetchone()[0]
+
+    def search(
+        self, text: str, limit: int = MAX_SEARCH_RESULTS
+    ) -> typing.List[SearchHit]:
+        """Results whose logs, stdout or traceback match text, most relevant first.
+
+        With full-text search, text is an FTS5 query (e.g. ``error NOT relation``,
+        ``"no db"``, ``conn*``); if it's not a valid one, it's searched as a phrase.
+        """
+        if not text.strip():
+            return []
+        if not self.has_fts:
+            return self._scan(text, limit)
+        sql = (
+            "SELECT r.scene, r.node, r.event, r.status, r.exception_type, r.created, "
+            "snippet(results_text, -1, '[', ']', '…', 12) "
+            "FROM results_text JOIN results r ON r.id = results_text.rowid "
+            "WHERE results_text MATCH ? ORDER BY rank LIMIT ?"
+        )
+        try:
+            rows = self._db.execute(sql, (text, limit)).fetchall()
+        except sqlite3.OperationalError:
+            phrase = '"' + text.replace('"', '""') + '"'
+            rows = self._db.execute(sql, (phrase, limit)).fetchall()
+        return [SearchHit(*row) for row in rows]
+
+    def _scan(self, text: str, limit: int) -> typing.List[SearchHit]:
+        rows = self._db.execute(
+            "SELECT r.scene, r.node, r.event, r.status, r.exception_type, r.created, "
+            "t.logs || char(10) || t.stdout || char(10) || t.traceback AS text "
+            "FROM results_text t JOIN results r ON r.id = t.rowid "
+            "WHERE instr(lower(text), lower(?)) ORDER BY r.created DESC LIMIT ?",
+            (text, limit),
+        ).fetchall()
+        hits = []
+        for *fields, body in rows:
+            at = body.lower().find(text.lower())
+            snippet = body[max(0, at - 40) : at + len(text) + 40].replace("\n", " ")
+            hits.append(SearchHit(*fields, snippet))
+        return hits
+
+
+_STOP = object()
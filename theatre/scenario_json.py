@@ -1,109 +1,477 @@
-"""Library to deserialize json data as scenario.state dataclasses."""
+"""Library to (de)serialize scenario.state dataclasses to and from json-compatible data.
+
+Encoders and decoders are generated once per dataclass, at import time, from the
+type annotations of its fields. The encoded form of a dataclass is a dict with one
+key per field (the same shape ``dataclasses.asdict`` gives, so data stored by older
+versions of theatre can still be loaded), but all values are json-native: paths,
+pebble layers, enums, sets, datetimes and non-string dict keys are converted both ways.
+"""
 
 # TODO: move to scenario
 
+import dataclasses
+import datetime
+import enum
 import typing
+from pathlib import Path, PurePath
 
+from ops import StatusBase, pebble
 from scenario.state import (
     Action,
+    Address,
+    BindAddress,
+    Container,
+    DeferredEvent,
+    Event,
+    ExecOutput,
+    Model,
+    Mount,
+    Network,
+    PeerRelation,
+    Port,
+    Relation,
+    Secret,
+    State,
+    Storage,
+    StoredState,
+    SubordinateRelation,
+    _EntityStatus,
+)
+
+_Encoder = typing.Callable[[typing.Any], typing.Any]
+_Decoder = typing.Callable[[typing.Any], typing.Any]
+
+# forward references scenario only defines when type checking
+_TYPE_ALIASES = {
+    "AnyRelation": typing.Union[Relation, PeerRelation, SubordinateRelation],
+    "AnyJson": typing.Any,
+    "RawDataBagContents": typing.Dict[str, str],
+    "RawSecretRevisionContents": typing.Dict[str, str],
+    "UnitID": int,
+    "PathLike": typing.Union[str, Path],
+}
+
+SCENARIO_DATACLASSES = (
+    Action,
+    Address,
+    BindAddress,
     Container,
     DeferredEvent,
     Event,
+    ExecOutput,
     Model,
+    Mount,
     Network,
+    PeerRelation,
+    Port,
     Relation,
     Secret,
     State,
+    Storage,
     StoredState,
+    SubordinateRelation,
     _EntityStatus,
 )
 
+_MISSING = object()
+_NATIVE_TYPES = (str, int, float, bool, type(None))
+
+_ENCODERS: typing.Dict[type, _Encoder] = {}
+_DECODERS: typing.Dict[type, _Decoder] = {}
+
+
+class CodecError(TypeError):
+    """Raised if some object or type cannot be (de)serialized."""
+
+
+def _encode_any(obj):
+    """Encode a value for which we have no type information."""
+    if isinstance(obj, _NATIVE_TYPES):
+        return obj
+    if isinstance(obj, dict):
+        return {
+            key if isinstance(key, str) else str(key): _encode_any(value)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_encode_any(value) for value in obj]
+    if encoder := _ENCODERS.get(type(obj)):
+        return encoder(obj)
+    if isinstance(obj, PurePath):
+        return str(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    raise CodecError(f"cannot encode {obj!r} ({type(obj)})")
+
+
+def _decode_any(obj):
+    """Copy json data for which we have no type information."""
+    if isinstance(obj, dict):
+        return {key: _decode_any(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_decode_any(value) for value in obj]
+    return obj
+
+
+def _encode_status(obj):
+    return {"name": obj.name, "message": obj.message}
+
+
+def _encode_layer(obj: pebble.Layer):
+    return obj.to_dict()
+
+
+def _compile_key(tp) -> typing.Tuple[_Encoder, _Decoder]:
+    """Codec for dict keys. Json only supports string keys."""
+    if tp is str or tp is typing.Any:
+        return str, str
+    if tp is int:
+        return str, int
+    raise CodecError(f"unsupported dict key type {tp}")
+
+
+def _compile_union(args) -> typing.Tuple[typing.Optional[_Encoder], _Decoder]:
+    members = [arg for arg in args if arg is not type(None)]
+    optional = len(members) < len(args)
+
+    if all(dataclasses.is_dataclass(member) for member in members):
+        # e.g. AnyRelation. The encoded form does not say which member it was,
+        # so we guess from the fields that are present: the first member having a
+        # field that no other member has wins.
+        fieldsets = {
+            member: {field.name for field in dataclasses.fields(member)}
+            for member in members
+        }
+        decoders = {member: _compile_type(member)[1] for member in members}
+        markers = []
+        for member, fieldset in fieldsets.items():
+            others = set().union(
+                *(fs for m, fs in fieldsets.items() if m is not member)
+            )
+            markers.append((tuple(fieldset - others), decoders[member]))
+        # members without distinctive fields come last
+        markers.sort(key=lambda marker: not marker[0])
+
+        def encode(obj):
+            return None if obj is None else _ENCODERS[type(obj)](obj)
+
+        def decode(data):
+            if data is None:
+                return None
+            for marker_fields, decoder in markers:
+                for name in marker_fields:
+                    if name in data:
+                        return decoder(data)
+            for member, fieldset in fieldsets.items():
+                if data.keys() <= fieldset:
+                    return decoders[member](data)
+            raise CodecError(f"cannot decode {data}: expected one of {members}")
+
+        return encode, decode
+
+    if _EntityStatus in members:
+        # ops StatusBase or scenario _EntityStatus: same shape.
+        def decode_status(data):
+            return None if data is None else _DECODERS[_EntityStatus](data)
+
+        return _encode_status, decode_status
+
+    if len(members) == 1:
+        encoder, decoder = _compile_type(members[0])
+        if not optional or encoder is None and decoder is None:
+            return encoder, decoder
+
+        def encode_optional(obj):
+            return None if obj is None else encoder(obj)
+
+        def decode_optional(data):
+            return None if data is None else decoder(data)
+
+        return encode_optional if encoder else None, decode_optional
+
+    if str in members and all(
+        member in _NATIVE_TYPES or issubclass(member, PurePath) for member in members
+    ):
+        # e.g. PathLike; we can't tell what it was, strings will do.
+        return (lambda obj: obj if isinstance(obj, _NATIVE_TYPES) else str(obj)), None
+
+    return _encode_any, _decode_any
+
+
+def _compile_type(tp) -> typing.Tuple[typing.Optional[_Encoder], _Decoder]:
+    """Return an (encoder, decoder) pair for this type annotation.
+
+    Either can be None, meaning: the value can be used as-is.
+    """
+    if tp in _NATIVE_TYPES:
+        return None, None
+    if tp is typing.Any or tp in (dict, list):
+        return _encode_any, _decode_any
+
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
 
-def _convert_if_not_none(
-    source: dict,
-    key: str,
-    converter: typing.Callable[[dict], typing.Any] = lambda x: x,
-    default: typing.Any = None,
-):
-    if value := source.get(key, None):
-        return converter(value)
-    return default
+    if origin is typing.Literal:
+        return None, None
+    if origin is typing.Union:
+        return _compile_union(args)
+
+    if origin in (list, tuple, set, frozenset):
+        if origin is tuple and args and args[-1] is not Ellipsis:
+            # fixed-length tuples such as Event.args: Tuple[Any]
+            return _encode_any, tuple
+        item_encoder, item_decoder = _compile_type(args[0] if args else typing.Any)
+        container = list if origin is list else origin
+
+        def encode_sequence(obj):
+            if item_encoder is None:
+                return list(obj)
+            return [item_encoder(item) for item in obj]
+
+        def decode_sequence(data):
+            if item_decoder is None:
+                return container(data)
+            if container is list:
+                return [item_decoder(item) for item in data]
+            return container(item_decoder(item) for item in data)
+
+        return encode_sequence, decode_sequence
+
+    if origin is dict:
+        key_type, value_type = args if args else (typing.Any, typing.Any)
+        value_encoder, value_decoder = _compile_type(value_type)
+        values_as_is = value_encoder is None and value_decoder is None
+
+        if typing.get_origin(key_type) is tuple:
+            # Container.exec_mock: {("ls", "-ll"): ExecOutput()}; json keys can only
+            # be strings, so we store these as lists of pairs.
+            value_encoder = value_encoder or (lambda x: x)
+            value_decoder = value_decoder or (lambda x: x)
+
+            def encode_pairs(obj):
+                return [[list(key), value_encoder(value)] for key, value in obj.items()]
+
+            def decode_pairs(data):
+                return {tuple(key): value_decoder(value) for key, value in data}
+
+            return encode_pairs, decode_pairs
+
+        key_encoder, key_decoder = _compile_key(key_type)
+
+        if values_as_is:
+            if key_type is str:
+                # e.g. databags: a shallow copy will do, the values are immutable
+                return dict, dict
+
+            # e.g. Dict[UnitID, RawDataBagContents]: only the keys need converting
+            def encode_keys(obj):
+                return {key_encoder(key): value for key, value in obj.items()}
+
+            def decode_keys(data):
+                return {key_decoder(key): value for key, value in data.items()}
+
+            return encode_keys, decode_keys
+
+        value_encoder = value_encoder or (lambda x: x)
+        value_decoder = value_decoder or (lambda x: x)
+
+        def encode_dict(obj):
+            return {
+                key_encoder(key): value_encoder(value) for key, value in obj.items()
+            }
+
+        def decode_dict(data):
+            return {
+                key_decoder(key): value_decoder(value) for key, value in data.items()
+            }
+
+        return encode_dict, decode_dict
+
+    if isinstance(tp, type):
+        if dataclasses.is_dataclass(tp):
+            return _ENCODERS.get(tp) or _compile_dataclass(tp)[0], _DECODERS[tp]
+        if issubclass(tp, enum.Enum):
+            return (lambda obj: obj.value), tp
+        if issubclass(tp, PurePath):
+            return str, tp
+        if tp is datetime.datetime:
+            return (lambda obj: obj.isoformat()), datetime.datetime.fromisoformat
+        if tp is pebble.Layer:
+            return _encode_layer, pebble.Layer
+
+    raise CodecError(f"unsupported type {tp}")
+
+
+def _compile_dataclass(cls: type) -> typing.Tuple[_Encoder, _Decoder]:
+    """Generate and register the encoder and decoder functions for a dataclass.
+
+    Decoded objects are built without going through ``__init__``, which for frozen
+    dataclasses sets each field through ``object.__setattr__``; ``__post_init__``
+    still runs, if the class has one, to validate the object (and normalize it, as
+    Event does). Fields missing from the data get their default value.
+    """
+    hints = typing.get_type_hints(cls, localns=_TYPE_ALIASES)
+    namespace = {"cls": cls, "MISSING": _MISSING, "new": object.__new__}
+    encode_items = []
+    decode_items = []
+    decode_lines = []
+
+    for field in dataclasses.fields(cls):
+        if not field.init:
+            continue
+        name = field.name
+        encoder, decoder = _compile_type(hints[name])
+
+        if encoder:
+            namespace[f"encode_{name}"] = encoder
+            encode_items.append(f"{name!r}: encode_{name}(obj.{name})")
+        else:
+            encode_items.append(f"{name!r}: obj.{name}")
+
+        if field.default is not dataclasses.MISSING:
+            namespace[f"default_{name}"] = field.default
+            default = f"default_{name}"
+        elif field.default_factory is not dataclasses.MISSING:
+            namespace[f"factory_{name}"] = field.default_factory
+            default = f"factory_{name}()"
+        else:
+            default = None
+
+        decode_items.append(
+            f"{name!r}: "
+            + (f"decode_{name}(data[{name!r}])" if decoder else f"data[{name!r}]")
+        )
+        decode_lines.append(f"    value = data.get({name!r}, MISSING)")
+        if default is None:
+            decode_lines.append("    if value is MISSING:")
+            decode_lines.append(
+                f"        raise CodecError('{cls.__name__}: missing field {name}')"
+            )
+            decode_lines.append(
+                f"    attrs[{name!r}] = "
+                + (f"decode_{name}(value)" if decoder else "value")
+            )
+        else:
+            value = f"decode_{name}(value)" if decoder else "value"
+            decode_lines.append(
+                f"    attrs[{name!r}] = {default} if value is MISSING else {value}"
+            )
+        if decoder:
+            namespace[f"decode_{name}"] = decoder
+
+    post_init = "    obj.__post_init__()" if hasattr(cls, "__post_init__") else ""
+    namespace["CodecError"] = CodecError
+    namespace["N_FIELDS"] = len(encode_items)
+    source = "\n".join(
+        [
+            "def encode(obj):",
+            "    return {" + ", ".join(encode_items) + "}",
+            "",
+            "def decode_partial(data):",
+            "    attrs = {}",
+            *decode_lines,
+            "    return attrs",
+            "",
+            "def decode(data):",
+            # fast path: all fields are there
+            "    if len(data) == N_FIELDS:",
+            "        try:",
+            "            attrs = {" + ", ".join(decode_items) + "}",
+            "        except KeyError:",
+            "            attrs = decode_partial(data)",
+            "    else:",
+            "        attrs = decode_partial(data)",
+            "    obj = new(cls)",
+            "    obj.__dict__.update(attrs)",
+            post_init,
+            "    return obj",
+        ]
+    )
+    exec(
+        compile(source, f"<scenario_json codec for {cls.__name__}>", "exec"), namespace
+    )
+
+    _ENCODERS[cls] = encoder = namespace["encode"]
+    _DECODERS[cls] = decoder = namespace["decode"]
+    return encoder, decoder
+
+
+for _cls in SCENARIO_DATACLASSES:
+    if _cls not in _ENCODERS:
+        _compile_dataclass(_cls)
+
+# statuses set by the charm are ops.StatusBase instances until scenario converts them
+for _status_type in (StatusBase, *StatusBase.__subclasses__()):
+    _ENCODERS[_status_type] = _encode_status
+_ENCODERS[pebble.Layer] = _encode_layer
+
+
+def dump(obj: typing.Any) -> typing.Any:
+    """Encode a scenario dataclass (or a container thereof) as json-compatible data."""
+    return _encode_any(obj)
+
+
+_T = typing.TypeVar("_T")
+
+
+def parse(cls: typing.Type[_T], obj: dict) -> _T:
+    """Decode json-compatible data into an instance of this scenario dataclass."""
+    try:
+        decoder = _DECODERS[cls]
+    except KeyError:
+        raise CodecError(f"no decoder for {cls}")
+    return decoder(obj)
+
+
+def dump_state(state: State) -> dict:
+    return _ENCODERS[State](state)
+
+
+def dump_event(event: Event) -> dict:
+    return _ENCODERS[Event](event)
 
 
 def parse_action(obj: dict) -> Action:
-    return Action(**obj)
+    return parse(Action, obj)
 
 
 def parse_container(obj: dict) -> Container:
-    return Container(**obj)  # this won't work for long, alas
+    return parse(Container, obj)
 
 
-def parse_relation(obj: dict) -> Relation:
-    return Relation(**obj)  # this won't work for long, alas
+def parse_relation(
+    obj: dict,
+) -> typing.Union[Relation, PeerRelation, SubordinateRelation]:
+    return parse(State, {"relations": [obj]}).relations[0]
 
 
 def parse_secret(obj: dict) -> Secret:
-    return Secret(**obj)  # this won't work for long, alas
+    return parse(Secret, obj)
 
 
 def parse_event(obj: dict) -> Event:
-    return Event(
-        path=_convert_if_not_none(obj, "path"),
-        action=_convert_if_not_none(obj, "action", parse_action),
-        args=_convert_if_not_none(obj, "args", lambda x: x),
-        container=_convert_if_not_none(obj, "container", parse_container),
-        kwargs=_convert_if_not_none(obj, "kwargs", lambda x: x, {}),
-        relation=_convert_if_not_none(obj, "relation", parse_relation),
-        relation_remote_unit_id=_convert_if_not_none(obj, "relation_remote_unit_id"),
-        secret=_convert_if_not_none(obj, "secret", parse_secret),
-    )
+    return parse(Event, obj)
 
 
 def parse_status(obj: dict) -> _EntityStatus:
-    return _EntityStatus(**obj)
+    return parse(_EntityStatus, obj)
 
 
 def parse_model(obj: dict) -> Model:
-    return Model(**obj)
+    return parse(Model, obj)
 
 
 def parse_network(obj: dict) -> Network:
-    return Network(**obj)
+    return parse(Network, obj)
 
 
 def parse_deferred(obj: dict) -> DeferredEvent:
-    return DeferredEvent(**obj)
+    return parse(DeferredEvent, obj)
 
 
 def parse_storedstate(obj: dict) -> StoredState:
-    return StoredState(**obj)
+    return parse(StoredState, obj)
 
 
 def parse_state(obj: dict) -> State:
-    return State(
-        config=_convert_if_not_none(obj, "config", default={}),
-        relations=_convert_if_not_none(
-            obj, "relations", lambda x: [parse_relation(r) for r in x], []
-        ),
-        networks=_convert_if_not_none(
-            obj, "networks", lambda x: [parse_network(r) for r in x], []
-        ),
-        containers=_convert_if_not_none(
-            obj, "containers", lambda x: [parse_container(r) for r in x], []
-        ),
-        leader=_convert_if_not_none(obj, "leader", default=False),
-        model=_convert_if_not_none(obj, "model", parse_model, Model()),
-        secrets=_convert_if_not_none(
-            obj, "secrets", lambda x: [parse_secret(r) for r in x], []
-        ),
-        unit_id=_convert_if_not_none(obj, "unit_id", default=0),
-        deferred=_convert_if_not_none(
-            obj, "deferred", lambda x: [parse_deferred(r) for r in x], []
-        ),
-        stored_state=_convert_if_not_none(
-            obj, "stored_state", lambda x: [parse_storedstate(r) for r in x], []
-        ),
-        app_status=_convert_if_not_none(obj, "app_status", parse_status, ""),
-        unit_status=_convert_if_not_none(obj, "unit_status", parse_status, ""),
-        workload_version=_convert_if_not_none(obj, "workload_version"),
-    )
+    return parse(State, obj)
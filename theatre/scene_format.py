@@ -0,0 +1,167 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Packed on-disk scene format.
+
+A packed scene file is a stream of length-prefixed, zlib-compressed json records::
+
+    MAGIC
+    [u32 length][record: skeleton]
+    [u32 length][record: payload of node A]
+    [u32 length][record: payload of node B]
+    ...
+    [u32 length][record: index]
+    [u64 offset of the index record] MAGIC
+
+The skeleton is the serialized scene without the heavy per-node data (custom
+states and the like): that is enough to lay out the whole graph. Each heavy
+payload gets its own record, which the index maps to the node id; payloads are
+decompressed and parsed only when somebody asks for them.
+
+Every record is plain json, so a packed scene can always be turned back into
+the regular json scene format with `PackedScene.to_json`.
+"""
+
+import json
+import struct
+import typing
+import zlib
+from pathlib import Path
+
+MAGIC = b"THTRPAK1"
+COMPRESSION_LEVEL = 6
+HEAVY_NODE_KEYS = ("custom-state", "custom-state-patch")
+"""Node keys that are moved out of the skeleton into lazily loaded payloads."""
+LAZY_PAYLOAD_KEY = "lazy-payload"
+"""Key under which skeleton node data will hold a `LazyPayload` after reading."""
+
+_LENGTH = struct.Struct(">I")
+_TRAILER = struct.Struct(f">Q{len(MAGIC)}s")
+
+SerializedScene = dict
+
+
+class PackedSceneError(ValueError):
+    """Raised if a packed scene file is corrupted."""
+
+
+def is_packed_scene(path: typing.Union[str, Path]) -> bool:
+    """Whether this file is a packed scene (as opposed to a json one)."""
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _pack_record(obj: typing.Any) -> bytes:
+    raw = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+    return _LENGTH.pack(len(compressed)) + compressed
+
+
+def pack_scene(data: SerializedScene) -> bytes:
+    """Encode a serialized scene in the packed format."""
+    chunks = [MAGIC]
+    offset = len(MAGIC)
+
+    def append(record: bytes) -> int:
+        nonlocal offset
+        chunks.append(record)
+        start = offset
+        offset += len(record)
+        return start
+
+    skeleton_nodes = []
+    payloads = {}
+    for node_data in data["nodes"]:
+        light = {k: v for k, v in node_data.items() if k not in HEAVY_NODE_KEYS}
+        heavy = {k: node_data[k] for k in HEAVY_NODE_KEYS if node_data.get(k)}
+        if heavy:
+            payloads[node_data["id"]] = heavy
+        skeleton_nodes.append(light)
+
+    skeleton = {**data, "nodes": skeleton_nodes}
+    index = {"skeleton": append(_pack_record(skeleton)), "payloads": {}}
+    for node_id, payload in payloads.items():
+        # json object keys are strings
+        index["payloads"][str(node_id)] = append(_pack_record(payload))
+
+    index_offset = append(_pack_record(index))
+    chunks.append(_TRAILER.pack(index_offset, MAGIC))
+    return b"".join(chunks)
+
+
+def write_packed_scene(data: SerializedScene, path: typing.Union[str, Path]):
+    """Write a serialized scene to disk in the packed format."""
+    Path(path).write_bytes(pack_scene(data))
+
+
+class LazyPayload:
+    """Handle to the heavy data of a node, loaded on demand."""
+
+    def __init__(self, packed: "PackedScene", node_id: int):
+        self._packed = packed
+        self.node_id = node_id
+
+    def load(self) -> dict:
+        """Decompress and parse the payload; not cached."""
+        return self._packed.read_payload(self.node_id)
+
+    def __repr__(self):
+        return f"<LazyPayload node={self.node_id}>"
+
+
+class PackedScene:
+    """A packed scene file, read into memory but not yet decoded."""
+
+    def __init__(self, buffer: bytes):
+        if not buffer.startswith(MAGIC) or len(buffer) < len(MAGIC) + _TRAILER.size:
+            raise PackedSceneError("not a packed scene")
+        index_offset, magic = _TRAILER.unpack_from(buffer, len(buffer) - _TRAILER.size)
+        if magic != MAGIC:
+            raise PackedSceneError("truncated packed scene")
+        self._buffer = buffer
+        self._index = self._read_record(index_offset)
+        self._payload_offsets: typing.Dict[str, int] = self._index["payloads"]
+
+    @classmethod
+    def from_file(cls, path: typing.Union[str, Path]) -> "PackedScene":
+        return cls(Path(path).read_bytes())
+
+    def _read_record(self, offset: int) -> typing.Any:
+        try:
+            (length,) = _LENGTH.unpack_from(self._buffer, offset)
+            start = offset + _LENGTH.size
+            raw = zlib.decompress(self._buffer[start : start + length])
+            return json.loads(raw)
+        except (struct.error, zlib.error, ValueError) as e:
+            raise PackedSceneError(f"corrupted record at {offset}: {e}") from e
+
+    @property
+    def payload_node_ids(self) -> typing.List[int]:
+        """Ids of the nodes that have a heavy payload."""
+        return [int(node_id) for node_id in self._payload_offsets]
+
+    def read_payload(self, node_id: int) -> dict:
+        offset = self._payload_offsets.get(str(node_id))
+        if offset is None:
+            return {}
+        return self._read_record(offset)
+
+    def skeleton(self, lazy: bool = True) -> SerializedScene:
+        """The serialized scene without heavy payloads.
+
+        If lazy, the data of each node with a payload gets a `LazyPayload` handle
+        under LAZY_PAYLOAD_KEY. Else, payloads are loaded and merged in right away.
+        """
+        data = self._read_record(self._index["skeleton"])
+        for node_data in data["nodes"]:
+            node_id = node_data["id"]
+            if str(node_id) not in self._payload_offsets:
+                continue
+            if lazy:
+                node_data[LAZY_PAYLOAD_KEY] = LazyPayload(self, node_id)
+            else:
+                node_data.update(self.read_payload(node_id))
+        return data
+
+    def to_json(self) -> SerializedScene:
+        """The equivalent scene in the regular json scene format."""
+        return self.skeleton(lazy=False)
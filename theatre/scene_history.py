@@ -0,0 +1,399 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Undo/redo history storing diffs between scene snapshots."""
+
+import json
+import typing
+from collections import deque
+
+from nodeeditor.node_scene_history import SceneHistory as _SceneHistory
+
+from theatre import config
+from theatre.logger import logger as theatre_logger
+from theatre.trace_tree_widget.event_edge import EventEdge
+from theatre.trace_tree_widget.state_node import StateNode
+
+if typing.TYPE_CHECKING:
+    from theatre.theatre_scene import TheatreScene
+
+logger = theatre_logger.getChild("scene_history")
+
+_BEFORE = 0
+_AFTER = 1
+
+ItemData = typing.Optional[dict]
+Changes = typing.Dict[int, typing.Tuple[ItemData, ItemData]]
+"""Mapping from node or edge id to its (before, after) serialized data; None if absent."""
+
+
+def _diff(old: typing.Dict[int, dict], new: typing.Dict[int, dict]) -> Changes:
+    changes = {}
+    for item_id, before in old.items():
+        after = new.get(item_id)
+        if after is None:
+            changes[item_id] = (before, None)
+        elif after is not before and after != before:
+            changes[item_id] = (before, after)
+    for item_id, after in new.items():
+        if item_id not in old:
+            changes[item_id] = (None, after)
+    return changes
+
+
+def _node_signature(node: StateNode) -> tuple:
+    """Whatever node.serialize() reads, cheaply: if it's unchanged, so is the data."""
+    pos = node.grNode.scenePos()
+    return (
+        node.title,
+        pos.x(),
+        pos.y(),
+        tuple(socket.id for socket in node.inputs + node.outputs),
+        node.content.edit.text(),
+        # custom values are replaced, never modified in place
+        (node._value, node._lazy_payload) if node._is_custom else None,
+        node._deltas_source,
+    )
+
+
+def _edge_signature(edge: EventEdge) -> tuple:
+    """Whatever edge.serialize() reads, cheaply: if it's unchanged, so is the data."""
+    return (
+        edge.edge_type,
+        edge.start_socket.id if edge.start_socket else None,
+        edge.end_socket.id if edge.end_socket else None,
+        edge._event_spec,
+    )
+
+
+def _serialize_changed(
+    items: typing.Iterable,
+    signature: typing.Callable[[typing.Any], tuple],
+    previous: typing.Dict[int, dict],
+    signatures: typing.Dict[int, tuple],
+) -> typing.Dict[int, dict]:
+    """Serialize the items, reusing the previous data of those whose signature is unchanged.
+
+    Updates signatures in place.
+    """
+    out = {}
+    current = {}
+    for item in items:
+        current[item.id] = sig = signature(item)
+        if item.id in previous and signatures.get(item.id) == sig:
+            out[item.id] = previous[item.id]
+        else:
+            out[item.id] = item.serialize()
+    signatures.clear()
+    signatures.update(current)
+    return out
+
+
+def _affects_value(before: ItemData, after: ItemData) -> bool:
+    """Whether a node change may change its value (as opposed to, say, moving it)."""
+    return any(
+        (before or {}).get(key) != (after or {}).get(key)
+        for key in ("custom-state", "deltas_source")
+    )
+
+
+def _changes_size(changes: Changes) -> int:
+    """Rough estimate of how much memory the changes hold on to."""
+    return sum(
+        len(json.dumps(data, separators=(",", ":")))
+        for pair in changes.values()
+        for data in pair
+        if data is not None
+    )
+
+
+class SceneHistory(_SceneHistory):
+    """Scene history storing, for each step, only the nodes and edges that changed.
+
+    Restoring a step patches those items in the live scene, instead of
+    deserializing the whole scene again. Once the steps take up more than
+    HISTORY_MEMORY_BUDGET bytes (roughly), the oldest ones are dropped.
+    """
+
+    scene: "TheatreScene"
+
+    def __init__(self, scene: "TheatreScene"):
+        super().__init__(scene)
+        self.history_limit = config.HISTORY_LIMIT
+        self.memory_budget = config.HISTORY_MEMORY_BUDGET
+
+    def clear(self):
+        super().clear()
+        # nodes the last undo/redo invalidated, which need evaluating again
+        self.stale_nodes: typing.List[StateNode] = []
+        # what the last step stored, undone or redone changed: (nodes, edges), each
+        # mapping ids to their new data (None if removed). None if it could be anything.
+        self.last_changes: typing.Optional[
+            typing.Tuple[typing.Dict[int, ItemData], typing.Dict[int, ItemData]]
+        ] = None
+        # serialized nodes and edges as of the current step
+        self._nodes: typing.Dict[int, dict] = {}
+        self._edges: typing.Dict[int, dict] = {}
+        # signatures of the live nodes and edges, as of when we last serialized them
+        self._node_signatures: typing.Dict[int, tuple] = {}
+        self._edge_signatures: typing.Dict[int, tuple] = {}
+        self._size = 0
+
+    @property
+    def current_nodes(self) -> typing.Dict[int, dict]:
+        """The serialized nodes, as of the current step."""
+        return self._nodes
+
+    @property
+    def current_edges(self) -> typing.Dict[int, dict]:
+        """The serialized edges, as of the current step."""
+        return self._edges
+
+    def snapshot(self) -> dict:
+        """The scene, serialized as scene.serialize() would.
+
+        Only the nodes and edges that changed since the last stamp are serialized
+        again: the others are taken from the current step.
+        """
+        scene = self.scene
+        nodes = _serialize_changed(
+            scene.nodes, _node_signature, self._nodes, dict(self._node_signatures)
+        )
+        edges = _serialize_changed(
+            scene.edges, _edge_signature, self._edges, dict(self._edge_signatures)
+        )
+        return {
+            "id": scene.id,
+            "scene_width": scene.scene_width,
+            "scene_height": scene.scene_height,
+            "nodes": list(nodes.values()),
+            "edges": list(edges.values()),
+        }
+
+    @property
+    def memory_usage(self) -> int:
+        """Estimated size, in bytes, of all stored steps."""
+        return self._size
+
+    def storeHistory(self, desc: str, setModified: bool = False):
+        if self.scene.is_loading:
+            # whoever is bulk-loading the scene will store a stamp once done
+            return
+        if setModified:
+            self.scene.has_been_modified = True
+
+        # storing a new step discards the steps we could have redone
+        for stamp in self.history_stack[self.history_current_step + 1 :]:
+            self._size -= stamp["size"]
+        del self.history_stack[self.history_current_step + 1 :]
+
+        self.history_stack.append(self.createHistoryStamp(desc))
+        self.history_current_step += 1
+
+        while self.history_current_step > 0 and (
+            len(self.history_stack) > self.history_limit
+            or self._size > self.memory_budget
+        ):
+            self._drop_oldest()
+
+        for callback in self._history_modified_listeners:
+            callback()
+        for callback in self._history_stored_listeners:
+            callback()
+
+    def _drop_oldest(self):
+        dropped = self.history_stack.pop(0)
+        self._size -= dropped["size"]
+        self.history_current_step -= 1
+        # there is nothing to undo past the first step: forget its diff.
+        first = self.history_stack[0]
+        self._size -= first["size"]
+        first.update(nodes={}, edges={}, size=0)
+
+    def storeInitialHistoryStamp(self):
+        # the scene may have been loaded from a file: start from scratch
+        self.clear()
+        super().storeInitialHistoryStamp()
+
+    def createHistoryStamp(self, desc: str) -> dict:
+        # only (re)serialize what changed since the last stamp
+        nodes = _serialize_changed(
+            self.scene.nodes, _node_signature, self._nodes, self._node_signatures
+        )
+        edges = _serialize_changed(
+            self.scene.edges, _edge_signature, self._edges, self._edge_signatures
+        )
+
+        if self.history_stack:
+            node_changes = _diff(self._nodes, nodes)
+            edge_changes = _diff(self._edges, edges)
+        else:
+            # there's nothing to undo past the first step
+            node_changes, edge_changes = {}, {}
+        self._nodes, self._edges = nodes, edges
+        self.last_changes = (
+            (
+                {k: after for k, (_, after) in node_changes.items()},
+                {k: after for k, (_, after) in edge_changes.items()},
+            )
+            if self.history_stack
+            else None
+        )
+
+        size = _changes_size(node_changes) + _changes_size(edge_changes)
+        self._size += size
+        return {
+            "desc": desc,
+            "nodes": node_changes,
+            "edges": edge_changes,
+            "size": size,
+            "selection": self.captureCurrentSelection(),
+        }
+
+    def undo(self):
+        if self.canUndo():
+            self._apply(self.history_stack[self.history_current_step], _BEFORE)
+            self.history_current_step -= 1
+            self._after_restore()
+
+    def redo(self):
+        if self.canRedo():
+            self.history_current_step += 1
+            self._apply(self.history_stack[self.history_current_step], _AFTER)
+            self._after_restore()
+
+    def restoreHistory(self):
+        """Reset the whole scene to the current step."""
+        self.scene.deserialize(
+            {
+                "id": self.scene.id,
+                "nodes": list(self._nodes.values()),
+                "edges": list(self._edges.values()),
+            }
+        )
+        self._node_signatures.clear()
+        self._edge_signatures.clear()
+        self._reattach_outputs(set(self.scene.nodes))
+        self.last_changes = None
+        self._after_restore()
+
+    def _reattach_outputs(self, dirty: typing.Set[StateNode]):
+        """Give the dirty nodes and their descendants back their cached outputs.
+
+        Whatever can't be found in the scene's output cache (because its inputs
+        are really new) is left dirty and listed in `stale_nodes`.
+        """
+
+        def has_dirty_ancestor(node: StateNode) -> bool:
+            seen = {node}
+            while (edge_in := node.edge_in) and (node := edge_in.start_node):
+                if node in dirty:
+                    return True
+                if node in seen:  # don't loop forever on a broken graph
+                    return False
+                seen.add(node)
+            return False
+
+        # walk the subtrees top-down, so that parents are done before their children
+        queue = deque(node for node in dirty if not has_dirty_ancestor(node))
+        stale = []
+        while queue:
+            node = queue.popleft()
+            if node.isDirty() or node.isInvalid():
+                if not node.reattach_cached_output():
+                    stale.append(node)
+            queue.extend(node.getChildrenNodes())
+        self.stale_nodes = stale
+
+    def _after_restore(self):
+        self.scene.has_been_modified = True
+        self._restore_selection(self.history_stack[self.history_current_step])
+        for callback in self._history_modified_listeners:
+            callback()
+        for callback in self._history_restored_listeners:
+            callback()
+
+    def _apply(self, stamp: dict, direction: int):
+        """Patch the live scene (and our snapshot) to one side of this stamp's changes."""
+        scene = self.scene
+        hashmap = {}
+        # nodes whose value may not be valid anymore
+        dirty: typing.Set[StateNode] = set()
+        # nodes whose title may have to change (e.g. they're not root anymore)
+        retitle: typing.Set[StateNode] = set()
+
+        self.last_changes = (
+            {k: pair[direction] for k, pair in stamp["nodes"].items()},
+            {k: pair[direction] for k, pair in stamp["edges"].items()},
+        )
+
+        with scene.bulk_load():
+            live_nodes = {node.id: node for node in scene.nodes}
+            for node_id, (before, after) in stamp["nodes"].items():
+                data = (before, after)[direction]
+                node = live_nodes.get(node_id)
+                # serialized afresh at the next stamp
+                self._node_signatures.pop(node_id, None)
+                if data is None:
+                    self._nodes.pop(node_id, None)
+                    if node:
+                        node.remove()
+                    continue
+
+                self._nodes[node_id] = data
+                if node is None:
+                    node = StateNode(scene)
+                    dirty.add(node)
+                elif _affects_value(before, after):
+                    dirty.add(node)
+                node.deserialize(data, hashmap, restore_id=True)
+                node.onDeserialized(data)
+                retitle.add(node)
+
+            for node in scene.nodes:
+                for socket in node.inputs + node.outputs:
+                    hashmap[socket.id] = socket
+
+            live_edges = {edge.id: edge for edge in scene.edges}
+            for edge_id, pair in stamp["edges"].items():
+                data = pair[direction]
+                edge = live_edges.get(edge_id)
+                self._edge_signatures.pop(edge_id, None)
+                end_node = edge.end_socket.node if edge and edge.end_socket else None
+                if data is None:
+                    self._edges.pop(edge_id, None)
+                    if edge:
+                        edge.remove()
+                else:
+                    self._edges[edge_id] = data
+                    if edge is None:
+                        edge = EventEdge(scene)
+                    edge.deserialize(data, hashmap, restore_id=True)
+                    end_node = edge.end_socket.node
+
+                if isinstance(end_node, StateNode):
+                    dirty.add(end_node)
+                    retitle.add(end_node)
+
+            alive = set(scene.nodes)
+            for node in dirty & alive:
+                node.markDirty()
+            for node in retitle & alive:
+                node._update_title()
+
+        self._reattach_outputs(dirty & alive)
+
+    def _restore_selection(self, stamp: dict):
+        previous_selection = self.captureCurrentSelection()
+        selection = stamp["selection"]
+        selected_nodes = set(selection["nodes"])
+        selected_edges = set(selection["edges"])
+
+        for edge in self.scene.edges:
+            edge.grEdge.setSelected(edge.id in selected_edges)
+        for node in self.scene.nodes:
+            node.grNode.setSelected(node.id in selected_nodes)
+
+        self.scene._last_selected_items = self.scene.getSelectedItems()
+        self.undo_selection_has_changed = (
+            self.captureCurrentSelection() != previous_selection
+        )
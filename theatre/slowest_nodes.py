@@ -0,0 +1,147 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Dock listing the nodes of the current scene by how long they took to evaluate.
+
+See theatre.evaluation_timings.
+"""
+
+import typing
+
+from qtpy.QtCore import Qt, QTimer
+from qtpy.QtWidgets import (
+    QAbstractItemView,
+    QHeaderView,
+    QLabel,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from theatre.evaluation_timings import format_duration, format_timing
+from theatre.trace_tree_widget.state_node import StateNode
+
+if typing.TYPE_CHECKING:
+    from theatre.main_window import TheatreMainWindow
+    from theatre.theatre_scene import TheatreScene
+    from theatre.trace_tree_widget.structs import EvaluationTiming
+
+REFRESH_DELAY_MS = 300
+"""How long to wait for more nodes to be (re)evaluated before refreshing the table."""
+
+_COLUMNS = ("Node", "Wall", "CPU", "Consistency", "Setup", "Handlers")
+
+
+class _DurationItem(QTableWidgetItem):
+    """Shows a duration, sorts by its value."""
+
+    def __init__(self, seconds: float):
+        super().__init__(format_duration(seconds))
+        self.seconds = seconds
+        self.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+
+    def __lt__(self, other: QTableWidgetItem) -> bool:
+        if isinstance(other, _DurationItem):
+            return self.seconds < other.seconds
+        return super().__lt__(other)
+
+
+def _node_label(node: StateNode) -> str:
+    edge_in = node.edge_in
+    if edge_in is not None and edge_in.is_event_spec_set:
+        return f"{node.title} ← {edge_in.event_spec.event.name}"
+    return node.title
+
+
+class SlowestNodesWidget(QWidget):
+    def __init__(self, main_window: "TheatreMainWindow"):
+        super().__init__(main_window)
+        self._main_window = main_window
+
+        self.status_label = QLabel(self)
+        self.table = table = QTableWidget(0, len(_COLUMNS), self)
+        table.setHorizontalHeaderLabels(_COLUMNS)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setSelectionMode(QAbstractItemView.SingleSelection)
+        table.verticalHeader().hide()
+        header = table.horizontalHeader()
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        for column in range(1, len(_COLUMNS)):
+            header.setSectionResizeMode(column, QHeaderView.ResizeToContents)
+        table.itemActivated.connect(self._on_item_activated)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.status_label)
+        layout.addWidget(table)
+
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(REFRESH_DELAY_MS)
+        self._refresh_timer.timeout.connect(self.refresh)
+
+        self._nodes: typing.List[StateNode] = []
+
+    @property
+    def _scene(self) -> typing.Optional["TheatreScene"]:
+        editor = self._main_window.current_node_editor
+        return editor.scene if editor else None
+
+    def schedule_refresh(self, *_):
+        # nothing to keep up to date while nobody's looking
+        if self.isVisible():
+            self._refresh_timer.start()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+
+    def refresh(self):
+        table = self.table
+        scene = self._scene
+        ranked = scene.timings.slowest() if scene else []
+
+        # sorting while filling in moves rows around under our feet
+        table.setSortingEnabled(False)
+        table.setRowCount(len(ranked))
+        self._nodes = []
+        total = 0.0
+        for row, (node, timing) in enumerate(ranked):
+            self._nodes.append(node)
+            total += timing.wall
+            self._fill_row(row, node, timing)
+        table.setSortingEnabled(True)
+
+        if scene is None:
+            self.status_label.clear()
+        else:
+            self.status_label.setText(
+                f"{len(ranked)} nodes evaluated in this session, "
+                f"{format_duration(total)} in total"
+            )
+
+    def _fill_row(self, row: int, node: StateNode, timing: "EvaluationTiming"):
+        label = QTableWidgetItem(node.icon, _node_label(node))
+        # the index into self._nodes, which survives sorting
+        label.setData(Qt.UserRole, row)
+        label.setToolTip(format_timing(timing))
+        self.table.setItem(row, 0, label)
+        phases = (
+            timing.wall,
+            timing.cpu,
+            timing.consistency,
+            timing.setup,
+            timing.handler,
+        )
+        for column, seconds in enumerate(phases, start=1):
+            self.table.setItem(row, column, _DurationItem(seconds))
+
+    def _on_item_activated(self, item: QTableWidgetItem):
+        index = self.table.item(item.row(), 0).data(Qt.UserRole)
+        node = self._nodes[index]
+        scene = node.scene
+        scene.grScene.clearSelection()
+        node.grNode.setSelected(True)
+        scene.getView().centerOn(node.grNode)
+        scene.state_node_clicked.emit(node)
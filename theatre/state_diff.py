@@ -0,0 +1,187 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Structural diff of two scenario.State objects: what an event changed.
+
+States are compared field by field. Mappings (config, databags, stored state
+contents...) are compared key by key, and lists of entities are matched by
+identity instead of by position: relations by id, containers by name, secrets
+by id, and so on. Anything else is compared as a whole.
+"""
+
+import dataclasses
+import typing
+from dataclasses import dataclass
+
+from scenario.state import (
+    Container,
+    DeferredEvent,
+    Network,
+    PeerRelation,
+    Port,
+    Relation,
+    Secret,
+    Storage,
+    StoredState,
+    SubordinateRelation,
+    _EntityStatus,
+)
+
+if typing.TYPE_CHECKING:
+    from scenario import State
+
+MAX_VALUE_LENGTH = 80
+"""Values are cut short to this length in diff descriptions."""
+
+
+def _relation_id(relation) -> str:
+    return f"{relation.endpoint}:{relation.relation_id}"
+
+
+# how to tell which entity in the old list is which in the new one, and what to call it
+_IDENTITIES: typing.Dict[type, typing.Callable[[typing.Any], str]] = {
+    # one identity for all kinds of relation, so that a list mixing them diffs per item
+    Relation: _relation_id,
+    PeerRelation: _relation_id,
+    SubordinateRelation: _relation_id,
+    Container: lambda c: c.name,
+    Secret: lambda s: s.id,
+    StoredState: lambda s: f"{s.owner_path or ''}[{s.name}]",
+    Storage: lambda s: f"{s.name}/{s.index}",
+    Network: lambda n: n.name,
+    DeferredEvent: lambda d: d.handle_path,
+    Port: lambda p: f"{p.port}/{p.protocol}",
+}
+
+# compared as a whole, even though they're dataclasses
+_LEAVES = (_EntityStatus,)
+
+ChangeKind = typing.Literal["added", "removed", "modified"]
+
+
+@dataclass(frozen=True)
+class Change:
+    path: typing.Tuple[str, ...]
+    kind: ChangeKind
+    old: typing.Any = None
+    new: typing.Any = None
+
+    def describe(self) -> str:
+        path = "/".join(self.path)
+        if self.kind == "added":
+            return f"+ {path}: {format_value(self.new)}"
+        if self.kind == "removed":
+            return f"- {path}: {format_value(self.old)}"
+        return f"~ {path}: {format_value(self.old)} -> {format_value(self.new)}"
+
+
+@dataclass(frozen=True)
+class StateDiff:
+    """What changed between two states."""
+
+    changes: typing.Tuple[Change, ...] = ()
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def __len__(self):
+        return len(self.changes)
+
+    def describe(self, limit: int = 20) -> str:
+        """One line per change, up to limit."""
+        if not self.changes:
+            return "no changes"
+        lines = [change.describe() for change in self.changes[:limit]]
+        if len(self.changes) > limit:
+            lines.append(f"... and {len(self.changes) - limit} more")
+        return "\n".join(lines)
+
+
+def format_value(value: typing.Any) -> str:
+    if isinstance(value, _EntityStatus):
+        text = f"{value.name}({value.message!r})"
+    else:
+        text = repr(value)
+    if len(text) > MAX_VALUE_LENGTH:
+        return text[: MAX_VALUE_LENGTH - 1] + "…"
+    return text
+
+
+def _is_dataclass_instance(value: typing.Any) -> bool:
+    return dataclasses.is_dataclass(value) and not isinstance(value, type)
+
+
+def _identity(items: typing.Sequence) -> typing.Optional[typing.Callable]:
+    """How to identify items, if they're all entities of a known kind."""
+    identities = {_IDENTITIES.get(type(item)) for item in items}
+    if len(identities) == 1:
+        return identities.pop()
+    return None
+
+
+def _strict_equal(old: typing.Any, new: typing.Any) -> bool:
+    """old == new, except that 1, 1.0 and True are all different."""
+    if old is new:
+        return True
+    if type(old) is not type(new):
+        return False
+    if isinstance(old, typing.Mapping):
+        return old.keys() == new.keys() and all(
+            _strict_equal(value, new[key]) for key, value in old.items()
+        )
+    if isinstance(old, (list, tuple)):
+        return len(old) == len(new) and all(map(_strict_equal, old, new))
+    if _is_dataclass_instance(old):
+        return all(
+            _strict_equal(getattr(old, field.name), getattr(new, field.name))
+            for field in dataclasses.fields(old)
+        )
+    return old == new
+
+
+def _diff(
+    path: typing.Tuple[str, ...],
+    old: typing.Any,
+    new: typing.Any,
+    changes: typing.List[Change],
+):
+    if old is new or (old == new and _strict_equal(old, new)):
+        return
+
+    if (
+        _is_dataclass_instance(old)
+        and type(old) is type(new)
+        and not isinstance(old, _LEAVES)
+    ):
+        for field in dataclasses.fields(old):
+            name = field.name
+            _diff(path + (name,), getattr(old, name), getattr(new, name), changes)
+        return
+
+    if isinstance(old, typing.Mapping) and isinstance(new, typing.Mapping):
+        for key, value in old.items():
+            if key not in new:
+                changes.append(Change(path + (str(key),), "removed", old=value))
+            else:
+                _diff(path + (str(key),), value, new[key], changes)
+        for key, value in new.items():
+            if key not in old:
+                changes.append(Change(path + (str(key),), "added", new=value))
+        return
+
+    sequences = (list, tuple, set, frozenset)
+    if isinstance(old, sequences) and isinstance(new, sequences):
+        identity = _identity([*old, *new])
+        if identity:
+            old_by_id = {identity(item): item for item in old}
+            new_by_id = {identity(item): item for item in new}
+            _diff(path, old_by_id, new_by_id, changes)
+            return
+
+    changes.append(Change(path, "modified", old=old, new=new))
+
+
+def diff_states(old: "State", new: "State") -> StateDiff:
+    """What changed going from old to new."""
+    changes: typing.List[Change] = []
+    _diff((), old, new, changes)
+    return StateDiff(tuple(changes))
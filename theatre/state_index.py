@@ -0,0 +1,301 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""In-memory index over the evaluated states of a scene, and a small query language.
+
+Each state is flattened to (path, value) pairs once, when its node gets a value;
+the index maps each pair back to the nodes it's found in. Queries only look up
+those mappings, so they don't get slower with the size of the states, and the
+number of nodes only matters in that it's the size of the result.
+
+Paths are dot-separated field names, mapping keys and list indices, e.g.
+``leader``, ``config.port`` or ``relations.db.remote_app_data.host``. Entities in
+lists are named instead of numbered: relations by endpoint, containers, storage,
+networks and stored state by name, secrets by id. ``*`` matches any segment.
+
+Queries are one or more terms, all of which must match (``and`` is optional):
+    - ``path = value``, ``path != value``: equality with the (leaf) value;
+    - ``path ~ text``: the value contains text, case-insensitively;
+    - ``has path``: the state has that field, key or entity;
+    - ``status:name``: shorthand for ``unit_status = name``;
+    - ``exception:TypeName``: evaluation failed with that exception (or a subclass);
+    - ``not term``.
+Values with spaces (or operators) in them can be quoted.
+"""
+
+import dataclasses
+import re
+import typing
+
+from scenario.state import (
+    Container,
+    Network,
+    PeerRelation,
+    Relation,
+    Secret,
+    Storage,
+    StoredState,
+    SubordinateRelation,
+    _EntityStatus,
+)
+
+if typing.TYPE_CHECKING:
+    from theatre.trace_tree_widget.structs import StateNodeOutput
+
+_K = typing.TypeVar("_K", bound=typing.Hashable)
+Fact = typing.Tuple[str, typing.Optional[str]]
+"""(path, value); value is None for paths that aren't leaves."""
+
+# what entities in lists are called in paths
+_LABELS: typing.Dict[type, typing.Callable[[typing.Any], str]] = {
+    Relation: lambda r: r.endpoint,
+    PeerRelation: lambda r: r.endpoint,
+    SubordinateRelation: lambda r: r.endpoint,
+    Container: lambda c: c.name,
+    Secret: lambda s: s.id,
+    StoredState: lambda s: s.name,
+    Storage: lambda s: s.name,
+    Network: lambda n: n.name,
+}
+
+
+class QueryError(ValueError):
+    """Raised if a query can't be parsed."""
+
+
+def _label(item: typing.Any, position: int) -> str:
+    label = _LABELS.get(type(item))
+    return label(item) if label else str(position)
+
+
+def normalize(value: typing.Any) -> str:
+    """How leaf values are indexed, and compared to the values in queries."""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def flatten(output: "StateNodeOutput") -> typing.List[Fact]:
+    """All facts about an output: every path in its state, and its exception."""
+    facts: typing.List[Fact] = []
+    if output.exception is not None:
+        for cls in type(output.exception).__mro__:
+            if cls in (BaseException, object):
+                break
+            facts.append(("exception", cls.__name__))
+    if not output.state:
+        return facts
+
+    # iterative, to be safe with deeply nested stored state
+    stack: typing.List[typing.Tuple[str, typing.Any]] = [("", output.state)]
+    while stack:
+        path, value = stack.pop()
+        prefix = f"{path}." if path else ""
+        if isinstance(value, _EntityStatus):
+            facts.append((path, value.name))
+            facts.append((f"{prefix}message", value.message))
+            continue
+
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            children = (
+                (f.name, getattr(value, f.name)) for f in dataclasses.fields(value)
+            )
+        elif isinstance(value, typing.Mapping):
+            children = ((str(k), v) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            children = ((_label(item, i), item) for i, item in enumerate(value))
+        else:
+            facts.append((path, normalize(value)))
+            continue
+
+        if path:
+            facts.append((path, None))
+        stack.extend((f"{prefix}{key}", child) for key, child in children)
+    return facts
+
+
+class StateIndex(typing.Generic[_K]):
+    """Which nodes' states have what values at which paths."""
+
+    def __init__(self):
+        # path -> value -> keys
+        self._values: typing.Dict[str, typing.Dict[str, typing.Set[_K]]] = {}
+        # path -> keys; includes non-leaf paths
+        self._paths: typing.Dict[str, typing.Set[_K]] = {}
+        self._facts: typing.Dict[_K, typing.List[Fact]] = {}
+        self.version = 0
+        """Incremented on every change."""
+
+    def __len__(self):
+        return len(self._facts)
+
+    def __contains__(self, key: _K):
+        return key in self._facts
+
+    @property
+    def keys(self) -> typing.Set[_K]:
+        return set(self._facts)
+
+    def update(self, key: _K, output: typing.Optional["StateNodeOutput"]):
+        """(Re)index the output of key; None to drop it."""
+        self.discard(key)
+        if output is None:
+            return
+        facts = flatten(output)
+        self._facts[key] = facts
+        for path, value in facts:
+            self._paths.setdefault(path, set()).add(key)
+            if value is not None:
+                self._values.setdefault(path, {}).setdefault(value, set()).add(key)
+
+    def discard(self, key: _K):
+        facts = self._facts.pop(key, None)
+        self.version += 1
+        if facts is None:
+            return
+        for path, value in facts:
+            _remove(self._paths, path, key)
+            values = self._values.get(path)
+            if value is not None and values is not None:
+                _remove(values, value, key)
+                if not values:
+                    del self._values[path]
+
+    def clear(self):
+        self._values.clear()
+        self._paths.clear()
+        self._facts.clear()
+        self.version += 1
+
+    def _matching_paths(self, pattern: str) -> typing.Iterable[str]:
+        if "*" not in pattern:
+            return (pattern,)
+        # a wildcard stands for a single segment
+        regex = re.compile("[^.]*".join(map(re.escape, pattern.split("*"))))
+        return [path for path in self._paths if regex.fullmatch(path)]
+
+    def has(self, pattern: str) -> typing.Set[_K]:
+        out = set()
+        for path in self._matching_paths(pattern):
+            out.update(self._paths.get(path, ()))
+        return out
+
+    def equal(self, pattern: str, value: str) -> typing.Set[_K]:
+        out = set()
+        for path in self._matching_paths(pattern):
+            out.update(self._values.get(path, {}).get(value, ()))
+        return out
+
+    def contains(self, pattern: str, text: str) -> typing.Set[_K]:
+        """Keys with a value at path containing text; scans distinct values, not states."""
+        text = text.lower()
+        out = set()
+        for path in self._matching_paths(pattern):
+            for value, keys in self._values.get(path, {}).items():
+                if text in value.lower():
+                    out.update(keys)
+        return out
+
+    def query(self, query: str) -> typing.Set[_K]:
+        return compile_query(query)(self)
+
+
+def _remove(mapping: typing.Dict[typing.Any, set], item, key):
+    keys = mapping.get(item)
+    if keys is None:
+        return
+    keys.discard(key)
+    if not keys:
+        del mapping[item]
+
+
+_TOKEN = re.compile(r"""\s*("(?:[^"\\]|\\.)*"|'[^']*'|!=|==|=|~|[^\s=!~"']+)""")
+_OPERATORS = ("=", "==", "!=", "~")
+Query = typing.Callable[[StateIndex], typing.Set]
+
+
+def _tokenize(query: str) -> typing.List[str]:
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = _TOKEN.match(query, pos)
+        if not match:
+            raise QueryError(f"unexpected {query[pos:]!r}")
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+
+def _unquote(token: str) -> str:
+    if len(token) >= 2 and token[0] == token[-1] and token[0] in "\"'":
+        return re.sub(r"\\(.)", r"\1", token[1:-1]) if token[0] == '"' else token[1:-1]
+    return token
+
+
+def _literal(token: str) -> str:
+    if token in _OPERATORS:
+        raise QueryError(f"expected a value, got {token!r}")
+    value = _unquote(token)
+    if token == value and value.lower() in ("true", "false", "null"):
+        return value.lower()
+    return value
+
+
+def compile_query(query: str) -> Query:
+    """Parse a query into a function of the index returning the matching keys."""
+    tokens = _tokenize(query)
+    if not tokens:
+        raise QueryError("empty query")
+    terms: typing.List[Query] = []
+    pos = 0
+
+    def term() -> Query:
+        nonlocal pos
+        token = tokens[pos]
+        pos += 1
+        if token == "not":
+            if pos >= len(tokens):
+                raise QueryError("'not' what?")
+            negated = term()
+            return lambda index: index.keys - negated(index)
+        if token == "has":
+            if pos >= len(tokens):
+                raise QueryError("'has' what?")
+            path = _unquote(tokens[pos])
+            pos += 1
+            return lambda index: index.has(path)
+        if token.startswith("status:"):
+            status = _literal(token[len("status:") :])
+            return lambda index: index.equal("unit_status", status)
+        if token.startswith("exception:"):
+            name = _literal(token[len("exception:") :])
+            return lambda index: index.equal("exception", name)
+
+        path = _unquote(token)
+        if pos + 1 >= len(tokens) or tokens[pos] not in _OPERATORS:
+            raise QueryError(f"expected an operator and a value after {path!r}")
+        op, value = tokens[pos], _literal(tokens[pos + 1])
+        pos += 2
+        if op == "~":
+            return lambda index: index.contains(path, value)
+        if op == "!=":
+            return lambda index: index.has(path) - index.equal(path, value)
+        return lambda index: index.equal(path, value)
+
+    while pos < len(tokens):
+        if tokens[pos] == "and":
+            pos += 1
+            continue
+        terms.append(term())
+
+    def run(index: StateIndex) -> typing.Set:
+        result = terms[0](index)
+        for other in terms[1:]:
+            if not result:
+                break
+            result = result & other(index)
+        return result
+
+    return run
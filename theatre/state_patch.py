@@ -0,0 +1,271 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Store custom states in scene files as patches against a base state.
+
+Scenes are often built from many near-identical custom roots, each of which
+would otherwise be saved in full. When serializing a scene, each custom state
+is instead diffed against a few candidate bases and saved as the smallest patch:
+
+    - the null state, ``State()``;
+    - the library StateSpec the node was created from (matched by node name);
+    - the custom state of the first node with the same name. Patching against the
+      previous node instead would chain all same-named nodes together, and
+      loading any one of them would mean resolving all those before it.
+
+Library bases are embedded (once) in the scene under STATE_BASES_KEY, so the
+file does not break if the library changes.
+
+Patches work on the json-native encoding of `theatre.scenario_json`:
+    - ``{"=": value}``: replace the value;
+    - ``{"{}": {key: patch, ...}, "-": [key, ...]}``: patch some keys of a dict,
+      remove some others;
+    - ``{"[]": {"index": patch, ...}}``: patch some items of a list of the same
+      length.
+"""
+
+import copy
+import json
+import typing
+
+from scenario import State
+
+from theatre.logger import logger as theatre_logger
+from theatre.scenario_json import dump_state
+from theatre.scene_format import LAZY_PAYLOAD_KEY, LazyPayload
+
+if typing.TYPE_CHECKING:
+    from theatre.theatre_scene import SerializedScene
+
+logger = theatre_logger.getChild("state_patch")
+
+CUSTOM_STATE_KEY = "custom-state"
+PATCHED_STATE_KEY = "custom-state-patch"
+STATE_BASES_KEY = "state-bases"
+NULL_BASE = "null"
+LIBRARY_BASE_PREFIX = "library:"
+NODE_BASE_PREFIX = "node:"
+
+Patch = typing.Optional[dict]
+"""A patch; None means 'no changes'."""
+
+_NULL_STATE: typing.Optional[dict] = None
+
+
+class PatchError(ValueError):
+    """Raised if a patched state can't be resolved."""
+
+
+def _null_state() -> dict:
+    global _NULL_STATE
+    if _NULL_STATE is None:
+        _NULL_STATE = dump_state(State())
+    return _NULL_STATE
+
+
+def make_patch(base: typing.Any, target: typing.Any) -> Patch:
+    """Compute a patch turning base into target."""
+    if base is target:
+        return None
+
+    if isinstance(base, dict) and isinstance(target, dict):
+        changed = {}
+        for key, value in target.items():
+            if key not in base:
+                changed[key] = {"=": value}
+            elif (sub := make_patch(base[key], value)) is not None:
+                changed[key] = sub
+        removed = [key for key in base if key not in target]
+        if not changed and not removed:
+            return None
+        patch: dict = {"{}": changed}
+        if removed:
+            patch["-"] = removed
+        return patch
+
+    if isinstance(base, list) and isinstance(target, list) and len(base) == len(target):
+        changed = {
+            str(i): sub
+            for i, (old, new) in enumerate(zip(base, target))
+            if (sub := make_patch(old, new)) is not None
+        }
+        return {"[]": changed} if changed else None
+
+    # 1 == 1.0 == True, but a config option going from one to the other is a change
+    if type(base) is type(target) and base == target:
+        return None
+    return {"=": target}
+
+
+def apply_patch(base: typing.Any, patch: Patch) -> typing.Any:
+    """Apply a patch to a copy of base; base is not modified, nor shared with the result."""
+    if patch is None:
+        return copy.deepcopy(base)
+    if "=" in patch:
+        return copy.deepcopy(patch["="])
+    if "{}" in patch:
+        if not isinstance(base, dict):
+            raise PatchError(f"cannot apply a dict patch to {type(base)}")
+        subs = patch["{}"]
+        removed = set(patch.get("-", ()))
+        out = {
+            key: apply_patch(value, subs.get(key))
+            for key, value in base.items()
+            if key not in removed
+        }
+        for key, sub in subs.items():
+            if key not in out:
+                out[key] = apply_patch(base.get(key), sub)
+        return out
+    if "[]" in patch:
+        if not isinstance(base, list):
+            raise PatchError(f"cannot apply a list patch to {type(base)}")
+        subs = {int(index): sub for index, sub in patch["[]"].items()}
+        if any(index >= len(base) for index in subs):
+            raise PatchError(f"list patch out of range for {len(base)} items")
+        return [apply_patch(item, subs.get(index)) for index, item in enumerate(base)]
+    raise PatchError(f"invalid patch: {patch}")
+
+
+def _patch_size(patch: Patch) -> int:
+    return 0 if patch is None else len(json.dumps(patch, separators=(",", ":")))
+
+
+def _get_library_state(name: str) -> typing.Optional[State]:
+    from theatre.trace_tree_widget.library_widget import StateSpec, get_spec
+
+    try:
+        spec = get_spec(name)
+    except StopIteration:
+        return None
+    return spec.state if isinstance(spec, StateSpec) else None
+
+
+def encode_state_patches(data: "SerializedScene") -> "SerializedScene":
+    """Replace the full custom states in a serialized scene with patches."""
+    bases: typing.Dict[str, dict] = {}
+    # first full custom state seen, by node name
+    first_by_name: typing.Dict[str, typing.Tuple[int, dict]] = {}
+    nodes = []
+
+    for node_data in data["nodes"]:
+        custom_state = node_data.get(CUSTOM_STATE_KEY)
+        if not custom_state:
+            nodes.append(node_data)
+            continue
+
+        name = node_data.get("name", "")
+        candidates = [(NULL_BASE, _null_state())]
+        if (library_state := _get_library_state(name)) is not None:
+            ref = LIBRARY_BASE_PREFIX + name
+            if ref not in bases:
+                bases[ref] = dump_state(library_state)
+            candidates.append((ref, bases[ref]))
+        if first := first_by_name.get(name):
+            first_id, first_state = first
+            candidates.append((f"{NODE_BASE_PREFIX}{first_id}", first_state))
+        else:
+            first_by_name[name] = (node_data["id"], custom_state)
+
+        best_ref, best_patch, best_size = None, None, None
+        for ref, base in candidates:
+            patch = make_patch(base, custom_state)
+            size = _patch_size(patch)
+            if best_size is None or size < best_size:
+                best_ref, best_patch, best_size = ref, patch, size
+
+        node_data = {k: v for k, v in node_data.items() if k != CUSTOM_STATE_KEY}
+        node_data[PATCHED_STATE_KEY] = {"base": best_ref, "patch": best_patch}
+        nodes.append(node_data)
+
+    out = {**data, "nodes": nodes}
+    # only keep the library bases someone is actually patched against
+    used = {
+        node_data[PATCHED_STATE_KEY]["base"]
+        for node_data in nodes
+        if PATCHED_STATE_KEY in node_data
+    }
+    if library_bases := {ref: base for ref, base in bases.items() if ref in used}:
+        out[STATE_BASES_KEY] = library_bases
+    return out
+
+
+class PatchedPayload(LazyPayload):
+    """Lazy payload of a node whose custom state may be a patch against some base."""
+
+    def __init__(self, payload: LazyPayload, resolve: typing.Callable[[int], dict]):
+        self._payload = payload
+        self._resolve = resolve
+        self.node_id = payload.node_id
+
+    def load(self) -> dict:
+        return {CUSTOM_STATE_KEY: self._resolve(self.node_id)}
+
+    def __repr__(self):
+        return f"<PatchedPayload {self._payload}>"
+
+
+def decode_state_patches(data: "SerializedScene") -> "SerializedScene":
+    """Resolve the patched custom states in a serialized scene into full ones.
+
+    Lazy payloads (from packed scenes) are wrapped so that they are resolved
+    only when loaded.
+    """
+    nodes_data = data["nodes"]
+    if not any(
+        PATCHED_STATE_KEY in node_data or LAZY_PAYLOAD_KEY in node_data
+        for node_data in nodes_data
+    ):
+        return data
+
+    bases = data.get(STATE_BASES_KEY, {})
+    by_id = {node_data["id"]: node_data for node_data in nodes_data}
+    resolved: typing.Dict[int, dict] = {}
+
+    def resolve_base(ref: str) -> dict:
+        if ref == NULL_BASE:
+            return _null_state()
+        if ref in bases:
+            return bases[ref]
+        raise PatchError(f"unknown base state {ref!r}")
+
+    def resolve(node_id: int) -> dict:
+        # follow the chain of node bases down to a full state, then patch our way
+        # back up; iteratively, as scenes saved by older versions chain all nodes
+        # with the same name together
+        chain: typing.List[typing.Tuple[int, Patch]] = []
+        seen: typing.Set[int] = set()
+        while (state := resolved.get(node_id)) is None:
+            if node_id in seen:
+                raise PatchError(f"circular base state reference on node {node_id}")
+            seen.add(node_id)
+            node_data = by_id.get(node_id)
+            if node_data is None:
+                raise PatchError(f"base node {node_id} not found")
+            if lazy := node_data.get(LAZY_PAYLOAD_KEY):
+                node_data = lazy.load()
+            if (state := node_data.get(CUSTOM_STATE_KEY)) is not None:
+                resolved[node_id] = state
+                break
+            patched = node_data[PATCHED_STATE_KEY]
+            chain.append((node_id, patched["patch"]))
+            ref = patched["base"]
+            if not ref.startswith(NODE_BASE_PREFIX):
+                state = resolve_base(ref)
+                break
+            node_id = int(ref[len(NODE_BASE_PREFIX) :])
+
+        for patched_id, patch in reversed(chain):
+            state = apply_patch(state, patch)
+            resolved[patched_id] = state
+        return state
+
+    nodes = []
+    for node_data in nodes_data:
+        if PATCHED_STATE_KEY in node_data:
+            node_id = node_data["id"]
+            node_data = {k: v for k, v in node_data.items() if k != PATCHED_STATE_KEY}
+            node_data[CUSTOM_STATE_KEY] = resolve(node_id)
+        elif lazy := node_data.get(LAZY_PAYLOAD_KEY):
+            node_data = {**node_data, LAZY_PAYLOAD_KEY: PatchedPayload(lazy, resolve)}
+        nodes.append(node_data)
+    return {**data, "nodes": nodes}
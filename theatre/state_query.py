@@ -0,0 +1,245 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Dock to query the evaluated states of the current scene, and the traces through them.
+
+See theatre.state_index and theatre.trace_query for the query languages.
+"""
+
+import time
+import typing
+from datetime import datetime
+
+from qtpy.QtCore import Qt, QTimer
+from qtpy.QtWidgets import (
+    QComboBox,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QListWidget,
+    QListWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from theatre.helpers import get_icon
+from theatre.state_index import QueryError, compile_query
+from theatre.trace_query import compile_pattern, find_traces
+from theatre.trace_tree_widget.event_edge import EventEdge
+from theatre.trace_tree_widget.state_node import StateNode
+
+if typing.TYPE_CHECKING:
+    from theatre.main_window import TheatreMainWindow
+    from theatre.theatre_scene import TheatreScene
+
+REFRESH_DELAY_MS = 200
+"""How long to wait for more nodes to change before running the query again."""
+
+STATES, TRACES, LOGS = "States", "Traces", "Logs"
+_PLACEHOLDERS = {
+    STATES: "e.g. status:blocked, relations.db.remote_app_data.host = foo",
+    TRACES: "e.g. [status:active] .{1,2} [status:blocked]",
+    LOGS: 'e.g. KeyError, "no relation", connect* NOT pebble',
+}
+_TOOLTIPS = {
+    STATES: "Find evaluated states.\n"
+    "path = value, path != value, path ~ text, has path,\n"
+    "status:<name>, exception:<type>, not <term>.\n"
+    "Enter selects all matching nodes.",
+    TRACES: "Find stretches of traces.\n"
+    "event names (with globs), !event, . for any event, [state query],\n"
+    "^ and $ for the start and end of a trace, ( ), |, * + ? {m,n}.\n"
+    "Enter selects all matching paths.",
+    LOGS: "Search the logs and tracebacks of all recorded evaluations of this charm,\n"
+    "in any scene and session; see theatre.results_store.\n"
+    "Enter selects all matching nodes in this scene.",
+}
+
+
+def _out_edges(node: StateNode) -> typing.Iterator[EventEdge]:
+    """The edges out of node, including those from its deltas."""
+    for socket in node.outputs:
+        for edge in socket.edges:
+            if edge.end_socket and edge.is_event_spec_set:
+                yield edge
+
+
+class StateQueryWidget(QWidget):
+    def __init__(self, main_window: "TheatreMainWindow"):
+        super().__init__(main_window)
+        self._main_window = main_window
+
+        self.mode = mode = QComboBox(self)
+        mode.addItems([STATES, TRACES, LOGS])
+        mode.setToolTip(
+            "Query single states, sequences of events and states, or recorded logs."
+        )
+        mode.currentTextChanged.connect(self._on_mode_changed)
+
+        self.query_bar = query_bar = QLineEdit(self)
+        query_bar.setClearButtonEnabled(True)
+        query_bar.textChanged.connect(self.refresh)
+        query_bar.returnPressed.connect(self.select_all)
+
+        self.status_label = QLabel(self)
+        self.results = results = QListWidget(self)
+        results.itemActivated.connect(self._on_item_activated)
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        bar = QHBoxLayout()
+        bar.addWidget(mode)
+        bar.addWidget(query_bar)
+        layout.addLayout(bar)
+        layout.addWidget(self.status_label)
+        layout.addWidget(results)
+
+        # rerun the query once nodes are done (re)evaluating
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(REFRESH_DELAY_MS)
+        self._refresh_timer.timeout.connect(self.refresh)
+
+        # one list of nodes per match; single nodes for state queries
+        self._matches: typing.List[typing.List[StateNode]] = []
+        # the edge leading to each node in the matched traces
+        self._edges_in: typing.Dict[StateNode, EventEdge] = {}
+        self._on_mode_changed(STATES)
+
+    @property
+    def _scene(self) -> typing.Optional["TheatreScene"]:
+        editor = self._main_window.current_node_editor
+        return editor.scene if editor else None
+
+    def focus(self):
+        self.query_bar.setFocus()
+        self.query_bar.selectAll()
+
+    def schedule_refresh(self, *_):
+        if self.query_bar.text().strip():
+            self._refresh_timer.start()
+
+    def _on_mode_changed(self, mode: str):
+        self.query_bar.setPlaceholderText(_PLACEHOLDERS[mode])
+        self.query_bar.setToolTip(_TOOLTIPS[mode])
+        self.refresh()
+
+    def refresh(self):
+        self._matches = []
+        self._edges_in = {}
+        self.results.clear()
+        scene = self._scene
+        text = self.query_bar.text()
+        if not text.strip() or scene is None:
+            self.status_label.clear()
+            return
+        try:
+            mode = self.mode.currentText()
+            if mode == TRACES:
+                self._refresh_traces(scene, text)
+            elif mode == LOGS:
+                self._refresh_logs(scene, text)
+            else:
+                self._refresh_states(scene, text)
+        except QueryError as e:
+            self.status_label.setText(f"invalid query: {e}")
+
+    def _refresh_states(self, scene: "TheatreScene", text: str):
+        query = compile_query(text)
+        start = time.perf_counter()
+        matches = query(scene.state_index)
+        elapsed = (time.perf_counter() - start) * 1000
+        # in reading order, left to right
+        for node in sorted(matches, key=lambda node: (node.pos.x(), node.pos.y())):
+            self._add_result([node], node.icon, f"{node.title} ({node.description})")
+        self.status_label.setText(
+            f"{len(self._matches)} of {len(scene.state_index)} evaluated states "
+            f"match ({elapsed:.1f}ms)"
+        )
+
+    def _refresh_traces(self, scene: "TheatreScene", text: str):
+        pattern = compile_pattern(text)
+        start = time.perf_counter()
+        roots = [
+            node for node in scene.nodes if isinstance(node, StateNode) and node.is_root
+        ]
+        edges_in = self._edges_in
+
+        def children(node: StateNode):
+            for edge in _out_edges(node):
+                child = edge.end_socket.node
+                edges_in[child] = edge
+                yield edge.event_spec.event.name, child
+
+        matches = find_traces(pattern, roots, children, scene.state_index)
+        elapsed = (time.perf_counter() - start) * 1000
+        for path in sorted(matches, key=lambda path: (path[0].pos.y(), len(path))):
+            events = [edges_in[node].event_spec.event.name for node in path[1:]]
+            label = " → ".join([path[0].title, *events]) if events else path[0].title
+            self._add_result(path, path[-1].icon, label)
+        self.status_label.setText(
+            f"{len(self._matches)} matching paths from {len(roots)} roots "
+            f"({elapsed:.1f}ms)"
+        )
+
+    def _refresh_logs(self, scene: "TheatreScene", text: str):
+        store = scene.results_store
+        if store is None:
+            self.status_label.setText("no results recorded: open a charm repo first")
+            return
+        start = time.perf_counter()
+        hits = store.search(text)
+        elapsed = (time.perf_counter() - start) * 1000
+        nodes = {node.id: node for node in scene.nodes}
+        here = 0
+        for hit in hits:
+            node = nodes.get(hit.node) if hit.scene == scene.id else None
+            outcome = hit.exception_type or hit.status
+            snippet = " ".join(hit.snippet.split())
+            label = f"{hit.event} ({outcome}): {snippet}"
+            if node is None:
+                self._add_result([], get_icon("pending"), f"[elsewhere] {label}")
+            else:
+                here += 1
+                self._add_result([node], node.icon, label)
+            when = datetime.fromtimestamp(hit.created).strftime("%Y-%m-%d %H:%M:%S")
+            self.results.item(self.results.count() - 1).setToolTip(
+                f"recorded {when}, scene {hit.scene}, node {hit.node}"
+            )
+        self.status_label.setText(
+            f"{len(hits)} recorded results match, {here} in this scene ({elapsed:.1f}ms)"
+        )
+
+    def _add_result(self, nodes: typing.List[StateNode], icon, label: str):
+        self._matches.append(nodes)
+        item = QListWidgetItem(icon, label)
+        item.setData(Qt.UserRole, len(self._matches) - 1)
+        self.results.addItem(item)
+
+    def _select(self, matches: typing.Sequence[typing.List[StateNode]]):
+        scene = self._scene
+        # recorded results may be about nodes that aren't in this scene
+        matches = [nodes for nodes in matches if nodes]
+        if scene is None or not matches:
+            return
+        # one selection change, not one per node
+        scene.setSilentSelectionEvents(True)
+        try:
+            scene.grScene.clearSelection()
+            for nodes in matches:
+                for i, node in enumerate(nodes):
+                    node.grNode.setSelected(True)
+                    if i:  # the edges between the nodes of a path
+                        self._edges_in[node].grEdge.setSelected(True)
+        finally:
+            scene.setSilentSelectionEvents(False)
+        scene.getView().centerOn(matches[0][-1].grNode)
+
+    def select_all(self):
+        self._select(self._matches)
+
+    def _on_item_activated(self, item: QListWidgetItem):
+        nodes = self._matches[item.data(Qt.UserRole)]
+        if not nodes:
+            return
+        self._select([nodes])
+        nodes[-1].scene.state_node_clicked.emit(nodes[-1])
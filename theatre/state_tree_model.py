@@ -0,0 +1,214 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Lazy item model over a scenario.State, for the raw state view.
+
+Only the children of expanded items are ever looked at, and long lists and
+mappings are loaded in batches as they are scrolled into view; so displaying a
+state costs the same whatever the size of its databags or stored state.
+"""
+
+import dataclasses
+import json
+import typing
+
+import yaml
+from qtpy.QtCore import QAbstractItemModel, QModelIndex, Qt
+
+from theatre.scenario_json import dump_state
+
+if typing.TYPE_CHECKING:
+    from scenario import State
+
+FETCH_BATCH_SIZE = 256
+"""How many children to load at once."""
+MAX_DISPLAY_LENGTH = 200
+"""Longer values are cut short in the view (but not in its tooltips)."""
+MAX_TOOLTIP_LENGTH = 4000
+MAX_MATCHES = 1000
+"""Searches stop after this many matches."""
+
+ItemPath = typing.Tuple[int, ...]
+"""Row numbers leading from the root to an item."""
+_Entries = typing.List[typing.Tuple[str, typing.Any]]
+
+
+def child_entries(value: typing.Any) -> typing.Optional[_Entries]:
+    """The (key, value) pairs value is made of; None if it's a leaf."""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return [(f.name, getattr(value, f.name)) for f in dataclasses.fields(value)]
+    if isinstance(value, typing.Mapping):
+        return [(str(k), v) for k, v in value.items()]
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [(str(i), v) for i, v in enumerate(value)]
+    return None
+
+
+def _has_children(value: typing.Any) -> bool:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return bool(dataclasses.fields(value))
+    if isinstance(value, (typing.Mapping, list, tuple, set, frozenset)):
+        return len(value) > 0
+    return False
+
+
+def _summary(value: typing.Any) -> str:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return type(value).__name__
+    if isinstance(value, typing.Mapping):
+        return f"{{{len(value)} items}}"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return f"[{len(value)} items]"
+    if isinstance(value, str):
+        return repr(value)
+    return str(value)
+
+
+def _truncated(text: str, length: int) -> str:
+    return text if len(text) <= length else text[: length - 1] + "…"
+
+
+def find(
+    value: typing.Any, text: str, limit: int = MAX_MATCHES
+) -> typing.List[ItemPath]:
+    """Paths to the items whose key or (leaf) value contain text, case-insensitively.
+
+    In the same order as the items appear in the tree.
+    """
+    text = text.lower()
+    matches = []
+    # depth-first, without recursion; children are pushed in reverse to pop in order
+    stack: typing.List[typing.Tuple[ItemPath, str, typing.Any]] = [
+        ((i,), key, child)
+        for i, (key, child) in reversed(list(enumerate(child_entries(value) or ())))
+    ]
+    while stack and len(matches) < limit:
+        path, key, value = stack.pop()
+        entries = child_entries(value)
+        if text in key.lower() or (entries is None and text in str(value).lower()):
+            matches.append(path)
+        if entries:
+            stack.extend(
+                (path + (i,), k, v) for i, (k, v) in reversed(list(enumerate(entries)))
+            )
+    return matches
+
+
+def dump_state_text(state: "State", fmt: typing.Literal["yaml", "json"]) -> str:
+    """Full text dump of state; this can take a while for big states."""
+    data = dump_state(state)
+    if fmt == "json":
+        return json.dumps(data, indent=2)
+    return yaml.safe_dump(data)
+
+
+class _Item:
+    __slots__ = ("key", "value", "parent", "row", "children", "entries")
+
+    def __init__(self, key: str, value, parent: typing.Optional["_Item"], row: int):
+        self.key = key
+        self.value = value
+        self.parent = parent
+        self.row = row
+        self.children: typing.List["_Item"] = []
+        self.entries: typing.Optional[_Entries] = None  # computed on first fetch
+
+
+class StateTreeModel(QAbstractItemModel):
+    """Key, value and type of everything in a State, loaded as the tree is expanded."""
+
+    COLUMNS = ("key", "value", "type")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._root = _Item("", None, None, 0)
+
+    def set_state(self, state: typing.Optional["State"]):
+        self.beginResetModel()
+        self._root = _Item("", state, None, 0)
+        self.endResetModel()
+
+    def _item(self, index: QModelIndex) -> _Item:
+        return index.internalPointer() if index.isValid() else self._root
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()):
+        item = self._item(parent)
+        if not (0 <= row < len(item.children)) or not (0 <= column < len(self.COLUMNS)):
+            return QModelIndex()
+        return self.createIndex(row, column, item.children[row])
+
+    def parent(self, index: QModelIndex = QModelIndex()):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self._root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.column() > 0:
+            return 0
+        return len(self._item(parent).children)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return len(self.COLUMNS)
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        if parent.column() > 0:
+            return False
+        item = self._item(parent)
+        return bool(item.children) or _has_children(item.value)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        if parent.column() > 0:
+            return False
+        item = self._item(parent)
+        if item.entries is None:
+            return _has_children(item.value)
+        return len(item.children) < len(item.entries)
+
+    def fetchMore(self, parent: QModelIndex):
+        item = self._item(parent)
+        if item.entries is None:
+            item.entries = child_entries(item.value) or []
+        start = len(item.children)
+        end = min(start + FETCH_BATCH_SIZE, len(item.entries))
+        if end <= start:
+            return
+        self.beginInsertRows(parent, start, end - 1)
+        item.children.extend(
+            _Item(key, value, item, row)
+            for row, (key, value) in enumerate(item.entries[start:end], start)
+        )
+        self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item: _Item = index.internalPointer()
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return item.key
+            if column == 1:
+                return _truncated(_summary(item.value), MAX_DISPLAY_LENGTH)
+            return type(item.value).__name__
+        if role == Qt.ToolTipRole and column == 1:
+            return _truncated(_summary(item.value), MAX_TOOLTIP_LENGTH)
+        return None
+
+    def headerData(self, section: int, orientation, role: int = Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def index_for_path(self, path: ItemPath) -> QModelIndex:
+        """Load the items leading to path as needed, and return its index."""
+        index = QModelIndex()
+        for row in path:
+            item = self._item(index)
+            while len(item.children) <= row and self.canFetchMore(index):
+                self.fetchMore(index)
+            index = self.index(row, 0, index)
+            if not index.isValid():
+                break
+        return index
@@ -3,14 +3,31 @@
 import json
 import os
 import typing
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
 from nodeeditor.node_scene import InvalidFile
 from nodeeditor.node_scene import Scene as _Scene
 from nodeeditor.node_scene_clipboard import SceneClipboard as _SceneClipboard
-from qtpy.QtCore import QObject, QPoint, Signal
-from qtpy.QtWidgets import QGraphicsItem, QGraphicsProxyWidget
+from qtpy.QtCore import QCoreApplication, QEventLoop, QObject, QPoint, Signal
+from qtpy.QtWidgets import QGraphicsItem, QGraphicsProxyWidget, QGraphicsScene
 
+from theatre import config
 from theatre.logger import logger as theatre_logger
+from theatre.autosave import Autosave, atomic_write
+from theatre.evaluation_timings import EvaluationTimings
+from theatre.metrics import EVALUATION_QUEUE, QUEUE_DEPTH
+from theatre.output_cache import OutputCache
+from theatre.scene_history import SceneHistory
+from theatre.state_index import StateIndex
+from theatre.scene_format import (
+    PackedScene,
+    PackedSceneError,
+    is_packed_scene,
+    pack_scene,
+)
+from theatre.state_patch import decode_state_patches, encode_state_patches
+from theatre.tracing import span
 from theatre.trace_tree_widget.event_edge import EventEdge
 from theatre.trace_tree_widget.state_bases import (
     DeltaLabel,
@@ -18,16 +35,98 @@ from theatre.trace_tree_widget.state_bases import (
     StateGraphicsNode,
 )
 from theatre.trace_tree_widget.state_node import StateContent, StateNode
+from theatre.trace_tree_widget.trace_cache import TraceCache
 
 if typing.TYPE_CHECKING:
     from theatre.charm_repo_tools import CharmRepo
     from theatre.main_window import TheatreMainWindow
+    from theatre.results_store import ResultsStore
 
 logger = theatre_logger.getChild("scene")
 
 SerializedScene = dict  # TODO
 
 
+def validate_scene_data(data: SerializedScene, filename: str = "scene"):
+    """Check that the serialized scene is structurally sound.
+
+    Raises InvalidFile if nodes are missing ids, or edges point to sockets that
+    don't exist.
+    """
+    name = os.path.basename(filename)
+    try:
+        nodes, edges = data["nodes"], data["edges"]
+        node_ids = set()
+        socket_ids = set()
+        for node_data in nodes:
+            node_ids.add(node_data["id"])
+            for socket_data in node_data["inputs"] + node_data["outputs"]:
+                socket_ids.add(socket_data["id"])
+    except (KeyError, TypeError) as e:
+        raise InvalidFile(f"{name} is not a valid scene: missing {e}")
+
+    if len(node_ids) != len(nodes):
+        raise InvalidFile(f"{name} is not a valid scene: duplicate node ids")
+
+    for edge_data in edges:
+        if (
+            edge_data.get("start") not in socket_ids
+            or edge_data.get("end") not in socket_ids
+        ):
+            raise InvalidFile(
+                f"{name} is not a valid scene: edge {edge_data.get('id')} "
+                f"is connected to a socket that doesn't exist"
+            )
+
+
+def read_scene_file(filename: str) -> SerializedScene:
+    """Read, parse and validate a scene file, json or packed.
+
+    For packed scenes, custom states are not decoded: the nodes get a handle to
+    load them lazily. Doesn't touch any Qt object, so it's safe to run off the
+    main thread.
+    """
+    if is_packed_scene(filename):
+        try:
+            data = PackedScene.from_file(filename).skeleton()
+        except PackedSceneError as e:
+            raise InvalidFile(f"{os.path.basename(filename)} is corrupted: {e}")
+    else:
+        with open(filename, "r") as file:
+            raw_data = file.read()
+        try:
+            data = json.loads(raw_data)
+        except json.JSONDecodeError:
+            raise InvalidFile(f"{os.path.basename(filename)} is not a valid JSON file")
+    validate_scene_data(data, filename)
+    return data
+
+
+def write_scene_file(data: SerializedScene, filename: str):
+    """Write a serialized scene to disk, in the format configured by SCENE_FORMAT.
+
+    Thread-safe; the file is replaced atomically.
+    """
+    data = encode_state_patches(data)
+    if config.SCENE_FORMAT == "packed":
+        raw = pack_scene(data)
+    else:
+        raw = json.dumps(data, indent=4).encode("utf-8")
+    atomic_write(filename, raw)
+    logger.info(f"wrote scene to {filename} ({config.SCENE_FORMAT})")
+
+
+def _read_scene_file_in_background(filename: str) -> SerializedScene:
+    """Read the scene file in a worker thread, keeping the event loop alive meanwhile."""
+    app = QCoreApplication.instance()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(read_scene_file, filename)
+        while app and not future.done():
+            wait((future,), timeout=0.05)
+            app.processEvents(QEventLoop.ExcludeUserInputEvents)
+        return future.result()
+
+
 class SceneClipboard(_SceneClipboard):
     def deserializeFromClipboard(self, data: SerializedScene, *args, **kwargs):
         """
@@ -70,27 +169,31 @@ class SceneClipboard(_SceneClipboard):
 
         self.scene.doDeselectItems()
 
-        for node_data in data["nodes"]:
-            new_node = StateNode(self.scene)
-            new_node.deserialize(node_data, hashmap, restore_id=False, *args, **kwargs)
-            created_nodes.append(new_node)
+        # edges are connected one by one: evaluate the new nodes once they all are
+        with self.scene.evaluation_transaction():
+            for node_data in data["nodes"]:
+                new_node = StateNode(self.scene)
+                new_node.deserialize(
+                    node_data, hashmap, restore_id=False, *args, **kwargs
+                )
+                created_nodes.append(new_node)
 
-            # readjust the new nodeeditor's position
+                # readjust the new nodeeditor's position
 
-            # new node's current position
-            posx, posy = new_node.pos.x(), new_node.pos.y()
-            newx, newy = mousex + posx - minx, mousey + posy - miny
+                # new node's current position
+                posx, posy = new_node.pos.x(), new_node.pos.y()
+                newx, newy = mousex + posx - minx, mousey + posy - miny
 
-            new_node.setPos(newx, newy)
+                new_node.setPos(newx, newy)
 
-            new_node.doSelect()
+                new_node.doSelect()
 
-        if "edges" in data:
-            for edge_data in data["edges"]:
-                new_edge = EventEdge(self.scene)
-                new_edge.deserialize(
-                    edge_data, hashmap, restore_id=False, *args, **kwargs
-                )
+            if "edges" in data:
+                for edge_data in data["edges"]:
+                    new_edge = EventEdge(self.scene)
+                    new_edge.deserialize(
+                        edge_data, hashmap, restore_id=False, *args, **kwargs
+                    )
 
         self.scene.setSilentSelectionEvents(False)
 
@@ -110,7 +213,20 @@ class TheatreScene(QObject, _Scene):
         super().__init__()
         # FIXME: Dynamically set by MainWindow
         self._main_window: "TheatreMainWindow" = main_window
+        self._loading = 0
+        self._transactions = 0
+        # nodes whose evaluation is deferred until the outermost transaction is over
+        self._deferred_evaluations: typing.Dict[StateNode, None] = {}
+        self.history = SceneHistory(self)
         self.clipboard = SceneClipboard(self)
+        self.output_cache = OutputCache()
+        self.trace_cache = TraceCache()
+        # evaluated states, for the state query dock
+        self.state_index: StateIndex[StateNode] = StateIndex()
+        # how long nodes took to evaluate, for the heatmap and the slowest nodes dock
+        self.timings: EvaluationTimings[StateNode] = EvaluationTimings()
+        self.autosave = Autosave(self)
+        self.autosave.save_failed.connect(self._on_save_failed)
 
     @property
     def charm_spec(self):
@@ -128,20 +244,174 @@ class TheatreScene(QObject, _Scene):
     def repo(self) -> typing.Optional["CharmRepo"]:
         return self._main_window._repo
 
-    def loadFromFile(self, filename: str):
-        with open(filename, "r") as file:
-            raw_data = file.read()
+    @property
+    def results_store(self) -> typing.Optional["ResultsStore"]:
+        return self._main_window.results_store
+
+    @property
+    def show_heatmap(self) -> bool:
+        """Whether nodes are tinted by how long they took to evaluate."""
+        return self._main_window.show_heatmap
+
+    @property
+    def measure_memory(self) -> bool:
+        """Whether evaluations are run with tracemalloc on."""
+        return self._main_window.measure_memory
+
+    def update_timing(self, node: StateNode, timing):
+        """Record (or with None, forget) how long node took to evaluate."""
+        if self.timings.update(node, timing) and self.show_heatmap:
+            # the slowest or fastest node changed: so did everyone's heat
+            self.grScene.update()
+
+    @property
+    def is_loading(self) -> bool:
+        """Whether the scene is being bulk-(re)built by deserialize."""
+        return self._loading > 0
+
+    @contextmanager
+    def bulk_load(self):
+        """Suspend redraws, signals, history and greedy evaluation.
+
+        Everything is restored (and the scene index rebuilt) once, on exit.
+        Re-entrant: only the outermost context does any work.
+        """
+        self._loading += 1
+        if self._loading > 1:
             try:
-                data = json.loads(raw_data)
-                self.filename = filename
-                self.deserialize(data)
-                self.has_been_modified = False
-            except json.JSONDecodeError:
-                raise InvalidFile(
-                    f"{os.path.basename(filename)} is not a valid JSON file"
-                )
-            except Exception as e:
-                logger.error(e, exc_info=True)
+                yield
+            finally:
+                self._loading -= 1
+            return
+
+        grscene = self.grScene
+        views = [(view, view.updatesEnabled()) for view in grscene.views()]
+        for view, _ in views:
+            view.setUpdatesEnabled(False)
+        # maintaining the BSP index while inserting thousands of items is quadratic-ish;
+        # let Qt rebuild it in one go at the end.
+        index_method = grscene.itemIndexMethod()
+        grscene.setItemIndexMethod(QGraphicsScene.NoIndex)
+        silent_selection = self._silent_selection_events
+        self.setSilentSelectionEvents(True)
+        signals_blocked = self.blockSignals(True)
+        gr_signals_blocked = grscene.blockSignals(True)
+
+        try:
+            yield
+        finally:
+            self._loading -= 1
+            grscene.blockSignals(gr_signals_blocked)
+            self.blockSignals(signals_blocked)
+            self.setSilentSelectionEvents(silent_selection)
+            grscene.setItemIndexMethod(index_method)
+            for view, enabled in views:
+                view.setUpdatesEnabled(enabled)
+                view.viewport().update()
+
+    @property
+    def in_evaluation_transaction(self) -> bool:
+        return self._transactions > 0
+
+    def defer_evaluation(self, node: StateNode):
+        """Evaluate this node when the current evaluation transaction is over."""
+        if node not in self._deferred_evaluations:
+            QUEUE_DEPTH.inc(queue=EVALUATION_QUEUE)
+        self._deferred_evaluations[node] = None
+
+    @contextmanager
+    def evaluation_transaction(self):
+        """Defer the greedy evaluation of nodes whose inputs change in here.
+
+        Nodes and edges created in a transaction may be (re)connected several times
+        before the graph is complete, each time triggering a run of the charm. Instead,
+        all nodes that would have been evaluated are queued, and evaluated once (parents
+        first) when the outermost transaction is over.
+        If the transaction is aborted by an exception, nothing is evaluated.
+
+        Re-entrant: only the outermost transaction evaluates anything.
+        """
+        self._transactions += 1
+        try:
+            yield
+        except BaseException:
+            self._transactions -= 1
+            if not self._transactions:
+                QUEUE_DEPTH.dec(len(self._deferred_evaluations), queue=EVALUATION_QUEUE)
+                self._deferred_evaluations.clear()
+            raise
+
+        self._transactions -= 1
+        if not self._transactions:
+            nodes, self._deferred_evaluations = self._deferred_evaluations, {}
+            # the batch counts the nodes it has yet to evaluate itself
+            QUEUE_DEPTH.dec(len(nodes), queue=EVALUATION_QUEUE)
+            self._evaluate_batch(nodes)
+
+    def _evaluate_batch(self, nodes: typing.Iterable[StateNode]):
+        alive = set(self.nodes)
+
+        depths: typing.Dict[StateNode, int] = {}
+
+        def depth(node: StateNode) -> int:
+            # walk up to the first node of known depth (or the root), then down again
+            # memoizing: a chain of n nodes costs O(n), not O(n²)
+            chain = []
+            current = node
+            while current not in depths:
+                chain.append(current)
+                edge_in = current.edge_in
+                parent = edge_in.start_node if edge_in else None
+                if not isinstance(parent, StateNode):
+                    depths[chain.pop()] = 0
+                    break
+                current = parent
+            for child in reversed(chain):
+                depths[child] = depths[current] + 1
+                current = child
+            return depths[node]
+
+        with span("evaluation batch", "scheduling"):
+            with span("schedule", "scheduling"):
+                queue = sorted((node for node in nodes if node in alive), key=depth)
+            QUEUE_DEPTH.inc(len(queue), queue=EVALUATION_QUEUE)
+            for node in queue:
+                try:
+                    node.eval()
+                except Exception:
+                    logger.error(f"error evaluating {node}", exc_info=True)
+                finally:
+                    QUEUE_DEPTH.dec(queue=EVALUATION_QUEUE)
+
+    def saveToFile(self, filename: str):
+        # encoding and writing happen in the background; see theatre.autosave
+        # the history has most of the scene serialized already
+        self.autosave.save(filename, self.history.snapshot(), write_scene_file)
+        self.has_been_modified = False
+        self.filename = filename
+
+    def _on_save_failed(self, message: str):
+        # saveToFile took the scene for saved before the write was attempted
+        self.has_been_modified = True
+
+    def export_json(self, filename: str):
+        """Save a copy of this scene in the json format, regardless of SCENE_FORMAT."""
+        with open(filename, "w") as file:
+            file.write(json.dumps(self.serialize(), indent=4))
+
+    def loadFromFile(self, filename: str):
+        data = _read_scene_file_in_background(filename)
+        self.filename = filename
+        try:
+            self.deserialize(data)
+            self.has_been_modified = False
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    def removeNode(self, node: StateNode):
+        super().removeNode(node)
+        self.state_index.discard(node)
+        self.update_timing(node, None)
 
     def getEdgeClass(self):
         return EventEdge
@@ -154,68 +424,47 @@ class TheatreScene(QObject, _Scene):
         if restore_id:
             self.id = data["id"]
 
-        # -- deserialize NODES
+        data = decode_state_patches(data)
 
-        # Instead of recreating all the nodes, reuse existing ones...
-        # get list of all current nodes:
-        all_nodes = self.nodes.copy()
+        with self.bulk_load():
+            # -- deserialize NODES
+            # Instead of recreating all the nodes, reuse existing ones...
+            existing_nodes: typing.Dict[int, StateNode] = {
+                node.id: node for node in self.nodes
+            }
 
-        # go through deserialized nodes:
-        for node_data in data["nodes"]:
-            # can we find this node in the scene?
-            found: StateNode | typing.Literal[False] = False
-            for node in all_nodes:
-                if node.id == node_data["id"]:
-                    found = node
-                    break
-
-            if not found:
-                try:
-                    new_node = StateNode(self)
-                    new_node.deserialize(
-                        node_data, hashmap, restore_id, *args, **kwargs
-                    )
-                    new_node.onDeserialized(node_data)
-                except Exception as e:
-                    logger.error(e, exc_info=True)
-            else:
+            for node_data in data["nodes"]:
+                node = existing_nodes.pop(node_data["id"], None)
                 try:
-                    found.deserialize(node_data, hashmap, restore_id, *args, **kwargs)
-                    found.onDeserialized(node_data)
-                    all_nodes.remove(found)
-                    # print("Reused", node_data['title'])
+                    if node is None:
+                        node = StateNode(self)
+                    node.deserialize(node_data, hashmap, restore_id, *args, **kwargs)
+                    node.onDeserialized(node_data)
                 except Exception as e:
                     logger.error(e, exc_info=True)
 
-        while all_nodes != []:
-            node = all_nodes.pop()
-            node.remove()
-
-        # Instead of recreating all the edges, reuse existing ones...
-        # get list of all current edges:
-        all_edges = self.edges.copy()
-
-        # go through deserialized edges:
-        for edge_data in data["edges"]:
-            # can we find this node in the scene?
-            found: EventEdge | typing.Literal[False] = False
-            for edge in all_edges:
-                if edge.id == edge_data["id"]:
-                    found = edge
-                    break
+            # remove nodes which are left in the scene and were NOT in the serialized data
+            for node in existing_nodes.values():
+                node.remove()
 
-            if not found:
-                new_edge = EventEdge(self)
-                new_edge.deserialize(edge_data, hashmap, restore_id, *args, **kwargs)
-            else:
-                found.deserialize(edge_data, hashmap, restore_id, *args, **kwargs)
-                all_edges.remove(found)
-
-        # remove nodes which are left in the scene and were NOT in the serialized data!
-        # that means they were not in the graph before...
-        while all_edges != []:
-            edge = all_edges.pop()
-            edge.remove()
+            # -- deserialize EDGES
+            existing_edges: typing.Dict[int, EventEdge] = {
+                edge.id: edge for edge in self.edges
+            }
+
+            for edge_data in data["edges"]:
+                edge = existing_edges.pop(edge_data["id"], None)
+                if edge is None:
+                    edge = EventEdge(self)
+                edge.deserialize(edge_data, hashmap, restore_id, *args, **kwargs)
+
+            # remove edges which are left in the scene and were NOT in the serialized data
+            for edge in existing_edges.values():
+                edge.remove()
+
+            # now that the topology is known, titles can tell roots from children
+            for node in self.nodes:
+                node._update_title()
 
         return True
 
@@ -1,16 +1,48 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
-import dataclasses
+import re
 import typing
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
 
 import scenario
-import yaml
-from qtpy.QtCore import QItemSelection, Qt, Signal
+from qtpy.QtCore import QItemSelection, Qt, QTimer, Signal
 from qtpy.QtGui import QBrush, QStandardItem, QStandardItemModel
-from qtpy.QtWidgets import QListView, QSplitter, QTabWidget, QTextEdit, QTreeView
-
-from theatre.helpers import get_color, get_icon, toggle_visible
+from qtpy.QtWidgets import (
+    QComboBox,
+    QFileDialog,
+    QHBoxLayout,
+    QHeaderView,
+    QLabel,
+    QLineEdit,
+    QListView,
+    QSplitter,
+    QTableView,
+    QTabWidget,
+    QTextEdit,
+    QToolButton,
+    QTreeView,
+    QVBoxLayout,
+    QWidget,
+)
+
+from theatre.charm_log_model import (
+    LEVELS,
+    CharmLogModel,
+    compile_filter,
+)
+from theatre.helpers import get_color, get_icon, show_error_dialog, toggle_visible
 from theatre.logger import logger
+from theatre.memory_profiling import format_bytes, format_memory, grows_monotonically
+from theatre.state_diff import format_value
+from theatre.state_tree_model import (
+    MAX_MATCHES,
+    ItemPath,
+    StateTreeModel,
+    dump_state_text,
+    find,
+)
 from theatre.trace_tree_widget.state_node import ParentEvaluationFailed, StateNode
 from theatre.trace_tree_widget.structs import StateNodeOutput
 from theatre.trace_tree_widget.delta import DeltaNode
@@ -20,12 +52,13 @@ if typing.TYPE_CHECKING:
 
 _Trace = typing.List[typing.Union[StateNode, DeltaNode]]
 
+FILTER_DELAY_MS = 150
+"""How long to wait for more keystrokes before filtering the logs again."""
+
 
 def get_trace(leaf: StateNode) -> _Trace:
-    trace = [leaf]
-    while leaf := leaf.get_previous():
-        trace.insert(0, leaf)
-    return trace
+    """The trace leading to leaf, root first; cached by the scene."""
+    return leaf.scene.trace_cache.get_trace(leaf)
 
 
 class TraceView(QListView):
@@ -34,8 +67,12 @@ class TraceView(QListView):
 
     def __init__(self, parent) -> None:
         super().__init__(parent)
-        self._trace: _Trace = None
+        self._trace: _Trace = []
+        self._trace_version: typing.Optional[int] = None
         self._state_node: StateNode = None
+        # for each node in the trace, how many rows the model has up to and including it
+        self._row_ends: typing.List[int] = []
+        self._state_items: typing.Dict[StateNode, QStandardItem] = {}
         self.setModel(QStandardItemModel())
         self.setSelectionMode(self.SingleSelection)
 
@@ -44,8 +81,7 @@ class TraceView(QListView):
 
     def display(self, state: StateNode, trace: _Trace):
         self._state_node = state
-        self._trace = trace
-        self._display()
+        self._display(trace)
         self.setCurrentIndex(self.model().index(-1, 0))
 
     def selectionChanged(self, selected: QItemSelection, deselected):
@@ -56,14 +92,21 @@ class TraceView(QListView):
             state = item.data(Qt.ItemDataRole.UserRole + 1)
             self.selection_changed.emit(state)
 
-    def _as_state_item(self, state_node: StateNode) -> QStandardItem:
-        text = f"{state_node.title} ({state_node.description})"
-        item = QStandardItem(state_node.icon, text)
+    def _update_state_item(self, item: QStandardItem, state_node: StateNode):
+        item.setIcon(state_node.icon)
+        item.setText(f"{state_node.title} ({state_node.description})")
         if state_node.isInvalid():
             brush = QBrush(get_color(self._invalid_state_color))
             brush.setStyle(Qt.BrushStyle.SolidPattern)
             item.setBackground(brush)
+        else:
+            item.setBackground(QBrush())
+
+    def _as_state_item(self, state_node: StateNode) -> QStandardItem:
+        item = QStandardItem()
+        self._update_state_item(item, state_node)
         item.setData(state_node)
+        self._state_items[state_node] = item
         return item
 
     def _as_delta_item(self, node: "DeltaNode") -> QStandardItem:
@@ -72,27 +115,68 @@ class TraceView(QListView):
         item.setEnabled(False)
         return item
 
+    def _update_event_item(self, item: QStandardItem, event: "EventEdge"):
+        item.setIcon(event.icon)
+        item.setText(event.event_spec.event.name)
+
     def _as_event_item(self, event: "EventEdge") -> QStandardItem:
-        item = QStandardItem(event.icon, event.event_spec.event.name)
+        item = QStandardItem()
+        self._update_event_item(item, event)
         item.setData(event, Qt.ItemDataRole.UserRole + 1)
         item.setEnabled(False)
         return item
 
-    def _display(self):
-        trace = self._trace
+    def _as_items(self, node, is_root: bool) -> typing.List[QStandardItem]:
+        if isinstance(node, StateNode):
+            if is_root:
+                return [self._as_state_item(node)]
+            return [self._as_event_item(node.edge_in), self._as_state_item(node)]
+        if isinstance(node, DeltaNode):
+            return [self._as_delta_item(node)]
+        logger.error(f"cannot display {node}: unknown type {type(node)}")
+        return []
+
+    def _display(self, trace: _Trace):
+        """Only replace the rows past the part of trace we're already displaying."""
         model = self.model()
-        model.clear()
-        root = trace[0]
-        model.appendRow(self._as_state_item(root))
-
-        for node in trace[1:]:
-            if isinstance(node, StateNode):
-                model.appendRow(self._as_event_item(node.edge_in))
-                model.appendRow(self._as_state_item(node))
-            elif isinstance(node, DeltaNode):
-                model.appendRow(self._as_delta_item(node))
-            else:
-                logger.error(f"cannot display {node}: unknown type {type(node)}")
+        version = trace[0].scene.trace_cache.version if trace else None
+
+        keep = 0
+        if version == self._trace_version:
+            old = self._trace
+            while keep < min(len(old), len(trace)) and old[keep] is trace[keep]:
+                keep += 1
+        else:
+            # the edges (and event items) in between may not be the same anymore
+            self._state_items.clear()
+
+        for node in self._trace[keep:]:
+            self._state_items.pop(node, None)
+        del self._row_ends[keep:]
+        first_row = self._row_ends[-1] if self._row_ends else 0
+        model.removeRows(first_row, model.rowCount() - first_row)
+
+        row = first_row
+        for i in range(keep, len(trace)):
+            for item in self._as_items(trace[i], is_root=i == 0):
+                model.appendRow(item)
+                row += 1
+            self._row_ends.append(row)
+
+        self._trace = list(trace)
+        self._trace_version = version
+
+    def update_node(self, state_node: StateNode):
+        """Refresh the rows of state_node in place, if it's in the displayed trace."""
+        item = self._state_items.get(state_node)
+        if item is None:
+            return
+        self._update_state_item(item, state_node)
+        edge = state_node.edge_in
+        if edge and item.row() > 0:
+            event_item = self.model().item(item.row() - 1)
+            if event_item.data(Qt.ItemDataRole.UserRole + 1) is edge:
+                self._update_event_item(event_item, edge)
 
 
 class StateNodeUnsetError(RuntimeError):
@@ -160,15 +244,148 @@ class ScenarioLogsView(TextView):
         return _format_error_message(out.exception)
 
 
-class CharmLogsView(TextView):
+def _source_name(node: StateNode) -> str:
+    edge = node.edge_in
+    if edge is not None and edge.is_event_spec_set:
+        return edge.event_spec.event.name
+    return node.title
+
+
+class CharmLogsView(QWidget):
+    """The juju-log output of a node, or of the whole trace leading to it.
+
+    Filterable by level and regex; only the rows on screen are ever rendered.
+    """
+
     TOOLTIP = "charm execution juju-log output"
 
-    def generate_contents(self):
-        out = self.node_output
-        juju_log = out.charm_logs
-        if juju_log:
-            return "\n".join(" ".join(line) for line in juju_log)
-        return _format_error_message(out.exception)
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._state_node: StateNode = None
+        # the nodes whose logs are in the model, and where each one's lines end
+        self._sources: typing.List[StateNode] = []
+        self._source_ends: typing.List[int] = []
+
+        self.level_box = level_box = QComboBox(self)
+        level_box.addItems(LEVELS)
+        level_box.setToolTip("Minimum level of the lines to show.")
+        level_box.currentTextChanged.connect(self._update_filter)
+
+        self.filter_bar = filter_bar = QLineEdit(self)
+        filter_bar.setPlaceholderText("filter (regex)")
+        filter_bar.setClearButtonEnabled(True)
+        # refilter once the user is done typing
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(FILTER_DELAY_MS)
+        self._filter_timer.timeout.connect(self._update_filter)
+        filter_bar.textChanged.connect(self._filter_timer.start)
+
+        self.trace_button = trace_button = QToolButton(self)
+        trace_button.setText("whole trace")
+        trace_button.setCheckable(True)
+        trace_button.setToolTip(
+            "Show the logs of all the events in the trace leading to this state."
+        )
+        trace_button.toggled.connect(self.update_contents)
+
+        self.status_label = QLabel(self)
+
+        self.log_model = CharmLogModel(self)
+        # a table of fixed-height rows never needs to lay out all of them, unlike
+        # list and tree views: it scales to any number of lines
+        self.log_view = log_view = QTableView(self)
+        log_view.setModel(self.log_model)
+        log_view.setShowGrid(False)
+        log_view.setWordWrap(False)
+        log_view.setSelectionBehavior(QTableView.SelectRows)
+        log_view.horizontalHeader().hide()
+        log_view.horizontalHeader().setStretchLastSection(True)
+        rows_header = log_view.verticalHeader()
+        rows_header.hide()
+        rows_header.setSectionResizeMode(QHeaderView.Fixed)
+        rows_header.setDefaultSectionSize(log_view.fontMetrics().height() + 4)
+        log_view.setToolTip(self.TOOLTIP)
+
+        top_bar = QHBoxLayout()
+        top_bar.addWidget(level_box)
+        top_bar.addWidget(filter_bar)
+        top_bar.addWidget(trace_button)
+        top_bar.addWidget(self.status_label)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(top_bar)
+        layout.addWidget(log_view)
+
+    def display(self, state_node: StateNode):
+        self._state_node = state_node
+        self.update_contents()
+
+    def _trace_nodes(self) -> typing.List[StateNode]:
+        if not self.trace_button.isChecked():
+            return [self._state_node]
+        return [n for n in get_trace(self._state_node) if isinstance(n, StateNode)]
+
+    def update_contents(self):
+        self._sources = []
+        self._source_ends = []
+        self.log_model.clear()
+        if self._state_node is None:
+            return
+        self._state_node.eval()
+        self.log_model.show_sources = self.trace_button.isChecked()
+        self._append_from(self._trace_nodes())
+
+    def on_node_changed(self, state_node: StateNode):
+        """Replace the logs of state_node, and of whatever comes after it."""
+        try:
+            i = self._sources.index(state_node)
+        except ValueError:
+            return
+        sources = self._sources[i:]
+        del self._sources[i:]
+        del self._source_ends[i:]
+        self.log_model.truncate(self._source_ends[-1] if self._source_ends else 0)
+        self._append_from(sources)
+
+    def _append_from(self, nodes: typing.List[StateNode]):
+        scrollbar = self.log_view.verticalScrollBar()
+        follow = scrollbar.value() == scrollbar.maximum()
+        total = self.log_model.total
+        for node in nodes:
+            output = node.value
+            logs = (output.charm_logs if output else None) or ()
+            self.log_model.append(_source_name(node), logs)
+            total += len(logs)
+            self._sources.append(node)
+            self._source_ends.append(total)
+        if follow:
+            self.log_view.scrollToBottom()
+        self._update_status()
+
+    def _update_filter(self):
+        try:
+            log_filter = compile_filter(
+                self.level_box.currentText(), self.filter_bar.text()
+            )
+        except re.error as e:
+            self.status_label.setText(f"invalid regex: {e}")
+            return
+        self.log_model.set_filter(log_filter)
+        self._update_status()
+
+    def _update_status(self):
+        model = self.log_model
+        if not model.total and self._state_node is not None:
+            output = self._state_node.value
+            exception = output.exception if output else None
+            self.status_label.setText(_format_error_message(exception))
+            return
+        shown = model.rowCount()
+        if shown == model.total:
+            self.status_label.setText(f"{model.total} lines")
+        else:
+            self.status_label.setText(f"{shown} of {model.total} lines")
 
 
 class LogsView(QSplitter):
@@ -190,30 +407,125 @@ class LogsView(QSplitter):
         self.charm_logs_view.update_contents()
         self.scenario_logs_view.update_contents()
 
+    def on_node_changed(self, state_node: StateNode):
+        self.charm_logs_view.on_node_changed(state_node)
+        if self.scenario_logs_view._state_node is state_node:
+            self.scenario_logs_view.update_contents()
+
     def display(self, state_node: StateNode):
         self.charm_logs_view.display(state_node)
         self.scenario_logs_view.display(state_node)
 
 
-class RawStateView(TextView):
-    def generate_contents(self):
-        if not self.node_output.state:
-            raise NoStateError()
-        state_dict = dataclasses.asdict(self.node_output.state)
+class RawStateView(QWidget):
+    """Browse the raw contents of the output state, searchable and exportable."""
+
+    export_done = Signal(str)
+    export_failed = Signal(str)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._state_node: StateNode = None
+        self._matches: typing.List[ItemPath] = []
+        self._match_idx = -1
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        self.search_bar = search_bar = QLineEdit(self)
+        search_bar.setPlaceholderText("search keys and values (enter: next match)")
+        search_bar.setClearButtonEnabled(True)
+        search_bar.returnPressed.connect(self._next_match)
+        search_bar.textChanged.connect(self._reset_search)
+        self.match_label = QLabel(self)
+
+        export_buttons = []
+        for fmt in ("yaml", "json"):
+            button = QToolButton(self)
+            button.setText(fmt)
+            button.setIcon(get_icon("download"))
+            button.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
+            button.setToolTip(f"Export this state as {fmt}.")
+            button.clicked.connect(partial(self.export, fmt))
+            export_buttons.append(button)
+
+        self.tree_view = tree_view = QTreeView(self)
+        self.state_model = StateTreeModel(tree_view)
+        tree_view.setModel(self.state_model)
+        # lets the view skip measuring rows it doesn't show
+        tree_view.setUniformRowHeights(True)
+        tree_view.setAlternatingRowColors(True)
+
+        top_bar = QHBoxLayout()
+        top_bar.addWidget(search_bar)
+        top_bar.addWidget(self.match_label)
+        for button in export_buttons:
+            top_bar.addWidget(button)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(top_bar)
+        layout.addWidget(tree_view)
+
+        self.export_done.connect(lambda f: logger.info(f"exported state to {f}"))
+        self.export_failed.connect(partial(show_error_dialog, self))
+
+    def display(self, state_node: StateNode):
+        self._state_node = state_node
+        self.update_contents()
 
-        # yaml doesn't like paths nor pebble layers
-        for container in state_dict.get("containers", {}):
-            for mount in container.get("mounts", {}).values():
-                mount["src"] = str(mount["src"])
-                mount["location"] = str(mount["location"])
-            container["layers"] = {
-                name: str(value) for name, value in container["layers"].items()
-            }
-            container["service_status"] = {
-                name: str(value) for name, value in container["service_status"].items()
-            }
+    @property
+    def _state(self) -> typing.Optional[scenario.State]:
+        if self._state_node is None:
+            return None
+        return self._state_node.eval().state
 
-        return yaml.safe_dump(state_dict)
+    def update_contents(self):
+        self._reset_search()
+        self.state_model.set_state(self._state)
+        self.tree_view.resizeColumnToContents(0)
+
+    def _reset_search(self):
+        self._matches = []
+        self._match_idx = -1
+        self.match_label.clear()
+
+    def _next_match(self):
+        text = self.search_bar.text()
+        if not text:
+            return
+        if self._match_idx < 0:
+            self._matches = find(self._state, text)
+        if not self._matches:
+            self.match_label.setText("no matches")
+            return
+
+        self._match_idx = (self._match_idx + 1) % len(self._matches)
+        index = self.state_model.index_for_path(self._matches[self._match_idx])
+        self.tree_view.setCurrentIndex(index)
+        self.tree_view.scrollTo(index)
+        more = "+" if len(self._matches) >= MAX_MATCHES else ""
+        self.match_label.setText(f"{self._match_idx + 1}/{len(self._matches)}{more}")
+
+    def export(self, fmt: typing.Literal["yaml", "json"]):
+        """Dump the state to a file; the dumping itself happens in the background."""
+        state = self._state
+        if not state:
+            show_error_dialog(self, "Nothing to export. State evaluation failed.")
+            return
+        fname, _ = QFileDialog.getSaveFileName(
+            self, f"Export state as {fmt}", f"state.{fmt}", f"{fmt} (*.{fmt})"
+        )
+        if not fname:
+            return
+        self._executor.submit(self._export, state, fmt, fname)
+
+    def _export(self, state: scenario.State, fmt: str, filename: str):
+        # worker thread: only talk to the GUI through (queued) signals
+        try:
+            Path(filename).write_text(dump_state_text(state, fmt))
+        except Exception as e:
+            logger.error(f"failed exporting state to {filename}", exc_info=True)
+            self.export_failed.emit(f"could not export state to {filename}: {e}")
+        else:
+            self.export_done.emit(filename)
 
 
 class StateView(QTreeView):
@@ -251,6 +563,178 @@ class StateView(QTreeView):
         model.appendRow(status_item)
 
 
+class FilesystemChangesView(QTreeView):
+    """Files added, removed and modified in the simulated filesystems by an event."""
+
+    _change_icons = {
+        "added": "upload_file",
+        "removed": "delete",
+        "modified": "edit",
+    }
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._state_node: StateNode = None
+        self.setModel(QStandardItemModel())
+        self.setToolTip("Files changed in the simulated filesystems by this event.")
+
+    def display(self, state_node: StateNode):
+        self._state_node = state_node
+        self.update_contents()
+
+    def update_contents(self):
+        state_node: StateNode = self._state_node
+        model: QStandardItemModel = self.model()
+        model.clear()
+        model.setHorizontalHeaderLabels(["path", "change", "size"])
+
+        output = state_node.value
+        if not output or not output.state:
+            model.appendRow(QStandardItem(get_icon("error"), "state evaluation failed"))
+            return
+
+        changes = output.fs_changes
+        if not changes:
+            model.appendRow(QStandardItem("<no filesystem changes>"))
+            return
+
+        manifest = output.fs_manifest
+        for change in ("added", "removed", "modified"):
+            icon = get_icon(self._change_icons[change])
+            for path in getattr(changes, change):
+                entry = manifest.get(path)
+                size = str(entry.size) if entry else ""
+                model.appendRow(
+                    [
+                        QStandardItem(icon, path),
+                        QStandardItem(change),
+                        QStandardItem(size),
+                    ]
+                )
+        self.resizeColumnToContents(0)
+
+
+class StateDiffView(QTreeView):
+    """What changed in the state with the event leading to a node."""
+
+    _change_icons = FilesystemChangesView._change_icons
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._state_node: StateNode = None
+        self.setModel(QStandardItemModel())
+        self.setUniformRowHeights(True)
+        self.setToolTip("Changes to the state made by this event.")
+
+    def display(self, state_node: StateNode):
+        self._state_node = state_node
+        self.update_contents()
+
+    def update_contents(self):
+        state_node: StateNode = self._state_node
+        model: QStandardItemModel = self.model()
+        model.clear()
+        model.setHorizontalHeaderLabels(["path", "change", "before", "after"])
+
+        output = state_node.value
+        if not output or not output.state:
+            model.appendRow(QStandardItem(get_icon("error"), "state evaluation failed"))
+            return
+
+        diff = output.state_diff
+        if diff is None:
+            model.appendRow(QStandardItem("<no previous state to compare with>"))
+            return
+        if not diff:
+            model.appendRow(QStandardItem("<no changes>"))
+            return
+
+        for change in diff.changes:
+            before = "" if change.kind == "added" else format_value(change.old)
+            after = "" if change.kind == "removed" else format_value(change.new)
+            model.appendRow(
+                [
+                    QStandardItem(
+                        get_icon(self._change_icons[change.kind]),
+                        "/".join(change.path),
+                    ),
+                    QStandardItem(change.kind),
+                    QStandardItem(before),
+                    QStandardItem(after),
+                ]
+            )
+        self.resizeColumnToContents(0)
+
+
+class MemoryView(QWidget):
+    """What an evaluation allocated, and how the peak evolves along the trace."""
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._state_node: StateNode = None
+        self.summary = summary = QLabel(self)
+        summary.setWordWrap(True)
+        self.sites = sites = QTreeView(self)
+        sites.setModel(QStandardItemModel())
+        sites.setRootIsDecorated(False)
+        sites.setToolTip(
+            "Where the memory still allocated after the evaluation was allocated."
+        )
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(summary)
+        layout.addWidget(sites)
+
+    def display(self, state_node: StateNode):
+        self._state_node = state_node
+        self.update_contents()
+
+    def update_contents(self):
+        model: QStandardItemModel = self.sites.model()
+        model.clear()
+        model.setHorizontalHeaderLabels(["allocated at", "size", "blocks"])
+
+        output = self._state_node.value
+        memory = output.memory if output else None
+        if memory is None:
+            self.summary.setText(
+                "Memory wasn't measured for this evaluation: "
+                "turn on Window > Measure Memory Use, and reevaluate."
+            )
+            return
+
+        # the peaks along the trace, if they were all measured
+        peaks = []
+        for node in get_trace(self._state_node):
+            if not isinstance(node, StateNode) or not node.can_profile:
+                continue  # deltas, roots and custom states don't run the charm
+            node_output = node.value
+            if not (node_output and node_output.memory):
+                peaks = []
+                break
+            peaks.append(node_output.memory.peak)
+        summary = format_memory(memory)
+        if grows_monotonically(peaks):
+            summary += (
+                f".\nWarning: the peak grows with every event in this trace "
+                f"({' → '.join(map(format_bytes, peaks))})."
+            )
+        self.summary.setText(summary)
+
+        for site in memory.top_sites:
+            label = QStandardItem(site.label)
+            label.setToolTip(f"{site.filename}:{site.line}")
+            model.appendRow(
+                [
+                    label,
+                    QStandardItem(format_bytes(site.size)),
+                    QStandardItem(str(site.count)),
+                ]
+            )
+        self.sites.resizeColumnToContents(0)
+
+
 class NodeView(QTabWidget):
     def __init__(self, parent=None) -> None:
         super().__init__(parent)
@@ -260,9 +744,15 @@ class NodeView(QTabWidget):
         self.state_view = sw = StateView(self)
         self.logs_view = tv = LogsView(self)
         self.raw_state_view = rsv = RawStateView(self)
+        self.fs_changes_view = fsv = FilesystemChangesView(self)
+        self.state_diff_view = sdv = StateDiffView(self)
+        self.memory_view = mv = MemoryView(self)
         self.addTab(sw, "state")
         self.addTab(tv, "logs")
         self.addTab(rsv, "raw")
+        self.addTab(fsv, "filesystem changes")
+        self.addTab(sdv, "diff")
+        self.addTab(mv, "memory")
 
     def is_displayed(self, state_node: StateNode | None):
         return self._displayed is state_node
@@ -270,8 +760,12 @@ class NodeView(QTabWidget):
     def update_contents(self):
         """Update contents of all tabs"""
         self.state_view.update_contents()
-        self.logs_view.update_contents()
+        # only the logs of the displayed node change; keep the rest
+        self.logs_view.on_node_changed(self._displayed)
         self.raw_state_view.update_contents()
+        self.fs_changes_view.update_contents()
+        self.state_diff_view.update_contents()
+        self.memory_view.update_contents()
 
     def display(self, state_node: StateNode):
         if self.is_displayed(state_node):
@@ -283,6 +777,9 @@ class NodeView(QTabWidget):
         self.state_view.display(state_node)
         self.logs_view.display(state_node)
         self.raw_state_view.display(state_node)
+        self.fs_changes_view.display(state_node)
+        self.state_diff_view.display(state_node)
+        self.memory_view.display(state_node)
 
 
 class TraceInspectorWidget(QSplitter):
@@ -310,6 +807,13 @@ class TraceInspectorWidget(QSplitter):
     def _evaluate_all(self, trace: _Trace):
         """Greedily evaluate all nodes in the trace."""
         for node in trace:
+            if (
+                isinstance(node, StateNode)
+                and node.has_value
+                and not (node.isDirty() or node.isInvalid())
+            ):
+                # nothing to do here
+                continue
             if not node.eval():
                 # interrupt when and if a node fails to evaluate
                 break
@@ -322,5 +826,9 @@ class TraceInspectorWidget(QSplitter):
         if self.trace_view.is_displayed(None):
             return self.display(state_node)
 
+        self.trace_view.update_node(state_node)
         if self.node_view.is_displayed(state_node):
             self.node_view.update_contents()
+        else:
+            # it may be in the trace whose logs we're showing
+            self.node_view.logs_view.on_node_changed(state_node)
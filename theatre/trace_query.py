@@ -0,0 +1,379 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Patterns over traces: sequences of events and of conditions on the states in between.
+
+A trace alternates states and events: ``S0 e1 S1 e2 S2 ...``. Patterns are
+regular expressions over it, where:
+    - ``config_changed``, ``*_relation_broken``: an event, by name (globs allowed);
+    - ``!*_relation_joined``: any event but those;
+    - ``.``: any event;
+    - ``[query]``: the current state matches a state query (see theatre.state_index);
+      doesn't consume any event;
+    - ``^`` and ``$``: the start (a root) and the end (a leaf) of the trace;
+    - ``( )``, ``|``, and the quantifiers ``*``, ``+``, ``?``, ``{m,n}`` for grouping,
+      alternatives and repetition; quantifiers go right after ``)`` or ``.``.
+Patterns match anywhere in a trace unless anchored. For example:
+    - ``[status:active] .{1,2} [status:blocked]``: active to blocked within two events;
+    - ``^ (!*_relation_joined)* *_relation_broken``: a relation broken without being
+      joined first.
+
+Patterns are compiled to a nondeterministic automaton, which is run over the
+whole tree in one depth-first pass: a node's automaton state is computed once,
+from its parent's, and shared by all the branches below it.
+"""
+
+import fnmatch
+import re
+import typing
+from dataclasses import dataclass
+
+from theatre.state_index import QueryError, StateIndex, compile_query
+
+_N = typing.TypeVar("_N", bound=typing.Hashable)
+Children = typing.Callable[[_N], typing.Iterable[typing.Tuple[str, _N]]]
+"""For a node, the name of each event leading out of it and the node it leads to."""
+
+MAX_MATCHES = 1000
+
+
+class PatternError(QueryError):
+    """Raised if a trace pattern can't be parsed."""
+
+
+# abstract syntax
+@dataclass(frozen=True)
+class _Event:
+    glob: typing.Optional[str]  # None: any event
+    negated: bool = False
+
+    def matches(self, event: str) -> bool:
+        if self.glob is None:
+            return True
+        return fnmatch.fnmatchcase(event, self.glob) != self.negated
+
+
+@dataclass(frozen=True)
+class _Assert:
+    query: int  # index into TracePattern.state_queries
+
+
+@dataclass(frozen=True)
+class _Anchor:
+    end: bool  # else: start
+
+
+@dataclass(frozen=True)
+class _Seq:
+    items: typing.Tuple
+
+
+@dataclass(frozen=True)
+class _Alt:
+    options: typing.Tuple
+
+
+@dataclass(frozen=True)
+class _Repeat:
+    item: typing.Any
+    min: int
+    max: typing.Optional[int]
+
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+    (?P<state>\[(?:[^\]"']|"[^"]*"|'[^']*')*\])
+    |(?P<quant>\{\d*(?:,\d*)?\})
+    |(?P<punct>[()|^$.])
+    |(?P<event>!?[\w\-*?]+)
+    )""",
+    re.VERBOSE,
+)
+
+
+_QUANTIFIABLE = (("punct", ")"), ("punct", "."))
+
+
+def _tokenize(pattern: str) -> typing.List[typing.Tuple[str, str]]:
+    tokens: typing.List[typing.Tuple[str, str]] = []
+    pos = 0
+    pattern = pattern.strip()
+    while pos < len(pattern):
+        # right after a group or '.', these are quantifiers rather than globs
+        if pattern[pos] in "*+?" and tokens and tokens[-1] in _QUANTIFIABLE:
+            tokens.append(("quant", pattern[pos]))
+            pos += 1
+            continue
+        match = _TOKEN.match(pattern, pos)
+        if not match:
+            raise PatternError(f"unexpected {pattern[pos:]!r}")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, pattern: str):
+        self.tokens = _tokenize(pattern)
+        self.pos = 0
+        self.state_queries: typing.List[str] = []
+
+    def peek(self) -> typing.Optional[typing.Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self):
+        if not self.tokens:
+            raise PatternError("empty pattern")
+        tree = self.alt()
+        if self.peek():
+            raise PatternError(f"unexpected {self.peek()[1]!r}")
+        return tree
+
+    def alt(self):
+        options = [self.seq()]
+        while self.peek() == ("punct", "|"):
+            self.pos += 1
+            options.append(self.seq())
+        return options[0] if len(options) == 1 else _Alt(tuple(options))
+
+    def seq(self):
+        items = []
+        while (token := self.peek()) and token not in (("punct", "|"), ("punct", ")")):
+            items.append(self.item())
+        return _Seq(tuple(items))
+
+    def item(self):
+        kind, text = self.peek()
+        self.pos += 1
+        quantifiable = True
+        if kind == "punct" and text == "(":
+            atom = self.alt()
+            if self.peek() != ("punct", ")"):
+                raise PatternError("missing ')'")
+            self.pos += 1
+        elif kind == "punct" and text == ".":
+            atom = _Event(None)
+        elif kind == "punct" and text in "^$":
+            atom, quantifiable = _Anchor(end=text == "$"), False
+        elif kind == "state":
+            query = text[1:-1]
+            try:
+                compile_query(query)  # fail early on invalid state queries
+            except QueryError as e:
+                raise PatternError(f"in [{query}]: {e}") from e
+            self.state_queries.append(query)
+            atom, quantifiable = _Assert(len(self.state_queries) - 1), False
+        elif kind == "event":
+            negated = text.startswith("!")
+            atom = _Event(text.lstrip("!"), negated)
+        else:
+            raise PatternError(f"unexpected {text!r}")
+
+        while (token := self.peek()) and token[0] == "quant":
+            if not quantifiable:
+                raise PatternError(f"nothing to repeat before {token[1]!r}")
+            self.pos += 1
+            atom = _Repeat(atom, *_bounds(token[1]))
+        return atom
+
+
+def _bounds(quantifier: str) -> typing.Tuple[int, typing.Optional[int]]:
+    if quantifier == "*":
+        return 0, None
+    if quantifier == "+":
+        return 1, None
+    if quantifier == "?":
+        return 0, 1
+    low, _, high = quantifier[1:-1].partition(",")
+    if "," not in quantifier:
+        high = low
+    low_n = int(low) if low else 0
+    high_n = int(high) if high else None
+    if high_n is not None and high_n < low_n:
+        raise PatternError(f"bad repetition {quantifier}")
+    return low_n, high_n
+
+
+# automaton: a list of states; epsilon states point to others by index
+_SPLIT, _EVENT, _ASSERT, _START, _END, _MATCH = range(6)
+
+
+class TracePattern:
+    """A compiled trace pattern."""
+
+    def __init__(self, pattern: str):
+        parser = _Parser(pattern)
+        tree = parser.parse()
+        self.pattern = pattern
+        self.state_queries = parser.state_queries
+        # each state is [kind, arg, out, out2]
+        self._states: typing.List[list] = []
+        start, ends = self._compile(tree)
+        match = self._add(_MATCH)
+        self._patch(ends, match)
+        self._start = start
+
+    def _add(self, kind, arg=None, out=None, out2=None) -> int:
+        self._states.append([kind, arg, out, out2])
+        return len(self._states) - 1
+
+    def _patch(self, ends: typing.List[typing.Tuple[int, int]], target: int):
+        for state, slot in ends:
+            self._states[state][slot] = target
+
+    def _compile(self, tree) -> typing.Tuple[int, typing.List[typing.Tuple[int, int]]]:
+        """Thompson's construction: the start state and the dangling exits of a fragment."""
+        if isinstance(tree, _Event):
+            state = self._add(_EVENT, tree)
+            return state, [(state, 2)]
+        if isinstance(tree, _Assert):
+            state = self._add(_ASSERT, tree.query)
+            return state, [(state, 2)]
+        if isinstance(tree, _Anchor):
+            state = self._add(_END if tree.end else _START)
+            return state, [(state, 2)]
+        if isinstance(tree, _Seq):
+            if not tree.items:
+                state = self._add(_SPLIT)
+                return state, [(state, 2)]
+            start, ends = self._compile(tree.items[0])
+            for item in tree.items[1:]:
+                item_start, item_ends = self._compile(item)
+                self._patch(ends, item_start)
+                ends = item_ends
+            return start, ends
+        if isinstance(tree, _Alt):
+            split = self._add(_SPLIT)
+            ends = []
+            outs = []
+            for option in tree.options:
+                option_start, option_ends = self._compile(option)
+                outs.append(option_start)
+                ends.extend(option_ends)
+            # chain binary splits
+            state = split
+            for option_start in outs[:-1]:
+                self._states[state][2] = option_start
+                nxt = self._add(_SPLIT)
+                self._states[state][3] = nxt
+                state = nxt
+            self._states[state][2] = outs[-1]
+            return split, ends
+        if isinstance(tree, _Repeat):
+            if tree.min == 0 and tree.max is None:  # item*
+                split = self._add(_SPLIT)
+                start, ends = self._compile(tree.item)
+                self._states[split][2] = start
+                self._patch(ends, split)
+                return split, [(split, 3)]
+            if tree.min == 0 and tree.max == 1:  # item?
+                split = self._add(_SPLIT)
+                start, ends = self._compile(tree.item)
+                self._states[split][2] = start
+                return split, ends + [(split, 3)]
+            # item{m,n}: m copies of item, then either item* or n-m times item?
+            items = [tree.item] * tree.min
+            if tree.max is None:
+                items.append(_Repeat(tree.item, 0, None))
+            else:
+                items.extend([_Repeat(tree.item, 0, 1)] * (tree.max - tree.min))
+            return self._compile(_Seq(tuple(items)))
+        raise TypeError(tree)
+
+    def _closure(
+        self,
+        threads: typing.Dict[int, int],
+        node,
+        depth: int,
+        is_leaf: bool,
+        state_sets: typing.Sequence[typing.Set],
+    ) -> typing.Dict[int, int]:
+        """Follow all epsilon transitions; threads map states to the depth they started at."""
+        states = self._states
+        out: typing.Dict[int, int] = {}
+        stack = list(threads.items())
+        while stack:
+            index, start = stack.pop()
+            if index is None:
+                continue
+            if index in out and out[index] <= start:
+                continue
+            out[index] = start
+            kind, arg, nxt, nxt2 = states[index]
+            if kind == _SPLIT:
+                stack.append((nxt, start))
+                stack.append((nxt2, start))
+            elif kind == _ASSERT:
+                if node in state_sets[arg]:
+                    stack.append((nxt, start))
+            elif kind == _START:
+                if depth == 0:
+                    stack.append((nxt, start))
+            elif kind == _END:
+                if is_leaf:
+                    stack.append((nxt, start))
+        return out
+
+    def run(
+        self,
+        roots: typing.Iterable[_N],
+        children: Children,
+        state_sets: typing.Sequence[typing.Set[_N]],
+        limit: int = MAX_MATCHES,
+    ) -> typing.List[typing.List[_N]]:
+        """The matching stretches of trace (as lists of nodes) in the trees under roots.
+
+        state_sets[i] are the nodes whose state matches the i-th state query.
+        For each node where a match ends, only the longest match is returned.
+        """
+        states = self._states
+        matches = []
+        parents: typing.Dict[_N, _N] = {}
+        stack: typing.List[typing.Tuple[_N, typing.Dict[int, int], int]] = [
+            (root, {}, 0) for root in roots
+        ]
+        while stack and len(matches) < limit:
+            node, threads, depth = stack.pop()
+            kids = list(children(node))
+            # a match may start at any node
+            threads = {
+                **threads,
+                self._start: min(threads.get(self._start, depth), depth),
+            }
+            current = self._closure(threads, node, depth, not kids, state_sets)
+
+            starts = [
+                start for index, start in current.items() if states[index][0] == _MATCH
+            ]
+            if starts:
+                path = [node]
+                for _ in range(depth - min(starts)):
+                    path.append(parents[path[-1]])
+                matches.append(path[::-1])
+
+            for event, child in kids:
+                parents[child] = node
+                advanced: typing.Dict[int, int] = {}
+                for index, start in current.items():
+                    kind, test, nxt, _ = states[index]
+                    if kind == _EVENT and test.matches(event):
+                        if nxt not in advanced or start < advanced[nxt]:
+                            advanced[nxt] = start
+                stack.append((child, advanced, depth + 1))
+        return matches
+
+
+def compile_pattern(pattern: str) -> TracePattern:
+    return TracePattern(pattern)
+
+
+def find_traces(
+    pattern: TracePattern,
+    roots: typing.Iterable[_N],
+    children: Children,
+    index: StateIndex,
+    limit: int = MAX_MATCHES,
+) -> typing.List[typing.List[_N]]:
+    """Run pattern over the trees under roots, with state queries answered by index."""
+    state_sets = [index.query(query) for query in pattern.state_queries]
+    return pattern.run(roots, children, state_sets, limit)
@@ -1,7 +1,6 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
 import typing
-from dataclasses import asdict
 
 from nodeeditor.node_edge import EDGE_TYPE_DIRECT
 from nodeeditor.node_edge import Edge as _Edge
@@ -18,7 +17,7 @@ from qtpy.QtGui import QIcon
 from theatre.dialogs.event_dialog import EventSpec
 from theatre.helpers import get_color, get_icon
 from theatre.logger import logger as theatre_logger
-from theatre.scenario_json import parse_event
+from theatre.scenario_json import dump_event, parse_event
 
 if typing.TYPE_CHECKING:
     from nodeeditor.node_socket import Socket
@@ -31,6 +30,9 @@ if typing.TYPE_CHECKING:
 
 logger = theatre_logger.getChild("event_edge")
 
+TOOLTIP_DIFF_LINES = 10
+"""How many state changes to list in the tooltip of an edge."""
+
 
 class GraphicsEdge(QDMGraphicsEdge):
     edge: "EventEdge"
@@ -109,6 +111,15 @@ class EventEdge(_Edge):
         if end_socket:
             end_socket.node.onInputChanged(end_socket)
 
+    def _update_tooltip(self):
+        if not self._event_spec:
+            return
+        tooltip = self._event_spec.event.name
+        value = self.end_socket.node.value if self.end_socket else None
+        if value and value.state_diff is not None:
+            tooltip += "\n" + value.state_diff.describe(limit=TOOLTIP_DIFF_LINES)
+        self.grEdge.setToolTip(tooltip)
+
     def _get_icon(self) -> QIcon:
         if not self._event_spec:
             # edge being dragged
@@ -180,7 +191,7 @@ class EventEdge(_Edge):
     def set_event_spec(self, spec: EventSpec):
         self._event_spec = spec
         self.grEdge.changeColor(self._get_color())
-        self.grEdge.setToolTip(spec.event.name)
+        self._update_tooltip()
         self._update_icon()
         # self.grEdge.set_label(spec.event.name)
 
@@ -194,7 +205,10 @@ class EventEdge(_Edge):
             )
 
         out = super().serialize()
-        out["event_spec"] = asdict(self._event_spec) if self._event_spec else None
+        spec = self._event_spec
+        out["event_spec"] = (
+            {"event": dump_event(spec.event), "env": spec.env} if spec else None
+        )
         return out
 
     def deserialize(
@@ -209,6 +223,8 @@ class EventEdge(_Edge):
             event = parse_event(evt_spec["event"])
             # we can't bind the event now because we can't guarantee the parent is evaluated yet
             self.set_event_spec(EventSpec(event, evt_spec["env"]))
+            # the edge is complete: the end node can (greedily) evaluate it
+            self._notify_end_node()
 
 
 EventEdge.registerEdgeValidator(edge_validator_debug)
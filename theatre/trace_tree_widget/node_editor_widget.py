@@ -18,9 +18,17 @@ from qtpy.QtCore import QMimeData
 from qtpy import QtCore
 from qtpy.QtCore import QDataStream, QEvent, QIODevice, QPoint, Qt, Signal
 from qtpy.QtGui import QDragMoveEvent, QMouseEvent, QWheelEvent
-from qtpy.QtWidgets import QAction, QGraphicsProxyWidget, QMenu, QVBoxLayout
+from qtpy.QtWidgets import (
+    QAction,
+    QGraphicsProxyWidget,
+    QMenu,
+    QMessageBox,
+    QVBoxLayout,
+)
 from scenario import Event, Relation, State
 
+from theatre import config
+from theatre.autosave import has_autosave, recover
 from theatre.dialogs.relation_picker import RelationPickerDialog
 from theatre.dialogs.event_dialog import LIFECYCLE_EVENTS, EventPicker, EventSpec
 from theatre.dialogs.file_backed_edit_dialog import Intent
@@ -50,7 +58,7 @@ from theatre.trace_tree_widget.state_node import (
     add_simulated_fs_from_repo,
     create_new_node,
 )
-from theatre.trace_tree_widget.utils import autolayout
+from theatre.trace_tree_widget.utils import autolayout, autolayout_new_branch
 
 if typing.TYPE_CHECKING:
     from theatre.main_window import TheatreMainWindow
@@ -280,15 +288,47 @@ class NodeEditorWidget(_NodeEditorWidget):
                 logger.error(f"error evaluating {node}", exc_info=True)
 
     def on_history_restored(self):
-        self.eval_outputs()
+        # the history reattached all cached outputs it could: only evaluate the rest
+        for node in self.scene.history.stale_nodes:
+            try:
+                node.eval()
+            except Exception:
+                logger.error(f"error evaluating {node}", exc_info=True)
 
     def fileLoad(self, filename):
         if super().fileLoad(filename):
             # self.eval_outputs()
+            self._maybe_recover_autosave()
             return True
 
         return False
 
+    def _maybe_recover_autosave(self):
+        filename = self.scene.filename
+        if not config.AUTOSAVE or not has_autosave(filename):
+            return
+
+        answer = QMessageBox.question(
+            self,
+            "Recover unsaved changes?",
+            f"{os.path.basename(filename)} has unsaved changes from a previous "
+            f"session that did not end well. Recover them?",
+        )
+        data = None
+        if answer == QMessageBox.Yes:
+            try:
+                data = recover(filename, self.scene.serialize())
+            except Exception as e:
+                logger.error(f"could not recover {filename}", exc_info=True)
+                show_error_dialog(self, f"Could not recover unsaved changes: {e}")
+
+        # either way, start journaling against the file on disk again
+        self.scene.autosave.discard()
+        if data is None:
+            return
+        self.scene.deserialize(data)
+        self.scene.history.storeHistory("Recovered unsaved changes", setModified=True)
+
     def _create_new_state_actions(self):
         self.state_actions = {}
         for state in get_sorted_entries(StateSpec):
@@ -305,6 +345,13 @@ class NodeEditorWidget(_NodeEditorWidget):
         for callback in self._close_event_listeners:
             callback(self, event)
 
+        if event.isAccepted():
+            if self.scene.has_been_modified:
+                # the user chose not to save: nothing to recover next time
+                self.scene.autosave.discard()
+            # wait for any pending save to be written
+            self.scene.autosave.close()
+
     def on_drag_enter(self, event):
         if (
             event.mimeData().hasFormat(STATE_SPEC_MIMETYPE)
@@ -432,6 +479,18 @@ class NodeEditorWidget(_NodeEditorWidget):
             "Deltas",
             lambda: selected.open_edit_deltas_dialog(self),
         )
+        profile_action = context_menu.addAction(
+            get_icon("bolt"),
+            "Profile evaluation",
+            partial(self._on_profile_action, selected, False),
+        )
+        profile_trace_action = context_menu.addAction(
+            get_icon("electric_bolt"),
+            "Profile trace",
+            partial(self._on_profile_action, selected, True),
+        )
+        profile_action.setEnabled(selected.can_profile)
+        profile_trace_action.setEnabled(selected.can_profile)
         branch_submenu = context_menu.addMenu(get_icon("arrow_split"), "Branch")
         branch_actions = []
         subtree: SubtreeSpec
@@ -471,6 +530,16 @@ class NodeEditorWidget(_NodeEditorWidget):
             logger.info(f"chosen action: {action}")
             # other actions should handle themselves
 
+    def _on_profile_action(self, node: StateNode, whole_trace: bool):
+        """Run the charm again under a profiler, and show where the time went."""
+        try:
+            profile = node.profile_trace() if whole_trace else node.profile_evaluation()
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            show_error_dialog(self, f"Could not profile {node}: {e}")
+            return
+        self._main_window.show_profile(profile)
+
     def _on_edge_context_menu(self, event, edge: "EventEdge"):
         context_menu = QMenu(self)
         change_event_action = context_menu.addAction("Change event")
@@ -545,16 +614,17 @@ class NodeEditorWidget(_NodeEditorWidget):
     def _fan_out(self, start: StateNode):
         """Experimental action to branch out in all possible directions from a start."""
 
-        for event in LIFECYCLE_EVENTS:
-            # todo avoid generating inconsistent paths.
-            new_node = self._new_node()
+        with self.scene.evaluation_transaction():
+            for event in LIFECYCLE_EVENTS:
+                # todo avoid generating inconsistent paths.
+                new_node = self._new_node()
 
-            EventEdge(
-                self.scene,
-                start.output_socket,
-                new_node.input_socket,
-                event_spec=EventSpec(Event(event), {}),
-            )
+                EventEdge(
+                    self.scene,
+                    start.output_socket,
+                    new_node.input_socket,
+                    event_spec=EventSpec(Event(event), {}),
+                )
 
         autolayout(start, align="center")
 
@@ -623,30 +693,33 @@ class NodeEditorWidget(_NodeEditorWidget):
     def _paste_subtree(
         self, start: StateNode, data: SerializedScene
     ) -> typing.List[StateNode]:
-        created_nodes = self.scene.clipboard.deserializeFromClipboard(data)
-        roots: typing.List[StateNode] = list(
-            filter(lambda node: node.is_root, created_nodes)
-        )
+        # evaluate the subtree once it's grafted onto start, not while building it
+        with self.scene.evaluation_transaction():
+            created_nodes = self.scene.clipboard.deserializeFromClipboard(data)
+            roots: typing.List[StateNode] = list(
+                filter(lambda node: node.is_root, created_nodes)
+            )
 
-        if len(roots) == 1:
-            root = roots[0]
-        else:
-            raise RuntimeError(f"expected a single root: got {len(roots)}")
+            if len(roots) == 1:
+                root = roots[0]
+            else:
+                raise RuntimeError(f"expected a single root: got {len(roots)}")
 
-        # swap out loaded root for selected node
-        edge = root.edge_out
-        next_node = edge.end_node
+            # swap out loaded root for selected node
+            edge = root.edge_out
+            next_node = edge.end_node
 
-        root.remove()
-        created_nodes.remove(root)
+            root.remove()
+            created_nodes.remove(root)
 
-        EventEdge(
-            edge.scene,
-            start.output_socket,
-            next_node.input_socket,
-            edge.edge_type,
-            event_spec=edge.event_spec,
-        )
+            EventEdge(
+                edge.scene,
+                start.output_socket,
+                next_node.input_socket,
+                edge.edge_type,
+                event_spec=edge.event_spec,
+            )
 
-        autolayout(start)
+        # only lay out the new branch: the rest of the tree stays where it is
+        autolayout_new_branch(start, next_node)
         return created_nodes
@@ -1,17 +1,39 @@
 # Copyright 2022 Canonical Ltd.
 # See LICENSE file for licensing details.
 import contextlib
+import logging
+import threading
+import time
 from typing import Any, Tuple
 
 import scenario
-from scenario import Action, Event, State
+from scenario import Action, Event, State, consistency_checker
 from scenario.state import BindFailedError
 
 from theatre.logger import logger as theatre_logger
-from theatre.trace_tree_widget.structs import StateNodeOutput
+from theatre.tracing import span
+from theatre.trace_tree_widget.structs import EvaluationTiming, StateNodeOutput
 
 logger = theatre_logger.getChild("scenario_interface")
 
+# the timing of the evaluation running on each thread, for the consistency checks
+_current = threading.local()
+_check_consistency = consistency_checker.check_consistency
+
+
+def _timed_check_consistency(*args, **kwargs):
+    mark = time.perf_counter()
+    try:
+        with span("consistency check", "scenario"):
+            return _check_consistency(*args, **kwargs)
+    finally:
+        if (timing := getattr(_current, "timing", None)) is not None:
+            timing.consistency += time.perf_counter() - mark
+
+
+# the runtime looks check_consistency up in its module on every run
+consistency_checker.check_consistency = _timed_check_consistency
+
 
 @contextlib.contextmanager
 def capture_output() -> Tuple[Any, str]:
@@ -36,18 +58,75 @@ def capture_output() -> Tuple[Any, str]:
         yield stdout_buffer
 
 
+@contextlib.contextmanager
+def _root_logger_restored():
+    """Undo what ops does to the root logger when it sets up a charm.
+
+    Each run adds a handler forwarding every log record to the context's juju_log,
+    and sets the level to DEBUG; left there, they pile up run after run.
+    """
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    level = root.level
+    try:
+        yield
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+
+
+@contextlib.contextmanager
+def _consistency_timed_into(timing: EvaluationTiming):
+    """Add the time spent in consistency checks on this thread to timing."""
+    previous = getattr(_current, "timing", None)
+    _current.timing = timing
+    try:
+        yield
+    finally:
+        _current.timing = previous
+
+
 def run_scenario(context: scenario.Context, state: State, event: Event):
-    with capture_output() as stdout:
+    timing = EvaluationTiming()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    # the context records what the charm logs in all runs: only keep this one's
+    context.juju_log = []
+
+    with (
+        span("run scenario", event=event.name),
+        capture_output() as stdout,
+        _root_logger_restored(),
+        _consistency_timed_into(timing),
+    ):
         if event._is_action_event:
             # todo: use the action from the event instead as soon as the event dialog supports attaching them
-            action = Action(event.name[: -len("_action")])
-            action_out = context.run_action(state=state, action=action)
-            state_out = action_out.state
+            manager = context.action_manager(
+                Action(event.name[: -len("_action")]), state
+            )
         else:
-            try:
-                closed_event = event.bind(state)
-            except BindFailedError:
-                logger.error("bind failed: might get an inconsistent scenario error!")
-                closed_event = event
-            state_out = context.run(state=state, event=closed_event)
-    return StateNodeOutput(state_out, context.juju_log, stdout)
+            with span("event.bind", "scenario"):
+                try:
+                    event = event.bind(state)
+                except BindFailedError:
+                    logger.error(
+                        "bind failed: might get an inconsistent scenario error!"
+                    )
+            manager = context.manager(event, state)
+
+        # what Context.run does, but split up so we can tell where the time goes
+        with span("context.run", "scenario"):
+            mark = time.perf_counter()
+            # entering runs scenario's consistency checks and sets the charm up
+            with manager:
+                timing.setup = time.perf_counter() - mark - timing.consistency
+                mark = time.perf_counter()
+                with span("emit", "charm"):
+                    output = manager.run()
+                timing.handler = time.perf_counter() - mark
+
+        state_out = output if isinstance(output, State) else output.state
+
+    timing.wall = time.perf_counter() - wall_start
+    timing.cpu = time.process_time() - cpu_start
+    return StateNodeOutput(state_out, context.juju_log, stdout, timing=timing)
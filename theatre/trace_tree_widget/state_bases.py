@@ -7,7 +7,7 @@ from nodeeditor.node_graphics_socket import QDMGraphicsSocket
 from nodeeditor.node_socket import Socket as _Socket
 from PyQt5.QtWidgets import QWidget
 from qtpy.QtCore import QRectF, Qt
-from qtpy.QtGui import QBrush, QFont, QPainter, QPainterPath
+from qtpy.QtGui import QBrush, QColor, QFont, QPainter, QPainterPath, QPen
 from qtpy.QtWidgets import QGraphicsTextItem
 
 from theatre.helpers import get_color, get_icon
@@ -30,6 +30,19 @@ class StateGraphicsNode(QDMGraphicsNode):
         self.delta_gr_items: typing.List[QGraphicsTextItem] = []
         super().__init__(node, parent)
 
+    @property
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, value):
+        # the title gets set several times while a node is being built or loaded;
+        # relaying out the text item each time is not cheap
+        if getattr(self, "_title", None) == value:
+            return
+        self._title = value
+        self.title_item.setPlainText(value)
+
     def initSizes(self):
         super().initSizes()
         self.width = 160
@@ -54,6 +67,8 @@ class StateGraphicsNode(QDMGraphicsNode):
         self._brush_delta = QBrush(get_color("lavender"))
         self._delta_label_color = get_color("black")
         self._delta_label_font = QFont("Ubuntu", 9)
+        self._color_cold = get_color("pastel green")
+        self._color_hot = get_color("pastel red")
 
     def boundingRect(self) -> QRectF:
         """Defining Qt' bounding rectangle"""
@@ -100,8 +115,46 @@ class StateGraphicsNode(QDMGraphicsNode):
             gritem.setTextWidth(self.width - 2 * self.title_horizontal_padding)
             delta_gr_items.append(gritem)
 
+    def _heat_color(self, heat: float) -> QColor:
+        cold, hot = self._color_cold, self._color_hot
+        return QColor(
+            round(cold.red() + (hot.red() - cold.red()) * heat),
+            round(cold.green() + (hot.green() - cold.green()) * heat),
+            round(cold.blue() + (hot.blue() - cold.blue()) * heat),
+            180,
+        )
+
+    def _paint_heat(self, painter: QPainter):
+        """Tint the title bar and outline by how long the node took to evaluate."""
+        heat = self.node.scene.timings.heat(self.node)
+        if heat is None:
+            return
+        color = self._heat_color(heat)
+        title = QPainterPath()
+        title.addRoundedRect(
+            0,
+            0,
+            self.width,
+            self.title_height,
+            self.edge_roundness,
+            self.edge_roundness,
+        )
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QBrush(color))
+        painter.drawPath(title)
+
+        outline = QPainterPath()
+        outline.addRoundedRect(
+            0, 0, self.width, self.height, self.edge_roundness, self.edge_roundness
+        )
+        painter.setPen(QPen(color, 4))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawPath(outline)
+
     def paint(self, painter: QPainter, QStyleOptionGraphicsItem, widget=None):
         super().paint(painter, QStyleOptionGraphicsItem, widget)
+        if self.node.scene.show_heatmap:
+            self._paint_heat(painter)
 
         if self.node.isInvalid():
             icon = self._icon_invalid
@@ -179,3 +232,11 @@ class GraphicsSocket(QDMGraphicsSocket):
 
 class Socket(_Socket):
     Socket_GR_Class = GraphicsSocket
+
+    def addEdge(self, edge):
+        super().addEdge(edge)
+        self.node.scene.trace_cache.invalidate()
+
+    def removeEdge(self, edge):
+        super().removeEdge(edge)
+        self.node.scene.trace_cache.invalidate()
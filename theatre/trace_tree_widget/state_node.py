@@ -2,9 +2,7 @@
 # See LICENSE file for licensing details.
 import tempfile
 import typing
-from dataclasses import asdict
 from itertools import count
-from shutil import copytree
 
 import scenario
 from nodeeditor.node_content_widget import QDMNodeContentWidget
@@ -20,14 +18,38 @@ from scenario.state import State
 from theatre.dialogs.edit_delta import get_deltas_from_source_code
 from theatre.charm_repo_tools import CharmRepo
 from theatre.dialogs import edit_delta, new_state
+from theatre.evaluation_timings import format_timing
 from theatre.helpers import get_icon
 from theatre.logger import logger as theatre_logger
-from theatre.scenario_json import parse_state
+from theatre.memory_profiling import format_memory, measure_memory
+from theatre.metrics import (
+    EVALUATION_SECONDS,
+    EVALUATIONS_FAILED,
+    EVALUATIONS_STARTED,
+    EVALUATIONS_SUCCEEDED,
+    estimate_size,
+)
+from theatre.output_cache import Fingerprint, fingerprint
+from theatre.profiling import Profile, profile_call
+from theatre.scenario_json import dump_event, dump_state, parse_state
+from theatre.scene_format import LAZY_PAYLOAD_KEY, LazyPayload
+from theatre.state_diff import diff_states
+from theatre.tracing import span, traced
 from theatre.trace_tree_widget.delta import Delta, DeltaNode, DeltaSocket
 from theatre.trace_tree_widget.event_edge import EventEdge
 from theatre.trace_tree_widget.scenario_interface import run_scenario
 from theatre.trace_tree_widget.state_bases import Socket, StateGraphicsNode
 from theatre.trace_tree_widget.structs import StateNodeOutput
+from theatre.vfs import (
+    Manifest,
+    build_manifest,
+    copy_tree,
+    diff_manifests,
+    get_mount_roots,
+    get_vfs_parent_dir,
+    make_vfs_root,
+    remove_vfs_root,
+)
 
 if typing.TYPE_CHECKING:
     from theatre.theatre_scene import TheatreScene
@@ -83,6 +105,13 @@ class StateContent(QDMNodeContentWidget):
         e.accept()
 
 
+def _run_measuring_memory(*args) -> StateNodeOutput:
+    """run_scenario, with tracemalloc on."""
+    output, output_memory = measure_memory(run_scenario, *args)
+    output.memory = output_memory
+    return output
+
+
 class ParentEvaluationFailed(RuntimeError):
     """Raised by StateNode._evaluate if the parent node's evaluation fails."""
 
@@ -125,15 +154,34 @@ class StateNode(Node):
         self.deltas: typing.List[Delta] = []
 
         self._is_custom = False
+        self._value: typing.Optional[StateNodeOutput] = None
+        # estimated size of the value, for the metrics; see value_size
+        self._value_size: typing.Optional[int] = None
+        # custom state from a packed scene file, not decoded yet
+        self._lazy_payload: typing.Optional[LazyPayload] = None
+        # encoded custom state, reused by serialize until the value changes
+        self._custom_state_data: typing.Optional[dict] = None
+        # fingerprint of the inputs our value was computed from; see theatre.output_cache
+        self._value_fingerprint: typing.Optional[Fingerprint] = None
+        # the last profile taken by profile_evaluation; see theatre.profiling
+        self.profile: typing.Optional[Profile] = None
         super().__init__(scene, name, [SocketType.INPUT], [SocketType.OUTPUT])
         self.icon: QIcon = icon or self._get_icon()
-        self.value: typing.Optional[StateNodeOutput] = None
         self.scene = typing.cast("TheatreScene", self.scene)
-        self.root_vfs_tempdir = tempfile.mkdtemp()
+        self._root_vfs_tempdir: typing.Optional[str] = None
 
         self.markDirty()
         self.grNode.title_item.setParent(self.content)
-        self._update_title()
+        if not self.scene.is_loading:
+            # else, deserialize will take care of it
+            self._update_title()
+
+    @property
+    def root_vfs_tempdir(self) -> str:
+        """Directory holding the simulated filesystems of this node; created on first use."""
+        if self._root_vfs_tempdir is None:
+            self._root_vfs_tempdir = make_vfs_root()
+        return self._root_vfs_tempdir
 
     def onMarkedDirty(self):
         self.markChildrenDirty()
@@ -194,17 +242,144 @@ class StateNode(Node):
 
         self.outputs.clear()
         self.outputs.extend(new_outputs)
+        # the nodes hanging off the old deltas aren't reachable the same way anymore
+        self.scene.trace_cache.invalidate()
+
+    @property
+    def value(self) -> typing.Optional[StateNodeOutput]:
+        if self._lazy_payload is not None:
+            self._hydrate()
+        return self._value
+
+    @value.setter
+    def value(self, value: typing.Optional[StateNodeOutput]):
+        self._lazy_payload = None
+        self._custom_state_data = None
+        self._value_fingerprint = None
+        self._value = value
+        self._value_size = None
+        self.scene.state_index.update(self, value)
+        self.scene.update_timing(self, value.timing if value else None)
+
+    @property
+    def value_size(self) -> int:
+        """Rough estimate of the memory our value takes up, in bytes; 0 if not loaded."""
+        if self._value_size is None:
+            self._value_size = estimate_size(self._value) if self._value else 0
+        return self._value_size
+
+    @property
+    def has_value(self) -> bool:
+        """Whether this node has a value, without loading it if it's lazy."""
+        return self._lazy_payload is not None or self._value is not None
+
+    def _drop_input_socket(self):
+        # if this node is being reused (e.g. by a scene reload), the input is gone already
+        if not ALLOW_INPUTS_ON_CUSTOM_NODES and self.inputs:
+            old_socket = self.inputs.pop()
+            self.scene.grScene.removeItem(old_socket.grSocket)
+
+    def _load_custom_state(self, custom_state: dict) -> State:
+        raw_state = parse_state(custom_state)
+        return add_simulated_fs_from_repo(
+            raw_state, self.scene.repo, root_vfs=self.root_vfs_tempdir
+        )
 
     def set_custom_value(self, state: State):
         """Overrides any value with this state and configures this as a custom node."""
         self._is_custom = True
         self.value = StateNodeOutput(state=state)
+        self._record_fs_changes(self.value, None)
+        self._drop_input_socket()
+        self.eval()
+        # whatever was computed from our previous value is outdated
+        self.markDescendantsDirty()
 
-        if not ALLOW_INPUTS_ON_CUSTOM_NODES:
-            old_socket = self.inputs.pop()
-            self.scene.grScene.removeItem(old_socket.grSocket)
+    def set_lazy_custom_value(self, payload: LazyPayload):
+        """Configure this as a custom node whose state will be loaded on first access."""
+        self._is_custom = True
+        self._value = None
+        self._custom_state_data = None
+        self._value_fingerprint = None
+        self._lazy_payload = payload
+        self._value_size = None
+        # not indexed until it's loaded
+        self.scene.state_index.discard(self)
+        self.scene.update_timing(self, None)
+        self._drop_input_socket()
+        self.markInvalid(False)
+        self.markDirty(False)
 
-        self.eval()
+    def _get_custom_state_data(self) -> dict:
+        if self._custom_state_data is None:
+            if self._lazy_payload is not None:
+                # no need to decode the state just to encode it again
+                data = self._lazy_payload.load()["custom-state"]
+            else:
+                data = dump_state(self.value.state)
+            self._custom_state_data = data
+        return self._custom_state_data
+
+    @property
+    def input_fingerprint(self) -> typing.Optional[Fingerprint]:
+        """Fingerprint of whatever our value is computed from.
+
+        None if it can't be determined, e.g. because the parent has no value yet.
+        """
+        if self._is_custom:
+            return fingerprint("custom", self._get_custom_state_data())
+        if self.is_root:
+            return fingerprint("root")
+
+        edge_in = self.edge_in
+        parent = edge_in.start_node
+        parent_fingerprint = getattr(parent, "value_fingerprint", None)
+        if not parent_fingerprint or not edge_in.is_event_spec_set:
+            return None
+        spec = edge_in.event_spec
+        return fingerprint(parent_fingerprint, dump_event(spec.event), spec.env)
+
+    @property
+    def value_fingerprint(self) -> typing.Optional[Fingerprint]:
+        """Fingerprint of the inputs our current value was computed from, if any."""
+        if self._is_custom and self.has_value and not self._value_fingerprint:
+            self._value_fingerprint = self.input_fingerprint
+        if self.isDirty() or self.isInvalid():
+            return None
+        return self._value_fingerprint
+
+    def reattach_cached_output(self) -> bool:
+        """Take our value from the scene's output cache, if our inputs are known there.
+
+        Parents should be reattached (or evaluated) first.
+        """
+        if self._is_custom:
+            # custom values are restored along with the node itself: no need to run anything
+            self.eval()
+            return True
+        input_fingerprint = self.input_fingerprint
+        if not input_fingerprint:
+            return False
+        output = self.scene.output_cache.get(self.id, input_fingerprint)
+        if output is None:
+            return False
+        logger.info(f"reattaching cached output to {self}")
+        self.update_value(output)
+        self._value_fingerprint = input_fingerprint
+        return True
+
+    def _hydrate(self):
+        payload, self._lazy_payload = self._lazy_payload, None
+        logger.info(f"hydrating {self} from {payload}")
+        try:
+            state = self._load_custom_state(payload.load()["custom-state"])
+        except Exception as e:
+            self._set_error_value(e)
+            return
+        self._value = StateNodeOutput(state=state)
+        self._value_size = None
+        self._record_fs_changes(self._value, None)
+        self.scene.state_index.update(self, self._value)
 
     @property
     def description(self) -> str:
@@ -265,7 +440,7 @@ class StateNode(Node):
             qualifiers.append("null")
         if self.is_root:
             qualifiers.append("root")
-        if self.value:
+        if self.has_value:
             qualifiers.append("evaluated")
         else:
             qualifiers.append("no value")
@@ -293,6 +468,7 @@ class StateNode(Node):
 
     def _evaluate(self) -> StateNodeOutput:
         """Compute the state in this node, based on previous node=state and edge=event"""
+        run = _run_measuring_memory if self.scene.measure_memory else run_scenario
         logger.info(f'{"re" if self.value else ""}evaluating {self}')
         self._is_null = False
 
@@ -312,17 +488,110 @@ class StateNode(Node):
         if self.is_root:
             logger.info(f"no edge in: {self} inited as null state (root)")
             self._is_null = True
-            return StateNodeOutput(state_in)
+            output = StateNodeOutput(state_in)
+        else:
+            event_spec = self.edge_in.event_spec
+            logger.info(f"{'re' if self.value else ''}computing state on {self}")
+            event = event_spec.event.name
+            EVALUATIONS_STARTED.inc(event=event)
+            try:
+                output = run(self.scene.context, state_in, event_spec.event)
+            except Exception:
+                EVALUATIONS_FAILED.inc(event=event)
+                raise
+            EVALUATIONS_SUCCEEDED.inc(event=event)
+            if output.timing:
+                EVALUATION_SECONDS.observe(output.timing.wall, event=event)
+            if output.state:
+                # once per evaluation, so browsing the trace doesn't need to diff again
+                with span("diff states", "output"):
+                    output.state_diff = diff_states(state_in, output.state)
+
+        self._record_fs_changes(output, parent_output.fs_manifest)
+        return output
 
-        event_spec = self.edge_in.event_spec
-        logger.info(f"{'re' if self.value else ''}computing state on {self}")
-        return run_scenario(self.scene.context, state_in, event_spec.event)
+    @property
+    def can_profile(self) -> bool:
+        """Whether evaluating this node runs the charm at all."""
+        return not self._is_custom and not self.is_root
+
+    def _run_detached(self, run: typing.Callable) -> typing.Any:
+        """Call run on our input again, leaving this node alone; returns its result.
+
+        The simulated filesystems are copied into a scratch directory, removed
+        afterwards, so the charm can't touch ours. Nor is the run counted as an
+        evaluation in the metrics.
+        """
+        parent_output = self._get_parent_output()
+        scratch = make_vfs_root(prefix="theatre-scratch-")
+        try:
+            state_in = add_simulated_fs_from_repo(
+                parent_output.state,
+                self.scene.repo,
+                situation="default",
+                root_vfs=scratch,
+            )
+            return run(self.scene.context, state_in, self.edge_in.event_spec.event)
+        finally:
+            remove_vfs_root(scratch)
+
+    def profile_evaluation(self, mode: typing.Optional[str] = None) -> Profile:
+        """Run the charm again under a profiler, and keep the profile.
+
+        The output is thrown away: our value (and our children's) stays as it is.
+        """
+        _, profile = self._run_detached(
+            lambda *args: profile_call(run_scenario, *args, mode=mode)
+        )
+        event = self.edge_in.event_spec.event.name
+        profile.name = f"{event} → {self.description or self.title}"
+        if self.scene.measure_memory:
+            # separately: each would skew what the other measures
+            profile.memory = self._run_detached(_run_measuring_memory).memory
+        self.profile = profile
+        return profile
+
+    def profile_trace(self, mode: typing.Optional[str] = None) -> Profile:
+        """Profile all nodes from the root of our trace down to us, and merge them."""
+        trace = []
+        node = self
+        while node.can_profile:
+            trace.append(node)
+            node = node.edge_in.start_node
+        if not trace:
+            raise ValueError(f"nothing to profile on the way to {self}")
+        profiles = [node.profile_evaluation(mode) for node in reversed(trace)]
+        return Profile.merge(
+            profiles,
+            f"trace to {self.description or self.title} ({len(profiles)} evaluations)",
+        )
+
+    @staticmethod
+    @traced("snapshot filesystems", "vfs")
+    def _record_fs_changes(
+        output: StateNodeOutput, parent_manifest: typing.Optional[Manifest]
+    ):
+        """Snapshot the simulated filesystems of this node and diff them with the parent's."""
+        if not output.state:
+            return
+        manifest = build_manifest(
+            get_mount_roots(output.state), previous=parent_manifest
+        )
+        output.fs_manifest = manifest
+        output.fs_changes = diff_manifests(parent_manifest or {}, manifest)
 
     def onInputChanged(self, socket: "Socket"):
         super().onInputChanged(socket)
 
+        if self.scene.is_loading:
+            # the scene is being bulk-loaded: the edges will be set up by the loader
+            return
+
         if GREEDY_NODE_EVALUATION:
-            self.eval()
+            if self.scene.in_evaluation_transaction:
+                self.scene.defer_evaluation(self)
+            else:
+                self.eval()
 
         edge_in = self.edge_in
         if edge_in:
@@ -378,6 +647,7 @@ class StateNode(Node):
 
         self.load_deltas(output.source, deltas=output.deltas)
 
+    @traced("update node", "ui")
     def update_value(self, new_value: StateNodeOutput) -> StateNodeOutput:
         # todo: also update library, name and icon
         self.markInvalid(False)
@@ -386,7 +656,12 @@ class StateNode(Node):
         self.value = new_value
 
         # todo find better tooltip
-        self.grNode.setToolTip(self.get_title())
+        tooltip = self.get_title()
+        if new_value.timing:
+            tooltip += "\n" + format_timing(new_value.timing)
+        if new_value.memory:
+            tooltip += "\nmemory: " + format_memory(new_value.memory)
+        self.grNode.setToolTip(tooltip)
 
         # notify listeners of potential value change
         self.scene.state_node_changed.emit(self)
@@ -415,7 +690,9 @@ class StateNode(Node):
         self._update_title()
         self.grNode.update()
         if self.input_socket and self.input_socket.edges:
-            self.input_socket.edges[0]._update_icon()
+            edge = self.input_socket.edges[0]
+            edge._update_icon()
+            edge._update_tooltip()
 
     def eval(self) -> StateNodeOutput:
         if self._is_custom:
@@ -428,10 +705,57 @@ class StateNode(Node):
             logger.info(f"Returning cached value for {self}.")
             return self.value
 
-        try:
-            return self.update_value(self._evaluate())
-        except Exception as e:
-            return self._set_error_value(e)
+        with span("evaluate", node=self.id):
+            try:
+                output = self._restore_output()
+                restored = output is not None
+                if not restored:
+                    output = self._evaluate()
+            except Exception as e:
+                output = self._set_error_value(e)
+                if not isinstance(e, ParentEvaluationFailed):
+                    # the charm itself failed: worth keeping the traceback around
+                    self._record_output(self.input_fingerprint, output)
+                return output
+
+            # the parent is evaluated by now, so its fingerprint is up to date
+            input_fingerprint = self.input_fingerprint
+            self.update_value(output)
+            if input_fingerprint:
+                self._value_fingerprint = input_fingerprint
+                self.scene.output_cache.put(self.id, input_fingerprint, output)
+                if not restored:
+                    self._record_output(input_fingerprint, output)
+            return output
+
+    @traced("restore output", "cache")
+    def _restore_output(self) -> typing.Optional[StateNodeOutput]:
+        """Our output as recorded by an earlier evaluation, if the results store has it."""
+        store = self.scene.results_store
+        if store is None or self.is_root:
+            return None
+        # the parent must be evaluated for our fingerprint to be known
+        parent_output = self._get_parent_output()
+        input_fingerprint = self.input_fingerprint
+        if not input_fingerprint:
+            return None
+        output = store.get(self.scene.id, self.id, input_fingerprint)
+        if output is None:
+            return None
+        logger.info(f"restoring the recorded output of {self}")
+        output.state_diff = diff_states(parent_output.state, output.state)
+        self._record_fs_changes(output, parent_output.fs_manifest)
+        return output
+
+    def _record_output(
+        self, input_fingerprint: typing.Optional[Fingerprint], output: StateNodeOutput
+    ):
+        store = self.scene.results_store
+        if store is None or self.is_root or not input_fingerprint:
+            return
+        edge_in = self.edge_in
+        event = edge_in.event_spec.event.name if edge_in.is_event_spec_set else None
+        store.put(self.scene.id, self.id, input_fingerprint, event, output)
 
     def getChildrenNodes(self) -> typing.List["StateNode"]:
         """
@@ -461,7 +785,7 @@ class StateNode(Node):
         res["name"] = self.title
         res["value"] = self.content.edit.text()
         if self._is_custom:
-            res["custom-state"] = asdict(self.value.state)
+            res["custom-state"] = self._get_custom_state_data()
         res["deltas_source"] = self._deltas_source
         return res
 
@@ -476,12 +800,13 @@ class StateNode(Node):
             value = data["value"]
             self.content.edit.setText(value)
             if custom_state := data.get("custom-state"):
-                raw_state = parse_state(custom_state)
-                state_with_fs = add_simulated_fs_from_repo(
-                    raw_state, self.scene.repo, root_vfs=self.root_vfs_tempdir
-                )
-                self.set_custom_value(state_with_fs)
+                self.set_custom_value(self._load_custom_state(custom_state))
+            elif lazy_payload := data.get(LAZY_PAYLOAD_KEY):
+                self.set_lazy_custom_value(lazy_payload)
 
+            if not self.scene.is_loading:
+                # else, the scene will once all edges are in place
+                self._update_title()
             return True & res
         except Exception as e:
             dumpException(e)
@@ -497,6 +822,7 @@ class StateNode(Node):
         return outs[0] if outs else None
 
 
+@traced("copy filesystems", "vfs")
 def add_simulated_fs_from_repo(
     state_in_ori: State, repo: "CharmRepo", situation: str = "default", root_vfs=None
 ) -> State:
@@ -520,13 +846,14 @@ def add_simulated_fs_from_repo(
         new_mounts = {}
         for name, mount in container.mounts.items():
             new_src = tempfile.mkdtemp(
-                prefix=f"{container.name}-{name}-mount", dir=root_vfs
+                prefix=f"{container.name}-{name}-mount",
+                dir=root_vfs or get_vfs_parent_dir(),
             )
 
             # copy previous fs state into new mount location.
             # charm exec may mutate it!
             # FIXME: mount is a dict in some circumstances?!
-            copytree(mount.src, new_src, dirs_exist_ok=True)
+            copy_tree(mount.src, new_src)
 
             new_mount = mount.replace(src=new_src)
             new_mounts[name] = new_mount
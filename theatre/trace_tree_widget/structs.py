@@ -7,6 +7,29 @@ from dataclasses import dataclass
 import scenario
 from scenario.state import JujuLogLine
 
+from theatre.memory_profiling import MemoryUsage
+from theatre.state_diff import StateDiff
+from theatre.vfs import Manifest, ManifestDiff
+
+
+@dataclass
+class EvaluationTiming:
+    """Where the time of an evaluation went, in seconds."""
+
+    wall: float = 0.0
+    cpu: float = 0.0
+    # scenario's checks that the state, event and charm make sense together
+    consistency: float = 0.0
+    # setting up the simulated model and constructing the charm
+    setup: float = 0.0
+    # the event handlers, and committing the framework
+    handler: float = 0.0
+
+    @property
+    def other(self) -> float:
+        """Time not accounted for by the phases, e.g. binding the event."""
+        return max(self.wall - self.consistency - self.setup - self.handler, 0.0)
+
 
 @dataclass
 class StateNodeOutput:
@@ -14,6 +37,16 @@ class StateNodeOutput:
     charm_logs: typing.Optional[typing.List[JujuLogLine]] = None
     scenario_logs: typing.Optional[str] = None
     exception: typing.Optional[Exception] = None
+    # snapshot of the simulated filesystems after evaluation
+    fs_manifest: typing.Optional[Manifest] = None
+    # what the event changed in the simulated filesystems
+    fs_changes: typing.Optional[ManifestDiff] = None
+    # what the event changed in the state
+    state_diff: typing.Optional[StateDiff] = None
+    # how long the evaluation took; None if it wasn't run in this session
+    timing: typing.Optional[EvaluationTiming] = None
+    # what the evaluation allocated, if memory was being measured
+    memory: typing.Optional[MemoryUsage] = None
 
     @property
     def traceback(self) -> typing.Optional[inspect.Traceback]:
@@ -0,0 +1,145 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Tidy tree layout, after Buchheim, Jünger and Leipert's linear-time take on Walker's algorithm.
+
+Siblings are kept in order, at least `distance` apart from each other, and so
+are the subtrees they root; parents are centered over their children.
+
+Only the 'breadth' coordinate is computed here (the vertical one, in theatre's
+left-to-right trees); the other one is simply proportional to the depth.
+Runs in O(n) and without recursion, so that deep traces don't hit the
+recursion limit.
+"""
+
+import typing
+
+Children = typing.Sequence[typing.Sequence[int]]
+"""children[i] are the indices of the children of node i, in order."""
+
+
+def tidy_layout(
+    children: Children, root: int = 0, distance: float = 1.0
+) -> typing.Dict[int, float]:
+    """Compute the breadth coordinate of each node in the tree rooted at root.
+
+    The root ends up at 0. Nodes not reachable from root are left out.
+    """
+    n = len(children)
+    parent = [-1] * n
+    number = [0] * n  # index among siblings
+    for v, kids in enumerate(children):
+        for i, w in enumerate(kids):
+            parent[w] = v
+            number[w] = i
+
+    prelim = [0.0] * n
+    mod = [0.0] * n
+    shift = [0.0] * n
+    change = [0.0] * n
+    thread = [-1] * n
+    ancestor = list(range(n))
+
+    def left_sibling(v: int) -> int:
+        if v == root or number[v] == 0:
+            # root may well have siblings, outside of the tree we're laying out
+            return -1
+        return children[parent[v]][number[v] - 1]
+
+    def next_left(v: int) -> int:
+        kids = children[v]
+        return kids[0] if kids else thread[v]
+
+    def next_right(v: int) -> int:
+        kids = children[v]
+        return kids[-1] if kids else thread[v]
+
+    def move_subtree(wl: int, wr: int, amount: float):
+        subtrees = number[wr] - number[wl]
+        change[wr] -= amount / subtrees
+        shift[wr] += amount
+        change[wl] += amount / subtrees
+        prelim[wr] += amount
+        mod[wr] += amount
+
+    def apportion(v: int, default_ancestor: int) -> int:
+        w = left_sibling(v)
+        if w < 0:
+            return default_ancestor
+        # inner/outer, right/left contours
+        vir = vor = v
+        vil = w
+        vol = children[parent[v]][0]
+        sir, sor, sil, sol = mod[vir], mod[vor], mod[vil], mod[vol]
+        while next_right(vil) >= 0 and next_left(vir) >= 0:
+            vil, vir = next_right(vil), next_left(vir)
+            vol, vor = next_left(vol), next_right(vor)
+            ancestor[vor] = v
+            gap = (prelim[vil] + sil) - (prelim[vir] + sir) + distance
+            if gap > 0:
+                a = ancestor[vil]
+                if parent[a] != parent[v]:
+                    a = default_ancestor
+                move_subtree(a, v, gap)
+                sir += gap
+                sor += gap
+            sil += mod[vil]
+            sir += mod[vir]
+            sol += mod[vol]
+            sor += mod[vor]
+        if next_right(vil) >= 0 and next_right(vor) < 0:
+            thread[vor] = next_right(vil)
+            mod[vor] += sil - sor
+        if next_left(vir) >= 0 and next_left(vol) < 0:
+            thread[vol] = next_left(vir)
+            mod[vol] += sir - sol
+            default_ancestor = v
+        return default_ancestor
+
+    def execute_shifts(v: int):
+        total_shift = total_change = 0.0
+        for w in reversed(children[v]):
+            prelim[w] += total_shift
+            mod[w] += total_shift
+            total_change += change[w]
+            total_shift += shift[w] + total_change
+
+    def finish(v: int):
+        """The tail of the first walk on v, once all its children are done."""
+        kids = children[v]
+        w = left_sibling(v)
+        if not kids:
+            prelim[v] = prelim[w] + distance if w >= 0 else 0.0
+            return
+        execute_shifts(v)
+        midpoint = (prelim[kids[0]] + prelim[kids[-1]]) / 2
+        if w >= 0:
+            prelim[v] = prelim[w] + distance
+            mod[v] = prelim[v] - midpoint
+        else:
+            prelim[v] = midpoint
+
+    # first walk: post-order, apportioning each child right after its subtree is done
+    default_ancestors = {root: children[root][0] if children[root] else root}
+    stack = [(root, 0)]
+    while stack:
+        v, i = stack[-1]
+        kids = children[v]
+        if i > 0:
+            default_ancestors[v] = apportion(kids[i - 1], default_ancestors[v])
+        if i < len(kids):
+            stack[-1] = (v, i + 1)
+            w = kids[i]
+            default_ancestors[w] = children[w][0] if children[w] else w
+            stack.append((w, 0))
+        else:
+            stack.pop()
+            finish(v)
+
+    # second walk: pre-order, summing up the modifiers
+    out = {}
+    walk = [(root, -prelim[root])]
+    while walk:
+        v, m = walk.pop()
+        out[v] = prelim[v] + m
+        walk.extend((w, m + mod[v]) for w in children[v])
+    return out
@@ -0,0 +1,61 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Cache of the traces leading to each node of a scene.
+
+A trace is stored as a linked list from its leaf up to its root, so sibling
+nodes share the (cached) trace of their parent instead of each having a copy.
+Any change to how the nodes are connected empties the cache.
+"""
+
+import typing
+
+if typing.TYPE_CHECKING:
+    from theatre.trace_tree_widget.delta import DeltaNode
+    from theatre.trace_tree_widget.state_node import StateNode
+
+    TraceNode = typing.Union[StateNode, DeltaNode]
+
+
+class _Link(typing.NamedTuple):
+    node: "TraceNode"
+    previous: typing.Optional["_Link"]
+    length: int
+
+
+class TraceCache:
+    """Traces (root first, leaf last) by leaf node."""
+
+    def __init__(self):
+        self._links: typing.Dict["TraceNode", _Link] = {}
+        self.version = 0
+        """Incremented each time the cache is invalidated."""
+
+    def __len__(self):
+        return len(self._links)
+
+    def invalidate(self):
+        """The graph structure changed: forget all traces."""
+        self._links.clear()
+        self.version += 1
+
+    def _get_link(self, leaf: "TraceNode") -> _Link:
+        links = self._links
+        # walk up to the closest ancestor whose trace we know already
+        missing = []
+        node = leaf
+        while node is not None and node not in links:
+            missing.append(node)
+            node = node.get_previous()
+
+        link = links.get(node) if node is not None else None
+        for node in reversed(missing):
+            link = links[node] = _Link(node, link, link.length + 1 if link else 1)
+        return link
+
+    def get_trace(self, leaf: "TraceNode") -> typing.List["TraceNode"]:
+        link = self._get_link(leaf)
+        trace = [None] * link.length
+        for i in range(link.length - 1, -1, -1):
+            trace[i] = link.node
+            link = link.previous
+        return trace
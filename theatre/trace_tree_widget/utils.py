@@ -2,27 +2,103 @@
 # See LICENSE file for licensing details.
 import typing
 
+from theatre.trace_tree_widget.tidy_tree import tidy_layout
+
 if typing.TYPE_CHECKING:
     from theatre.trace_tree_widget.state_node import StateNode
 
+HSPACING = 1.5
+"""Horizontal distance between a node and its children, in node widths."""
+VSPACING = 1.5
+"""Vertical distance between siblings (and cousins), in node heights."""
+
+
+def _collect_subtree(
+    node: "StateNode",
+) -> typing.Tuple[typing.List["StateNode"], typing.List[typing.List[int]]]:
+    """The nodes in the subtree rooted at node (breadth-first), and their children indices."""
+    nodes = [node]
+    index = {node: 0}
+    children: typing.List[typing.List[int]] = []
+    # breadth-first, without recursion
+    for current in nodes:
+        kids = []
+        for child in current.getChildrenNodes():
+            if child in index:  # don't loop forever on a broken graph
+                continue
+            index[child] = len(nodes)
+            kids.append(len(nodes))
+            nodes.append(child)
+        children.append(kids)
+    return nodes, children
+
+
+def _apply_positions(
+    nodes: typing.Sequence["StateNode"], positions: typing.Sequence[typing.Tuple]
+):
+    """Move all nodes at once, then update each of their edges once."""
+    scene = nodes[0].scene
+    edges = {}
+    with scene.bulk_load():
+        for node, (x, y) in zip(nodes, positions):
+            node.setPos(x, y)
+            for socket in node.inputs + node.outputs:
+                for edge in socket.edges:
+                    edges[edge] = None
+        for edge in edges:
+            edge.updatePositions()
+
 
 def autolayout(
     node: "StateNode", align: typing.Literal["top", "bottom", "center"] = "top"
 ):
+    """Lay out the subtree rooted at node as a tidy tree; node itself doesn't move.
+
+    Align decides where node's children go: starting level with it and growing
+    downwards (top), centered on it, or growing upwards (bottom).
+    """
+    nodes, children = _collect_subtree(node)
+    gr_node = node.grNode
+    hspacing = gr_node.width * HSPACING
+    vspacing = gr_node.height * VSPACING
+    breadth = tidy_layout(children, 0, vspacing)
+
+    kids = children[0]
+    offset = 0.0
+    if kids and align == "top":
+        offset = -breadth[kids[0]]
+    elif kids and align == "bottom":
+        offset = -breadth[kids[-1]]
+
+    depth = [0] * len(nodes)
+    for i, kids in enumerate(children):
+        for k in kids:
+            depth[k] = depth[i] + 1
+
     pos = node.pos
-    children: typing.Iterable["StateNode"] = node.getOutputs()
-    xpos = pos.x() + node.grNode.width * 1.5
-    ypos = pos.y()
-    vspacing = node.grNode.height * 1.5
-
-    if align == "top":
-        baseline = ypos
-    elif align == "center":
-        baseline = ypos - vspacing * len(children) / 2
-    else:
-        baseline = ypos - vspacing * len(children)
-
-    for i, child in enumerate(children):
-        child.setPos(xpos, baseline + vspacing * i)
-        child.updateConnectedEdges()
-        autolayout(child)
+    x0, y0 = pos.x(), pos.y()
+    positions = [(x0, y0)] + [
+        (x0 + depth[i] * hspacing, y0 + breadth[i] + offset)
+        for i in range(1, len(nodes))
+    ]
+    _apply_positions(nodes, positions)
+
+
+def autolayout_new_branch(parent: "StateNode", branch: "StateNode"):
+    """Lay out a branch just attached to parent, below parent's other branches.
+
+    Nothing but the new branch moves.
+    """
+    gr_node = parent.grNode
+    bottom = parent.pos.y() - gr_node.height * VSPACING
+    nodes, _ = _collect_subtree(parent)
+    branch_nodes = set(_collect_subtree(branch)[0])
+    for other in nodes[1:]:
+        if other not in branch_nodes:
+            bottom = max(bottom, other.pos.y())
+
+    branch.setPos(
+        parent.pos.x() + gr_node.width * HSPACING,
+        bottom + gr_node.height * VSPACING,
+    )
+    autolayout(branch)
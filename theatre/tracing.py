@@ -0,0 +1,172 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""A timeline of where evaluations spend their time, for Perfetto.
+
+While recording (see config.TRACE_EVALUATIONS, or Window > Record Evaluation
+Timeline), the evaluation pipeline records spans: scheduling a batch, copying
+the simulated filesystems, binding the event, running the charm, diffing its
+output, updating the node. Unlike the per-node timings, the timeline shows what
+happens between evaluations, too.
+
+When not recording, span() returns a shared do-nothing context manager: the
+cost is that of the call.
+
+Timelines are exported as Chrome Trace Event JSON: open them in
+https://ui.perfetto.dev (or chrome://tracing). Each thread gets a track of its
+own.
+"""
+
+import json
+import os
+import threading
+import time
+import typing
+from collections import deque
+from functools import wraps
+
+from theatre import config
+
+MAX_EVENTS = 1_000_000
+"""How many spans to keep; the oldest ones are dropped first."""
+
+_F = typing.TypeVar("_F", bound=typing.Callable)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_category", "_args", "_start")
+
+    def __init__(self, tracer: "Tracer", name: str, category: str, args: dict):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self._args["error"] = exc_type.__name__
+        self._tracer._record(
+            self._name,
+            self._category,
+            self._start,
+            time.perf_counter_ns(),
+            self._args,
+        )
+        return False
+
+
+class Tracer:
+    """Records spans of time, per thread."""
+
+    def __init__(self, enabled: bool = False, max_events: int = MAX_EVENTS):
+        self.enabled = enabled
+        # (name, category, start ns, end ns, thread id, args)
+        self._events: typing.Deque[tuple] = deque(maxlen=max_events)
+        self._threads: typing.Dict[int, str] = {}
+        self._origin = time.perf_counter_ns()
+
+    def __len__(self):
+        return len(self._events)
+
+    def start(self):
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def clear(self):
+        self._events.clear()
+        self._threads.clear()
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name: str, category: str = "evaluation", **args):
+        """Context manager recording the time spent in it, if recording."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def traced(self, name: str, category: str = "evaluation") -> typing.Callable:
+        """Decorator recording a span around each call of the function."""
+
+        def decorator(function: _F) -> _F:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, name, category, {}):
+                    return function(*args, **kwargs)
+
+            return typing.cast(_F, wrapper)
+
+        return decorator
+
+    def _record(self, name: str, category: str, start: int, end: int, args: dict):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._threads:
+            self._threads[tid] = thread.name
+        # deque.append is atomic: no lock needed for worker threads
+        self._events.append((name, category, start, end, tid, args))
+
+    def to_chrome_trace(self) -> dict:
+        """The spans recorded so far, in Chrome's Trace Event Format."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": 0,
+                "args": {"name": "theatre"},
+            }
+        ]
+        main_thread = threading.main_thread().ident
+        for tid, thread_name in list(self._threads.items()):
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": "GUI" if tid == main_thread else thread_name},
+                }
+            )
+        for name, category, start, end, tid, args in list(self._events):
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self._origin) / 1000,
+                "dur": (end - start) / 1000,
+                "pid": pid,
+                "tid": tid,
+            }
+            if args:
+                event["args"] = args
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+
+
+tracer = Tracer(enabled=config.TRACE_EVALUATIONS)
+"""The tracer the evaluation pipeline records into."""
+
+span = tracer.span
+traced = tracer.traced
@@ -0,0 +1,236 @@
+# Copyright 2022 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Storage backends for the simulated container filesystems of state nodes."""
+
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from theatre import config
+from theatre.logger import logger as theatre_logger
+from theatre.metrics import REGISTRY, VFS_COPIED_BYTES, VFS_DISK_BYTES
+
+if typing.TYPE_CHECKING:
+    from scenario import State
+
+logger = theatre_logger.getChild("vfs")
+
+DISK = "disk"
+MEMORY = "memory"
+SHM_ROOT = Path("/dev/shm")
+HASH_CHUNK_SIZE = 2**16
+
+_memory_root: typing.Optional[Path] = None
+# the vfs roots made by this process and not removed yet, to tell how much space
+# they take up
+_roots: typing.Set[str] = set()
+
+
+class VFSBackendUnavailable(RuntimeError):
+    """Raised if the requested vfs backend can't be used on this system."""
+
+
+def memory_backend_available() -> bool:
+    """Whether this system has a writable tmpfs we can keep node filesystems in."""
+    return SHM_ROOT.is_dir() and os.access(SHM_ROOT, os.W_OK)
+
+
+def _cleanup_memory_root():
+    if _memory_root and _memory_root.exists():
+        logger.info(f"cleaning up in-memory vfs root {_memory_root}")
+        shutil.rmtree(_memory_root, ignore_errors=True)
+        _roots.difference_update(
+            root for root in list(_roots) if Path(root).parent == _memory_root
+        )
+
+
+def _get_memory_root() -> Path:
+    """The tmpfs directory owned by this process; created on first use.
+
+    Unlike disk-backed temporary dirs, whatever is in there eats RAM, so we clean
+    it up when theatre exits.
+    """
+    global _memory_root
+    if _memory_root is None:
+        if not memory_backend_available():
+            raise VFSBackendUnavailable(f"{SHM_ROOT} is not available")
+        _memory_root = SHM_ROOT / f"theatre-{os.getpid()}"
+        _memory_root.mkdir(exist_ok=True)
+        atexit.register(_cleanup_memory_root)
+    return _memory_root
+
+
+def get_backend() -> str:
+    """The vfs backend in use, falling back to disk if memory is not available."""
+    backend = config.VFS_BACKEND
+    if backend == MEMORY and not memory_backend_available():
+        logger.warning(
+            f"vfs backend {MEMORY!r} requested, but {SHM_ROOT} is not available: "
+            f"falling back to {DISK!r}"
+        )
+        return DISK
+    if backend not in (DISK, MEMORY):
+        logger.warning(f"unknown vfs backend {backend!r}: falling back to {DISK!r}")
+        return DISK
+    return backend
+
+
+def get_vfs_parent_dir() -> typing.Optional[Path]:
+    """Directory in which to create vfs roots; None means the system default tempdir."""
+    if get_backend() == MEMORY:
+        return _get_memory_root()
+    return None
+
+
+def make_vfs_root(prefix: str = "theatre-vfs-") -> str:
+    """Create a fresh root directory for the simulated filesystems of a node."""
+    root = tempfile.mkdtemp(prefix=prefix, dir=get_vfs_parent_dir())
+    _roots.add(root)
+    return root
+
+
+def remove_vfs_root(root: str):
+    """Delete a root made by make_vfs_root, and everything in it."""
+    _roots.discard(root)
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def _copy_counting(src: str, dst: str, *, follow_symlinks: bool = True):
+    VFS_COPIED_BYTES.inc(os.path.getsize(src))
+    return shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+
+
+def copy_tree(src: typing.Union[str, Path], dst: typing.Union[str, Path]):
+    """shutil.copytree into an existing dst, counting the bytes copied."""
+    shutil.copytree(src, dst, copy_function=_copy_counting, dirs_exist_ok=True)
+
+
+def disk_usage() -> int:
+    """Bytes in all files under the vfs roots made by this process."""
+    total = 0
+    for root in list(_roots):
+        for entry in _walk(Path(root)):
+            try:
+                total += entry.stat(follow_symlinks=False).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+@dataclass(frozen=True)
+class FileEntry:
+    """Manifest entry for a file in a simulated filesystem."""
+
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+Manifest = typing.Dict[str, FileEntry]
+"""Mapping from '<container>/<mount>/<relative path>' to file entries."""
+
+
+@dataclass(frozen=True)
+class ManifestDiff:
+    """Files added, removed and modified between two manifests."""
+
+    added: typing.Tuple[str, ...] = ()
+    removed: typing.Tuple[str, ...] = ()
+    modified: typing.Tuple[str, ...] = ()
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+
+def get_mount_roots(state: "State") -> typing.Dict[str, Path]:
+    """Mapping from '<container>/<mount>' to the directory backing that mount."""
+    return {
+        f"{container.name}/{name}": Path(mount.src)
+        for container in state.containers
+        for name, mount in container.mounts.items()
+    }
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _walk(root: Path) -> typing.Iterator[os.DirEntry]:
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def build_manifest(
+    roots: typing.Dict[str, Path],
+    previous: typing.Optional[Manifest] = None,
+    max_workers: typing.Optional[int] = None,
+) -> Manifest:
+    """Build a manifest of all files under these mount roots.
+
+    Files whose size and mtime match their entry in ``previous`` (typically, the
+    manifest of the parent node, from which the mounts were copied with their
+    metadata preserved) are not read again: only new or changed files are hashed,
+    in parallel.
+    """
+    previous = previous or {}
+    manifest: Manifest = {}
+    to_hash: typing.List[typing.Tuple[str, Path, os.stat_result]] = []
+
+    for prefix, root in roots.items():
+        for entry in _walk(root):
+            key = f"{prefix}/{Path(entry.path).relative_to(root).as_posix()}"
+            stat = entry.stat(follow_symlinks=False)
+            old = previous.get(key)
+            if old and old.size == stat.st_size and old.mtime_ns == stat.st_mtime_ns:
+                manifest[key] = old
+            else:
+                to_hash.append((key, Path(entry.path), stat))
+
+    if len(to_hash) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            digests = executor.map(_hash_file, (path for _, path, _ in to_hash))
+    else:
+        digests = map(_hash_file, (path for _, path, _ in to_hash))
+
+    for (key, _, stat), digest in zip(to_hash, digests):
+        manifest[key] = FileEntry(stat.st_size, stat.st_mtime_ns, digest)
+    return manifest
+
+
+def diff_manifests(old: Manifest, new: Manifest) -> ManifestDiff:
+    """Compare two manifests."""
+    added = tuple(sorted(new.keys() - old.keys()))
+    removed = tuple(sorted(old.keys() - new.keys()))
+    modified = tuple(
+        sorted(
+            key for key in new.keys() & old.keys() if new[key].digest != old[key].digest
+        )
+    )
+    return ManifestDiff(added, removed, modified)
+
+
+def _sample_disk_usage():
+    VFS_DISK_BYTES.set(disk_usage())
+
+
+# walking the roots takes a while: not on every scrape
+REGISTRY.add_sampler(_sample_disk_usage)